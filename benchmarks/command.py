@@ -0,0 +1,49 @@
+'''
+Description: 500条命令时的命令匹配开销
+    对比每个匹配器各自取一次纯文本并检查开头(NoneBot按匹配器逐个检查规则的做法),
+    和process_event时沿前缀树走一遍, 每个匹配器只检查集合成员关系. 用法: python benchmarks/command.py [次数]
+'''
+import sys
+import timeit
+
+from nonebot.adapters.opqbot.message import MessageChain, MessageSegment
+from nonebot.adapters.opqbot.rule import CommandTrie
+
+COMMANDS = [f'cmd{n}' for n in range(500)]
+START = ('/', '')
+
+
+def check(text: str, prefixes) -> bool:
+    for prefix in prefixes:
+        if text.startswith(prefix) and (len(text) == len(prefix) or text[len(prefix)].isspace()):
+            return True
+    return False
+
+
+def main(number: int):
+    trie = CommandTrie(START)
+    for cmd in COMMANDS:
+        trie.add(cmd)
+    prefixes = [tuple(start + cmd for start in START) for cmd in COMMANDS]
+    rule_sets = [frozenset((cmd,)) for cmd in COMMANDS]
+    for text in ('/cmd250 some arguments', 'just chatting, no command here'):
+        chain = MessageChain([MessageSegment.plain(text), MessageSegment.at(10000)])
+
+        def linear() -> int:
+            # 每个匹配器都重新取一次纯文本, 再检查开头和命令之后的空白
+            return sum(check(chain.extract_plain_text(), prefix) for prefix in prefixes)
+
+        def indexed() -> int:
+            candidates = trie.match(chain.extract_plain_text())
+            return sum(not commands.isdisjoint(candidates) for commands in rule_sets)
+
+        assert linear() == indexed()
+        print(text)
+        for name, func in (('linear', linear), ('trie', indexed),
+                           ('trie match only', lambda: trie.match(chain.extract_plain_text()))):
+            seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+            print(f'  {name:>15}: {seconds * 1e6:.1f}µs per message')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,36 @@
+'''
+Description: 发件箱吞吐量
+    用一个什么都不做的Bot并发发送消息, 测量写入, 发送, 标记完成整个流程每秒能处理多少条消息.
+    数据库放在当前目录, 结果取决于磁盘的fsync速度, 用法: python benchmarks/outbox.py [消息数]
+'''
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+from nonebot.adapters.opqbot.outbox import Outbox
+
+
+class NullBot:
+    self_id = '10000'
+
+    async def call_api(self, api, **data):
+        return None
+
+
+async def main(count: int):
+    with tempfile.TemporaryDirectory(dir='.') as directory:
+        outbox = Outbox(os.path.join(directory, 'outbox.db'))
+        bot = NullBot()
+        await outbox.start(lambda self_id: bot)
+        begin = time.perf_counter()
+        await asyncio.gather(*(outbox.send(bot, 'v1/LuaApiCaller', {'n': n}) for n in range(count)))
+        seconds = time.perf_counter() - begin
+        await outbox.close()
+    print(f'{count} messages in {seconds:.3f}s, {count / seconds:.0f} msgs/s, '
+          f'delivered={outbox.stats["delivered"]} pending={outbox.pending}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
@@ -0,0 +1,43 @@
+'''
+Description: 请求目标的准备开销
+    对比每次调用都拼接URL, 重建查询参数并构造URL对象的旧做法, 和从端点取缓存的请求目标.
+    两种做法最后都构造同样的Request, 用法: python benchmarks/route.py [次数]
+'''
+import sys
+import timeit
+
+from nonebot.drivers import URL, Request
+
+from nonebot.adapters.opqbot.endpoint import DEFAULT_HEADERS, Endpoint
+
+API = 'v1/LuaApiCaller'
+QQ = '10000'
+BODY = '{"CgiCmd": "MessageSvc.PbSendMsg", "CgiRequest": {"ToUin": 100000, "ToType": 2, "Content": "hello"}}'
+
+
+def per_call(protocol: str = 'http', host: str = '127.0.0.1', port: int = 8086, timeout: int = 10) -> Request:
+    params = {'funcname': 'MagicCgiCmd', 'timeout': timeout, 'qq': QQ}
+    url = URL(f'{protocol}://{host}:{port}/{API}').with_query(params)
+    return Request('POST', url=url, headers={'Content-Type': 'application/json'}, content=BODY, timeout=timeout)
+
+
+endpoint = Endpoint('127.0.0.1', 8086)
+query = (('funcname', 'MagicCgiCmd'), ('timeout', '10'), ('qq', QQ))
+
+
+def cached() -> Request:
+    route = endpoint.route(API, query)
+    return Request('POST', url=route.url, headers=route.headers, content=BODY, timeout=10)
+
+
+def main(number: int):
+    assert str(per_call().url) == str(cached().url)
+    assert per_call().headers == cached().headers == DEFAULT_HEADERS
+    for name, func in (('per call', per_call), ('cached route', cached), ('route lookup only',
+                                                                          lambda: endpoint.route(API, query))):
+        seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+        print(f'{name:>18}: {seconds * 1e6:.2f}µs')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
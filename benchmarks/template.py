@@ -0,0 +1,37 @@
+'''
+Description: utils.format的开销
+    对比原来每次调用都编译正则并用str.format填充的实现, 和compile_template缓存编译结果后只拼接字符串的实现.
+    用法: python benchmarks/template.py [次数]
+'''
+import re
+import sys
+import timeit
+
+from nonebot.adapters.opqbot.utils import format
+from nonebot.adapters.opqbot.endpoint import API_URL
+
+CASES = [
+    (API_URL, {'base_url': 'http://127.0.0.1:8086', 'api': 'v1/LuaApiCaller'}),
+    ('ab{cd}efgh{i}jk', {'cd': '233', 'fg': 'emmm'}),
+]
+
+
+def legacy_format(String: str, Env: dict) -> str:
+    FetchRequestField = re.compile(r'\{([a-z_][a-z0-9_]*)\}', re.I)
+    PushField = {}
+    for RequestField in FetchRequestField.findall(String):
+        PushField[RequestField] = '{' + f'{RequestField}' + '}' if RequestField not in Env else Env[RequestField]
+    return String.format(**PushField)
+
+
+def main(number: int):
+    for String, Env in CASES:
+        assert legacy_format(String, Env) == format(String, Env)
+        print(String)
+        for name, func in (('legacy', legacy_format), ('compiled', format)):
+            seconds = min(timeit.repeat(lambda: func(String, Env), number=number, repeat=5)) / number
+            print(f'  {name:>8}: {seconds * 1e6:.2f}µs per call')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
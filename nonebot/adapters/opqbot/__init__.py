@@ -2,6 +2,8 @@ from .bot import Bot
 from .event import Event, MessageEvent, ON_EVENT_GROUP_NEW_MSG, ON_EVENT_FRIEND_NEW_MSG, TempMessage # noqa
 from .adapter import Adapter
 from .message import MessageChain, MessageSegment, MessageType
+from .rule import CommandTrie, trie_command, not_flooded
+from .deadline import deadline
 from .permission import (
     UserPermission,
     GROUP_MEMBER,
@@ -16,5 +18,6 @@ __all__ = [
     "Bot", "Event", "Adapter", "MessageChain", "MessageSegment", "MessageType"
     "MessageEvent", "ON_EVENT_GROUP_NEW_MSG", "ON_EVENT_FRIEND_NEW_MSG", "TempMessage",
     "UserPermission", "GROUP_MEMBER", "GROUP_ADMIN", "GROUP_ADMINS",
-    "GROUP_OWNER", "GROUP_OWNER_SUPERUSER", "SUPERUSER"
+    "GROUP_OWNER", "GROUP_OWNER_SUPERUSER", "SUPERUSER",
+    "CommandTrie", "trie_command", "not_flooded", "deadline"
 ]
@@ -1,12 +1,15 @@
+import os
 import json
+import time
 import asyncio
 import contextlib
-from typing import Any, Dict, List, Optional, Literal, cast
+import contextvars
+from typing import Any, Callable, Dict, List, Optional, Literal, Set, Tuple, cast
 
 from nonebot.typing import overrides
 from nonebot.utils import escape_tag
 from nonebot.adapters import Adapter as BaseAdapter
-from nonebot.exception import ActionFailed, WebSocketClosed
+from nonebot.exception import WebSocketClosed
 from nonebot.drivers import (
     URL,
     Driver,
@@ -15,21 +18,42 @@ from nonebot.drivers import (
     WebSocket,
     ReverseDriver,
     ForwardDriver,
+    HTTPServerSetup,
     WebSocketServerSetup
 )
 
 from . import log
 from .bot import Bot
+from .cache import GroupCache
 from .config import Config
+from .history import MessageHistory, SessionKey, session_of
+from .gap import Gap, GapTracker
+from .outbox import Outbox
+from .outgoing import Coalescer
+from .api import API_TABLE, ApiSpec
+from .exception import ApiNotAvailable, NetworkError
+from .endpoint import Endpoint, Query, rank
+from .deadline import remaining, set_deadline
+from .breaker import STATE_VALUES, CircuitBreaker
+from .offload import Offloader
+from .lag import LagMonitor
+from .flood import FloodControl
+from .metrics import Metrics, NullMetrics
+from .profiler import StageProfiler
+from .trace import Tracer, current_trace
+from .jsonl import LineWriter
+from .rule import CommandTrie, command_trie
 from .event import Event
+from .event.fast import fast_new
 from .utils import (
-    SyncIDStore,
+    EventDeduplicator,
     process_event,
     snake_to_camel,
     OPQBotDataclassEncoder,
     Message_OPQBot_to_mirai
 )
 
+
 class Adapter(BaseAdapter):
     """
     继承后必须实现__init__和get_name还有_call_api方法
@@ -39,10 +63,108 @@ class Adapter(BaseAdapter):
         super().__init__(driver, **kwargs)
         # 初始化配置类里的信息
         self.opqbot_config: Config = Config(**self.config.dict())
-        # 多Q兼容的缓存列表, 用KV存一下QQ号对应的连接信息
-        self.connections: Dict[str, WebSocket] = {}
+        # 多Q兼容的缓存列表, 用KV存一下QQ号对应的连接信息, 为了高可用一个QQ可以有多条连接
+        self.connections: Dict[str, List[WebSocket]] = {}
+        # 可用的OPQ端点, 第一个是opqbot_host:opqbot_port
+        self.endpoints: List[Endpoint] = [
+            Endpoint(
+                str(self.opqbot_config.opqbot_host),
+                int(self.opqbot_config.opqbot_port or 0),
+                str(self.opqbot_config.opqbot_api_protocol)
+            ),
+            *(Endpoint.parse(address, str(self.opqbot_config.opqbot_api_protocol))
+                for address in self.opqbot_config.opqbot_endpoints or [])
+        ]
+        # 事件循环延迟监控, 过载时丢弃低优先级事件
+        self.lag_monitor = LagMonitor(
+            interval=self.opqbot_config.opqbot_lag_interval or 0,
+            threshold=(self.opqbot_config.opqbot_lag_threshold or 0) / 1000
+        )
+        # 入站消息的刷屏限流
+        self.flood_control = FloodControl(
+            user_rate=self.opqbot_config.opqbot_flood_user_rate or 0,
+            user_burst=self.opqbot_config.opqbot_flood_user_burst or 0,
+            group_rate=self.opqbot_config.opqbot_flood_group_rate or 0,
+            group_burst=self.opqbot_config.opqbot_flood_group_burst or 0,
+            action=self.opqbot_config.opqbot_flood_action or 'drop',
+            max_keys=self.opqbot_config.opqbot_flood_max_keys or 10000
+        )
+        # 读取和编码图片, 序列化大请求体这类会卡住事件循环的工作在这里执行
+        self.offloader = Offloader(
+            workers=self.opqbot_config.opqbot_workers or 0,
+            queue_size=self.opqbot_config.opqbot_worker_queue or 0
+        )
+        # 每个端点和账号的熔断器, 键为 (端点名, QQ号), 插件可以从这里查看熔断状态
+        self.breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        # API调用的查询参数, 按OPQ超时秒数缓存
+        self._api_queries: Dict[int, Query] = {}
         # 监听任务列表, 等下给多Q用的, 单Q环境基本上就一个
         self.tasks: List["asyncio.Task"] = []
+        # 群与群成员信息缓存, 权限检查从这里取数据
+        self.group_cache = GroupCache(ttl=self.opqbot_config.opqbot_cache_ttl or 0)
+        # 各会话最近的消息, 用于构造引用回复和查询被撤回的消息
+        self.message_history = MessageHistory(
+            size=self.opqbot_config.opqbot_history_size or 0,
+            max_sessions=self.opqbot_config.opqbot_history_sessions or 0
+        )
+        # 重连或多连接时OPQ可能重复推送同一条消息, 在这里过滤掉
+        self.deduplicator = EventDeduplicator(
+            window=self.opqbot_config.opqbot_dedup_window or 0,
+            size=self.opqbot_config.opqbot_dedup_size or 0
+        )
+        # 运行指标, 没启用时是一个什么都不做的替身
+        self.metrics: Metrics = Metrics() if self.opqbot_config.opqbot_metrics else NullMetrics()
+        self.metrics.add_collector(self._collect_metrics)
+        # 定时接收指标的回调, 插件可以往里面加自己的上报函数
+        self.metrics_sinks: List[Callable[[Metrics], Any]] = []
+        # 分阶段耗时分析, 按采样率挑选事件
+        self.profiler = StageProfiler(
+            enabled=bool(self.opqbot_config.opqbot_profile),
+            sample_rate=self.opqbot_config.opqbot_profile_rate or 0,
+            top_n=self.opqbot_config.opqbot_profile_top or 0
+        )
+        # 端到端延迟追踪
+        self.tracer = Tracer(
+            enabled=bool(self.opqbot_config.opqbot_trace),
+            threshold=self.opqbot_config.opqbot_trace_threshold or 0,
+            sample_rate=self.opqbot_config.opqbot_trace_rate or 0,
+            path=self.opqbot_config.opqbot_trace_path
+        )
+        # 命令前缀索引, 由rule.trie_command注册命令
+        self.command_trie: CommandTrie = command_trie
+        command_trie.command_start = tuple(self.config.command_start)
+        # 消息缺口检测, 设置gap_tracker.fetcher后会自动补齐
+        self.gap_tracker = GapTracker(
+            max_age=self.opqbot_config.opqbot_backfill_max_age or 0,
+            max_count=self.opqbot_config.opqbot_backfill_max_count or 0,
+            min_interval=self.opqbot_config.opqbot_backfill_interval or 0,
+            concurrency=self.opqbot_config.opqbot_backfill_concurrency or 0
+        )
+        # 持久化的发件箱, 没有配置路径时不启用
+        self.outbox: Optional[Outbox] = None
+        if self.opqbot_config.opqbot_outbox_path:
+            self.outbox = Outbox(
+                self.opqbot_config.opqbot_outbox_path,
+                ttl=self.opqbot_config.opqbot_outbox_ttl or 0,
+                max_backoff=self.opqbot_config.opqbot_outbox_max_backoff or 0
+            )
+        # 合并短时间内发往同一目标的消息
+        self.coalescer = Coalescer(
+            window=self.opqbot_config.opqbot_coalesce_window or 0,
+            max_length=self.opqbot_config.opqbot_max_message_length or 0
+        )
+        # 关闭时置为False, 之后收到的帧不再派发
+        self.accepting = True
+        # 已经派发但还没处理完的事件任务, 以及正在进行的API调用
+        self._event_tasks: Set["asyncio.Task"] = set()
+        self._api_tasks: Set["asyncio.Task"] = set()
+        # 还没进入process_event的事件任务 -> 原始事件帧, 关闭时用来保存没来得及派发的事件
+        self._undispatched: Dict["asyncio.Task", Dict[str, Any]] = {}
+        # 关闭时保存事件帧的文件, 在后台线程中批量写入
+        spool_path = self.opqbot_config.opqbot_spool_path
+        self._spool_writer = LineWriter(spool_path) if spool_path else None
+        # 正在补齐缺口的会话, 补齐结束时置位, 同一会话的实时事件在此之前不派发
+        self._backfilling: Dict[SessionKey, asyncio.Event] = {}
         self.setup()
 
     @classmethod
@@ -61,7 +183,25 @@ class Adapter(BaseAdapter):
                     URL(f'/{self.opqbot_config.opqbot_mountpoint}'), self.get_name(), self._handle_ws_server
                 )
             )
-            
+            if self.metrics.enabled and self.opqbot_config.opqbot_metrics_path:
+                self.setup_http_server(
+                    HTTPServerSetup(
+                        URL(f'/{self.opqbot_config.opqbot_metrics_path}'), 'GET', self.get_name(), self._handle_metrics
+                    )
+                )
+            if self.profiler.enabled and self.opqbot_config.opqbot_profile_path:
+                self.setup_http_server(
+                    HTTPServerSetup(
+                        URL(f'/{self.opqbot_config.opqbot_profile_path}'), 'GET', self.get_name(), self._handle_profile
+                    )
+                )
+        if self.metrics.enabled and self.opqbot_config.opqbot_metrics_interval:
+            self.driver.on_startup(self._start_metrics_push)
+        if self.outbox is not None:
+            self.driver.on_startup(self._start_outbox)
+        if self.lag_monitor.interval:
+            self.driver.on_startup(self._start_lag_monitor)
+
         # 加载正向ws的配置
         if isinstance(self.driver, ForwardDriver) and self.opqbot_config.opqbot_forward:
             # 别忘记校验数据
@@ -77,7 +217,8 @@ class Adapter(BaseAdapter):
             ]):
                 raise ValueError("请检查环境变量中的 opqbot_host, opqbot_port, opqbot_mountpoint, opqbot_qq 是否异常")
             self.driver.on_startup(self._start_ws_client)
-            self.driver.on_shutdown(self._stop_ws_client)
+        # 关闭流程统一在这里处理, 先等待在途的事件与请求, 再断开连接
+        self.driver.on_shutdown(self._shutdown)
 
     async def _handle_ws_server(self, websocket: WebSocket):
         """在这里处理WS发来的事件
@@ -90,42 +231,157 @@ class Adapter(BaseAdapter):
         # 这里传入前检查过了(在Config里)
         qqid = self.opqbot_config.opqbot_qq
 
-        bot = Bot(self, qqid)
-        self.bot_connect(bot)
-        self.connections[qqid] = websocket
-        log.info(f"({bot.self_id}) connection ...")
-
-        # 事件等待回环
+        # 事件等待回环, 登记连接也放在里面, 出错时一定会注销
         try:
+            bot = self._attach(qqid, websocket)
             while True:
                 data = await websocket.receive()
-                json_data = json.loads(data)
+                json_data = self._decode_frame(data)
                 if json_data.get("data"):
                     self._event_handle(bot, json_data)
         except WebSocketClosed as e:
-            qqid = ", ".join(self.connections)
             log.warning(f"WebSocket for Bot {escape_tag(qqid)} closed by peer")
         except Exception as e:
             log.error(f"<r><bg #f8bbd0>Error while process data from websocket "
-                f"for bot {escape_tag(bot.self_id)}.</bg #f8bbd0></r>", e)
+                f"for bot {escape_tag(qqid)}.</bg #f8bbd0></r>", e)
         finally:
             with contextlib.suppress(Exception):
                 await websocket.close()
-            self.connections.pop(qqid, None)
-            self.bot_disconnect(bot=bot)
-    
+            self._detach(qqid, websocket)
+
+    def _attach(self, qq: str, ws: WebSocket) -> Bot:
+        """登记一条连接, 这个QQ的第一条连接建立时触发连接事件
+
+        Args:
+            qq (str): 连接所属的QQ号
+            ws (WebSocket): 新建立的连接
+
+        Returns:
+            Bot: 这个QQ对应的Bot, 多条连接共用同一个
+        """
+        self.connections.setdefault(qq, []).append(ws)
+        bot = cast(Optional[Bot], self.bots.get(qq))
+        if bot is None:
+            bot = Bot(self, qq)
+            # 触发一下连接事件
+            self.bot_connect(bot)
+            log.info(f"<y>Bot {escape_tag(qq)}</y> connected")
+            self._warmup_cache(bot)
+            # 读文件在后台进行, 出错也不影响这条连接
+            self.tasks.append(asyncio.create_task(self._replay_spool(bot)))
+        return bot
+
+    def _detach(self, qq: str, ws: WebSocket):
+        """注销一条连接, 这个QQ的最后一条连接断开时触发断开事件"""
+        connections = self.connections.get(qq, [])
+        if ws in connections:
+            connections.remove(ws)
+        if not connections:
+            self.connections.pop(qq, None)
+            bot = self.bots.get(qq)
+            if bot is not None:
+                self.bot_disconnect(bot)
+
     async def _start_ws_client(self):
         # 校验一下数据更加安全, 但我建议别这么干, 因为浪费性能, 这里用到的数据在setup中已经校验过了
         # 所以我在这儿忽视Pylance的报告, 下面同理
         qq: str = self.opqbot_config.opqbot_qq
+        for endpoint in self.endpoints:
+            try:
+                ws_url = URL(endpoint.ws_url(str(self.opqbot_config.opqbot_mountpoint)))
+            except Exception as e:
+                log.error(f"<r><bg #f8bbd0>Bad url {escape_tag(endpoint.name)} "
+                    "in opqbot forward websocket config</bg #f8bbd0></r>",
+                    e)
+                continue
+            # 异步拉起监听任务避免堵塞, 每个端点可以有多条连接
+            for _ in range(self.opqbot_config.opqbot_connections_per_endpoint or 1):
+                self.tasks.append(asyncio.create_task(self._ws_client(qq, ws_url, endpoint)))
+
+    async def _shutdown(self):
+        """优雅关闭: 停止派发新事件, 在期限内等待在途的事件与API调用完成,
+        超时后取消剩余任务, 并按配置保存还没派发的事件帧
+        """
+        self.accepting = False
+        # 限流暂存的事件还没派发, 和其他没派发的事件一起保存
+        held = self.flood_control.clear()
+        timeout = self.opqbot_config.opqbot_shutdown_timeout or 0
+        # 合并窗口里攒下的消息现在就发出去, 和其他在途任务一起等待
+        tasks = self._event_tasks | self._api_tasks | self.coalescer.close()
+        if tasks:
+            log.info(f"Waiting up to {timeout}s for {len(tasks)} in-flight tasks")
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            if pending:
+                log.warning(f"{len(pending)} tasks did not finish in time, cancelling")
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        frames = [*held, *self._undispatched.values()]
+        self._undispatched.clear()
+        if frames:
+            self._spool(frames)
+        if self.outbox is not None:
+            await self.outbox.close()
+        self.offloader.shutdown()
+        await self._stop_ws_client()
+        if self._spool_writer is not None:
+            await self._spool_writer.close()
+        await self.tracer.close()
+
+    async def _start_outbox(self):
+        await self.outbox.start(lambda self_id: cast(Optional[Bot], self.bots.get(self_id)))  # type: ignore
+
+    def _spool(self, frames: List[Dict[str, Any]]):
+        """把事件帧追加保存到磁盘, 没有配置路径时直接丢弃"""
+        if self._spool_writer is None:
+            log.warning(f"Dropped {len(frames)} undispatched events")
+            return
+        # 在后台线程里批量写入, 关闭时由_shutdown等待写完
+        for frame in frames:
+            self._spool_writer.write(frame)
+        log.info(f"Saving {len(frames)} undispatched events to {escape_tag(self._spool_writer.path)}")
+
+    async def _replay_spool(self, bot: Bot):
+        """重放上次关闭时保存的事件帧, 文件在线程池中读取, 读完就删除"""
+        path = self.opqbot_config.opqbot_spool_path
+        if not path:
+            return
         try:
-            ws_url = URL(f"ws://{self.opqbot_config.opqbot_host}:{self.opqbot_config.opqbot_port}/{self.opqbot_config.opqbot_mountpoint}")
-            # 异步拉起一个监听任务避免堵塞
-            self.tasks.append(asyncio.create_task(self._ws_client(qq, ws_url)))
-        except Exception as e:
-            log.error(f"<r><bg #f8bbd0>Bad url {escape_tag(str(ws_url))} "
-                "in opqbot forward websocket config</bg #f8bbd0></r>",
-                e)
+            frames, broken = await self.offloader.run(self._read_spool, path)
+        except OSError as e:
+            log.error(f"Failed to read events saved at last shutdown from {escape_tag(path)}", e)
+            return
+        if broken:
+            log.warning(f"Skipped {broken} corrupt lines in {escape_tag(path)}")
+        if frames:
+            log.info(f"Replaying {len(frames)} events saved at last shutdown")
+            self._dispatch_frames(bot, frames)
+
+    @staticmethod
+    def _read_spool(path: str) -> Tuple[List[Dict[str, Any]], int]:
+        """读出并删除保存的事件帧
+
+        Returns:
+            Tuple[List[Dict[str, Any]], int]: 事件帧与损坏的行数
+        """
+        if not os.path.exists(path):
+            return [], 0
+        # 先改名再读取, 避免重放的过程中再次关闭时写进同一个文件
+        replaying = f'{path}.replay'
+        os.replace(path, replaying)
+        frames: List[Dict[str, Any]] = []
+        broken = 0
+        with open(replaying, 'rb') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    frames.append(json.loads(line))
+                except ValueError:
+                    # JSONDecodeError和UnicodeDecodeError都是ValueError, 写了一半的行或者损坏的字节都跳过
+                    broken += 1
+        os.remove(replaying)
+        return frames, broken
 
     async def _stop_ws_client(self):
         # 关闭ws的时候记得删掉任务
@@ -133,35 +389,50 @@ class Adapter(BaseAdapter):
             if not task.done():
                 task.cancel()
 
-    async def _ws_client(self, qq: str, url: URL):
+    async def _ws_client(self, qq: str, url: URL, endpoint: Endpoint):
         """进入WS客户端
 
         Args:
             qq (str): 需要响应的QQ号
             url (URL): 要监听的URL
+            endpoint (Endpoint): 这条连接所属的端点
         """
         headers = {"qq": qq}
-        request = Request("GET", url=url, headers=headers, timeout=3)
+        mountpoint = str(self.opqbot_config.opqbot_mountpoint)
+        address = endpoint.ws_url(mountpoint)
+        request = Request("GET", url=url, headers=headers, timeout=self.opqbot_config.opqbot_connect_timeout)
+        idle_timeout = self.opqbot_config.opqbot_ws_idle_timeout
         # 进入监听回环, 不抛异常不出来
         while True:
+            if endpoint.ws_url(mountpoint) != address:
+                # 端点地址被Endpoint.update修改过, 重连到新地址
+                address = endpoint.ws_url(mountpoint)
+                url = URL(address)
+                request = Request("GET", url=url, headers=headers, timeout=self.opqbot_config.opqbot_connect_timeout)
+            # 连接被判定为失效时跳过等待立即重连
+            stale = False
             try:
                 async with self.websocket(request) as ws:
                     log.debug(f"WebSocket Connection to {escape_tag(str(url))} established")
+                    # 这里拿到一下Bot, 等下推消息回去好推, 同一个QQ的多条连接共用一个Bot
+                    endpoint.connections += 1
+                    heartbeat: Optional["asyncio.Task[bool]"] = None
                     try:
-                        bot = Bot(self, qq)
-                        # 这里拿到一下Bot, 等下推消息回去好推
-                        # 把连接信息塞进去
-                        self.connections[qq] = ws
-                        # 触发一下连接事件
-                        self.bot_connect(bot)
-                        log.info(f"<y>Bot {escape_tag(qq)}</y> connected")
-
+                        # 登记连接放在try里, 出错时finally一定会注销它
+                        bot = self._attach(qq, ws)
+                        heartbeat = asyncio.create_task(self._heartbeat(qq, ws, endpoint))
                         while True:
                             # 等待事件传过来, 收到消息再丢给_event_handle处理
-                            data = await ws.receive()
+                            if idle_timeout:
+                                data = await asyncio.wait_for(ws.receive(), idle_timeout)
+                            else:
+                                data = await ws.receive()
                             log.debug(f"$_ws_client@ Received data from: {data}")
-                            json_data = json.loads(data)
+                            json_data = self._decode_frame(data)
                             self._event_handle(bot, json_data)
+                    except asyncio.TimeoutError:
+                        stale = True
+                        log.warning(f"No data from {escape_tag(str(url))} in {idle_timeout}s, reconnecting")
                     except WebSocketClosed as e:
                         log.error("<r><bg #f8bbd0>WebSocket Closed</bg #f8bbd0></r>", e)
                     except Exception as e:
@@ -170,84 +441,497 @@ class Adapter(BaseAdapter):
                             e
                         )
                     finally:
-                        self.connections.pop(qq, None)
-                        # 照常忽略, 因为这里的值来源是new对象(谁家new对象new出None还不抛异常啊, 不用处理)
-                        self.bot_disconnect(bot)
+                        endpoint.connections -= 1
+                        self._detach(qq, ws)
+                        if heartbeat is not None:
+                            # 心跳判定连接失效时会返回True, 被取消或者出错时就当作没有判定
+                            heartbeat.cancel()
+                            with contextlib.suppress(asyncio.CancelledError, Exception):
+                                stale = await heartbeat or stale
             except Exception as e:
                 log.error("<r><bg #f8bbd0>Error while setup websocket to "
                     f"{escape_tag(str(url))}. Trying to reconnect...</bg #f8bbd0></r>",
                     e
                 )
-            await asyncio.sleep(3)
+            self.metrics.inc('reconnects', qq=qq)
+            if not stale:
+                await asyncio.sleep(3)
+
+    async def _heartbeat(self, qq: str, ws: WebSocket, endpoint: Endpoint) -> bool:
+        """定时探测连接是否还活着, 记录往返时间
+        连续失败达到次数上限时关闭ws, 让_ws_client立即重连
+
+        Args:
+            qq (str): 连接所属的QQ号
+            ws (WebSocket): 正在使用的连接
+            endpoint (Endpoint): 连接所属的端点
+
+        Returns:
+            bool: 因为探测失败而关闭了连接时为True
+        """
+        config = self.opqbot_config
+        if not config.opqbot_heartbeat_interval:
+            return False
+        misses = 0
+        while True:
+            await asyncio.sleep(config.opqbot_heartbeat_interval)
+            begin = time.perf_counter()
+            try:
+                await self._probe(qq, ws, endpoint)
+            except Exception as e:
+                misses += 1
+                self.metrics.inc('heartbeat_failures', endpoint=endpoint.name)
+                log.warning(f"Heartbeat of Bot {escape_tag(qq)} failed ({misses}/{config.opqbot_heartbeat_misses})", e)
+                if misses >= (config.opqbot_heartbeat_misses or 1):
+                    log.error(f"<r><bg #f8bbd0>Connection of Bot {escape_tag(qq)} is stale, reconnecting</bg #f8bbd0></r>")
+                    with contextlib.suppress(Exception):
+                        await ws.close()
+                    return True
+                continue
+            misses = 0
+            rtt = time.perf_counter() - begin
+            endpoint.rtt = rtt
+            self.metrics.set('rtt_seconds', rtt, endpoint=endpoint.name)
+            self.metrics.observe('heartbeat_seconds', rtt, endpoint=endpoint.name)
+
+    async def _probe(self, qq: str, ws: WebSocket, endpoint: Endpoint):
+        """探测一次连接, 失败时抛出异常
+        优先在这条ws上发送ping并等待pong, 这样才能发现半开的连接;
+        驱动器不支持等待pong时(比如aiohttp), 退回到请求OPQ的clusterinfo接口
+        """
+        config = self.opqbot_config
+        timeout = config.opqbot_heartbeat_timeout or None
+        ping = getattr(getattr(ws, 'websocket', None), 'ping', None)
+        if ping is not None:
+            pong = await asyncio.wait_for(ping(), timeout)
+            if pong is not None:
+                await asyncio.wait_for(pong, timeout)
+                return
+        # 每次都重新取请求目标, 端点地址更新后心跳也会跟着切换
+        request = Request(
+            "GET",
+            url=endpoint.route(str(config.opqbot_clusterinfo), (('qq', qq),)).url,
+            timeout=config.opqbot_heartbeat_timeout
+        )
+        response: Response = await self.driver.request(request)
+        if response.status_code != 200:
+            raise ValueError(f"HTTP {response.status_code}")
 
-    def _event_handle(self, bot: Bot, event: Dict):
+    async def _handle_metrics(self, request: Request) -> Response:
+        """以OpenMetrics文本格式导出运行指标"""
+        return Response(
+            200,
+            headers={'Content-Type': 'application/openmetrics-text; version=1.0.0; charset=utf-8'},
+            content=self.metrics.render()
+        )
+
+    async def _handle_profile(self, request: Request) -> Response:
+        """导出耗时分析结果, ``?format=collapsed`` 时为火焰图折叠栈格式, 否则为文本报告"""
+        if request.url.query.get('format') == 'collapsed':
+            content = self.profiler.dump_collapsed()
+        else:
+            content = self.profiler.report()
+        return Response(200, headers={'Content-Type': 'text/plain; charset=utf-8'}, content=content)
+
+    async def _start_lag_monitor(self):
+        task = self.lag_monitor.start()
+        if task is not None:
+            self.tasks.append(task)
+
+    async def _start_metrics_push(self):
+        self.tasks.append(asyncio.create_task(self._metrics_push()))
+
+    async def _metrics_push(self):
+        """定时把指标推送给所有回调"""
+        while True:
+            await asyncio.sleep(self.opqbot_config.opqbot_metrics_interval or 0)
+            for sink in self.metrics_sinks:
+                try:
+                    result = sink(self.metrics)
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception as e:
+                    log.error("Error while pushing metrics", e)
+
+    def _collect_metrics(self, metrics: Metrics):
+        """导出前刷新那些按需计算的仪表"""
+        metrics.set('connections', sum(map(len, self.connections.values())))
+        for endpoint in self.endpoints:
+            metrics.set('endpoint_connections', endpoint.connections, endpoint=endpoint.name)
+        for (name, qq), breaker in self.breakers.items():
+            metrics.set('breaker_state', STATE_VALUES[breaker.state], endpoint=name, qq=qq)
+            metrics.set('breaker_trips', breaker.trips, endpoint=name, qq=qq)
+        metrics.set('pending_events', len(self._event_tasks))
+        metrics.set('loop_lag_seconds', self.lag_monitor.lag)
+        metrics.set('loop_lag_max_seconds', self.lag_monitor.max_lag)
+        metrics.set('shedding', int(self.lag_monitor.shedding))
+        if self.flood_control.enabled:
+            metrics.set('flood_keys', len(self.flood_control.users), scope='user')
+            metrics.set('flood_keys', len(self.flood_control.groups), scope='group')
+            metrics.set('flood_held', self.flood_control.held)
+        metrics.set('offload_pending', self.offloader.pending)
+        for name, value in self.offloader.stats.items():
+            metrics.set(f'offload_{name}', value)
+        metrics.set('dedup_hits', self.deduplicator.hits)
+        for name, value in self.coalescer.stats.items():
+            metrics.set('outgoing_messages', value, state=name)
+        if self.outbox is not None:
+            metrics.set('outbox_pending', self.outbox.pending)
+            for name, value in self.outbox.stats.items():
+                metrics.set('outbox_messages', value, state=name)
+
+    def _decode_frame(self, data: Any) -> Dict[str, Any]:
+        """解码ws收到的一帧数据"""
+        # 在这里决定是否对这一帧进行耗时分析, 并创建追踪上下文, 后续为它创建的任务都会继承它们
+        self.profiler.begin()
+        self.tracer.begin()
+        begin = time.perf_counter()
+        with self.profiler.stage('json.loads'), self.tracer.span('decode'):
+            json_data = json.loads(data)
+        if self.metrics.enabled:
+            self.metrics.observe('decode_seconds', time.perf_counter() - begin)
+        return json_data
+
+    def _event_done(self, task: "asyncio.Task"):
+        self._event_tasks.discard(task)
+        # 关闭期间被取消的任务要留着, 等待保存到磁盘
+        if self.accepting:
+            self._undispatched.pop(task, None)
+
+    def _warmup_cache(self, bot: Bot):
+        """按配置在后台预热群成员缓存, 不阻塞事件接收
+
+        Args:
+            bot (Bot): 刚连接上的Bot
+        """
+        if self.opqbot_config.opqbot_cache_warmup:
+            self.tasks.append(asyncio.create_task(self.group_cache.warmup(bot)))
+
+    def _event_handle(self, bot: Bot, event: Dict, backfilled: bool = False) -> Optional["asyncio.Task"]:
         """处理收到的事件
 
         Args:
             bot (Bot): Bot对象本身
             event (Dict): 事件源
+            backfilled (bool): 是否是补齐缺口拉取到的事件, 它们不等待所在会话的补齐完成
+
+        Returns:
+            Optional[asyncio.Task]: 派发事件的任务, 事件被丢弃或暂存时为None
         """
+        if not self.accepting:
+            # 正在关闭, 新收到的帧直接保存, 下次启动再处理
+            self._spool([event])
+            return None
+        metrics = self.metrics
+        event_name = event['CurrentPacket']['EventName']
+        # 在去重和丢弃之前计数, frames_received是实际收到的帧数
+        metrics.inc('frames_received', event=event_name)
+        if self.deduplicator.seen(bot.self_id, event_name, event['CurrentPacket']['EventData']):
+            log.debug(f"$_event_handle@ Drop duplicated event {event_name}")
+            return None
+        if self.lag_monitor.should_shed(event_name):
+            # 过载时在解析之前就丢掉低优先级的事件
+            metrics.inc('events_shed', event=event_name)
+            return None
+        profiler = self.profiler
+        profiler.rename(event_name)
+        trace = current_trace()
+        if trace is not None:
+            trace.event = event_name
+            parse_start = time.time_ns()
         # 处理事件, 将OPQBot格式的数据簇转为Mirai格式的消息列表
         MsgSegment: list = []
-        if event['CurrentPacket']['EventData']['MsgBody'] is not None:
-            MsgData = event['CurrentPacket']['EventData']['MsgBody']
-            MsgSegment = Message_OPQBot_to_mirai(MsgData)
-
-        event['CurrentPacket']['EventData']['MsgBody'] = MsgSegment
-        asyncio.create_task(process_event(
-            bot,
-            event=Event.new({
-                **event['CurrentPacket']['EventData'],
-                "type": event['CurrentPacket']['EventName'],
-                "self_id": bot.self_id,
-                "messageChain": MsgSegment
-            })
-        ))
+        MsgData = event['CurrentPacket']['EventData'].get('MsgBody')
+        if MsgData is not None:
+            with profiler.stage('Message_OPQBot_to_mirai'):
+                MsgSegment = Message_OPQBot_to_mirai(MsgData)
+
+        begin = time.perf_counter() if metrics.enabled else 0
+        # 消息链只通过messageChain传入一次, MsgBody是它的别名
+        event_data = {
+            **event['CurrentPacket']['EventData'],
+            "type": event_name,
+            "self_id": bot.self_id,
+            "messageChain": MsgSegment
+        }
+        # 原始帧要保持原样, 关闭时可能还要保存下来
+        event_data.pop('MsgBody', None)
+        with profiler.stage('Event.new'):
+            parsed_event = self._fast_new(event_data) or Event.new(event_data)
+        if metrics.enabled:
+            metrics.observe('event_parse_seconds', time.perf_counter() - begin, event=event_name)
+        if trace is not None:
+            parsed_event._trace = trace
+            trace.queued = time.time_ns()
+            trace.add_span('parse', parse_start, trace.queued)
+        # 先让缓存吃掉相关的通知事件, 这样后面的权限检查拿到的就是最新的数据
+        self.group_cache.update(parsed_event)
+        # 这里存的是转换后的原始消息段, 后面的process_*会修改消息链, 但不会改动它们
+        self.message_history.record(parsed_event, MsgSegment)
+        gap = self._observe_gap(parsed_event)
+        # 缓存, 历史和缺口检测都要看到每一条消息, 限流只决定是否交给匹配器
+        if self.flood_control.enabled and session_of(parsed_event) is not None \
+                and str(parsed_event.MsgHead.SenderUin) != bot.self_id:  # type: ignore
+            limited = self.flood_control.check(parsed_event)  # type: ignore
+            if limited is not None:
+                key, wait = limited
+                metrics.inc('events_limited', scope=key[0], action=self.flood_control.action)
+                if not self.flood_control.limit(
+                        parsed_event, key, wait, lambda held: self._schedule(bot, held), event):  # type: ignore
+                    return None
+        return self._schedule(bot, parsed_event, gap, event, backfilled)
+
+    def _schedule(self, bot: Bot, event: Event, gap: Optional[Gap] = None,
+                  frame: Optional[Dict] = None, backfilled: bool = False) -> Optional["asyncio.Task"]:
+        """创建派发事件的任务, frame是事件的原始帧, 关闭时还没派发的帧会被保存下来"""
+        if not self.accepting:
+            return None
+        task = asyncio.create_task(self._dispatch(bot, event, gap, backfilled))
+        self._event_tasks.add(task)
+        if frame is not None:
+            self._undispatched[task] = frame
+        task.add_done_callback(self._event_done)
+        return task
+
+    def _observe_gap(self, event: Event) -> Optional[Gap]:
+        """检查消息事件之前是否有丢失的消息"""
+        session = session_of(event)
+        if session is None:
+            return None
+        head = event.MsgHead  # type: ignore
+        gap = self.gap_tracker.observe(session, head.MsgSeq, head.MsgTime)
+        if gap is not None:
+            log.warning(f"Detected {gap.size} missing messages in {gap.session}")
+            self.metrics.inc('gaps', kind=gap.session[0])
+            self.metrics.inc('gap_messages', gap.size, kind=gap.session[0])
+        return gap
+
+    async def _dispatch(self, bot: Bot, event: Event, gap: Optional[Gap], backfilled: bool = False):
+        """派发一个事件, 如果它之前有消息缺口, 先补齐并处理完缺口中的消息;
+        补齐期间同一会话的其他事件要等补齐结束才能派发, 最多等待 ``opqbot_backfill_hold`` 秒
+        """
+        if not backfilled:
+            session = session_of(event)
+            hold = self._backfilling.get(session) if session is not None else None
+            if hold is not None:
+                await hold.wait()
+        if gap is not None and self.gap_tracker.should_backfill(gap):
+            hold = self._backfilling[gap.session] = asyncio.Event()
+            limit = self.opqbot_config.opqbot_backfill_hold or None
+            deadline_at = time.monotonic() + limit if limit else None
+            try:
+                try:
+                    frames = await asyncio.wait_for(self.gap_tracker.backfill(bot, gap), limit)
+                except asyncio.TimeoutError:
+                    log.warning(f"Backfill of {gap!r} took longer than {limit}s, releasing live events")
+                    frames = []
+                except Exception as e:
+                    log.warning(f"Failed to backfill {gap!r}", e)
+                    frames = []
+                # 补齐的事件有各自的追踪上下文, 在上下文的拷贝里派发, 避免覆盖当前事件的
+                tasks = contextvars.copy_context().run(self._dispatch_frames, bot, frames, True)
+                self.metrics.inc('backfilled', len(frames))
+                if tasks:
+                    # 处理得太慢时不再等待, 补齐的事件继续在后台处理
+                    timeout = max(deadline_at - time.monotonic(), 0) if deadline_at is not None else None
+                    await asyncio.wait(tasks, timeout=timeout)
+            finally:
+                if self._backfilling.get(gap.session) is hold:
+                    del self._backfilling[gap.session]
+                hold.set()
+        # 从这里开始事件就算派发出去了, 关闭时不再保存它
+        self._undispatched.pop(asyncio.current_task(), None)  # type: ignore
+        budget = self.opqbot_config.opqbot_event_deadline
+        if budget:
+            # 任务运行在自己的上下文里, 处理过程中的API调用和创建的任务都会继承这个期限
+            set_deadline(budget)
+        await process_event(bot, event=event)
+
+    def _dispatch_frames(self, bot: Bot, frames: List[Dict[str, Any]],
+                         backfilled: bool = False) -> List["asyncio.Task"]:
+        """派发补齐或者重放的事件帧, 每一帧都有自己的采样与追踪上下文, 返回派发事件的任务"""
+        tasks: List["asyncio.Task"] = []
+        for frame in frames:
+            self.profiler.begin()
+            self.tracer.begin()
+            try:
+                task = self._event_handle(bot, frame, backfilled)
+            except Exception as e:
+                log.error(f"Failed to dispatch frame {escape_tag(str(frame))}", e)
+                continue
+            if task is not None:
+                tasks.append(task)
+        return tasks
+
+    def _fast_new(self, event_data: Dict[str, Any]) -> Optional[Event]:
+        """按配置尝试快速解码高频事件, 失败时返回None交给Event.new处理"""
+        if not self.opqbot_config.opqbot_fast_decode:
+            return None
+        try:
+            return fast_new(event_data)
+        except (KeyError, TypeError, ValueError) as e:
+            log.debug(f"$_fast_new@ Fallback to Event.new: {e!r}")
+            return None
 
     @overrides(BaseAdapter)
     async def _call_api(self, bot: Bot, api: str,
         subcommand: Optional[Literal['get', 'update']] = None, **data: Any) -> Any:
+        """调用OPQ接口
+
+        传入 ``origin`` 时把它作为完整的请求体发往 ``api`` 路径, 返回原始响应;
+        否则按 ``API_TABLE`` 中的声明构造请求体, 返回解析后的响应
+        """
         log.debug(f'$_call_api@ api: {api}, data: {data}')
+        name = api
+        spec: Optional[ApiSpec] = None
         if 'origin' in data:
             body = data['origin']
         else:
-            # TODO: 不为origin信息, 就尝试识别api信息
-            body = {
-                "CgiCmd": "MessageSvc.PbSendMsg",
-                "CgiRequest": {
-                    "ToUin": 123456,
-                    "ToType": 2,
-                    "Content": "HelloWorld"
-                }
-            }
-        # 发送数据
-        ApiUrl: str = f'{self.opqbot_config.opqbot_api_protocol}://{self.opqbot_config.opqbot_host}:{self.opqbot_config.opqbot_port}/{api}'
-        log.debug(f'$_call_api@ ApiUrl: {ApiUrl}')
-        request = Request(
-            method="POST",  # 请求方法
-            url=ApiUrl,  # 接口地址
-            # headers={
-            #     'Content-Type': 'application/json'
-            # },
-            params={
-                'funcname': 'MagicCgiCmd',
-                'timeout': 10,
-                'qq': f'{self.opqbot_config.opqbot_qq}'
-            },
-            json=body
+            spec = API_TABLE.get(api)
+            if spec is None:
+                raise ApiNotAvailable(api)
+            body = spec.build(data)
+            api = spec.path
+        cmd = str(body.get('CgiCmd'))
+        # 超时时间: 调用时给出的 > 按API名称或CgiCmd配置的 > 默认的, 再受事件处理的剩余时间限制
+        config = self.opqbot_config
+        timeouts = config.opqbot_api_timeouts or {}
+        timeout = float(
+            data.get('timeout')
+            or timeouts.get(name, timeouts.get(cmd, config.opqbot_api_timeout or 0))
         )
-        result: Response = await self.driver.request(request)
-        # TODO: 处理返回结果识别错误情况打印日志
-        log.debug(f'$_call_api@ result: {result} -> {str(result.content, "utf-8")}')
-        # 发送请求，返回结果
-        return result
+        left = remaining()
+        if left is not None:
+            if left <= 0:
+                self.metrics.inc('api_deadline_exceeded', cmd=cmd)
+                raise NetworkError(f'{cmd} not sent, deadline exceeded')
+            timeout = min(timeout, left) if timeout else left
+        content = await self._encode_body(body)
+        # 请求在单独的任务里发送并登记下来, 关闭时只等待请求本身, 而不是发起调用的整个任务;
+        # 调用方被取消时, 等待中的请求任务也会一起被取消
+        task = asyncio.create_task(self._send_api_request(api, cmd, content, timeout))
+        self._api_tasks.add(task)
+        task.add_done_callback(self._api_tasks.discard)
+        result = await task
+        if spec is None:
+            return result
+        if result.status_code != 200:
+            raise NetworkError(f'{cmd} failed with HTTP {result.status_code}')
+        return spec.parse(result.content)  # type: ignore
 
-        result: Dict[str, Any] = await SyncIDStore.fetch_response(
-            sync_id, timeout=self.config.api_timeout)
+    def _breaker(self, endpoint: Endpoint, qq: str) -> CircuitBreaker:
+        """获取端点与账号对应的熔断器, 第一次使用时创建"""
+        key = (endpoint.name, qq)
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            config = self.opqbot_config
+            breaker = self.breakers[key] = CircuitBreaker(
+                failure_rate=config.opqbot_breaker_failure_rate or 0,
+                min_calls=config.opqbot_breaker_min_calls or 0,
+                window=config.opqbot_breaker_window or 0,
+                slow_call=config.opqbot_breaker_slow_call or 0,
+                open_seconds=config.opqbot_breaker_open_seconds or 0
+            )
+        return breaker
 
-        if ('data') not in result or (result['data']).get('code') not in (None, 0):
-            raise ActionFailed(
-                f'{self.get_name()} | {result.get("data") or result}'
+    def _api_query(self, timeout: float) -> Query:
+        """API调用的查询参数, OPQ的timeout参数以整秒计, 每个取值只准备一次"""
+        seconds = max(1, int(timeout)) if timeout else 10
+        query = self._api_queries.get(seconds)
+        if query is None:
+            query = self._api_queries[seconds] = (
+                ('funcname', 'MagicCgiCmd'),
+                ('timeout', str(seconds)),
+                ('qq', str(self.opqbot_config.opqbot_qq)),
             )
+        return query
 
-        return result['data']
+    async def _encode_body(self, body: Dict[str, Any]) -> str:
+        """序列化请求体, 带着大段数据(比如base64图片)的请求体在线程池中序列化"""
+        threshold = self.opqbot_config.opqbot_offload_json_size
+        request = body.get('CgiRequest')
+        if threshold and isinstance(request, dict) and sum(
+            len(value) for value in request.values() if isinstance(value, str)
+        ) >= threshold:
+            return await self.offloader.run(json.dumps, body)
+        with self.profiler.stage('json.dumps'):
+            return json.dumps(body)
+
+    async def _send_api_request(self, api: str, cmd: str, content: str, timeout: float) -> Response:
+        """把请求依次发往各个端点, 返回第一个成功的响应
+
+        Args:
+            api (str): 接口路径
+            cmd (str): CgiCmd, 用于日志和指标
+            content (str): 序列化后的请求体
+            timeout (float): 整个调用(包括换端点重试)的超时时间(秒), 为0时不限制,
+                每个端点最多用掉剩余时间除以剩余端点数, 除最后一个端点外还不超过 ``opqbot_api_attempt_timeout``
+        """
+        result: Optional[Response] = None
+        error: Optional[Exception] = None
+        query = self._api_query(timeout)
+        deadline_at = time.monotonic() + timeout if timeout else None
+        qq = str(self.opqbot_config.opqbot_qq)
+        endpoints = rank(self.endpoints)
+        attempt_cap = self.opqbot_config.opqbot_api_attempt_timeout or 0
+        # 发送数据, 按健康度依次尝试各个端点, 连接失败或超时时换下一个
+        for index, endpoint in enumerate(endpoints):
+            left = deadline_at - time.monotonic() if deadline_at is not None else None
+            if left is not None and left <= 0:
+                error = NetworkError(f'{cmd} timed out after {timeout}s')
+                break
+            # 剩余时间平分给还没尝试的端点, 第一个端点卡住时后面的端点仍然有机会, 最后一个端点拿到全部剩余时间
+            attempt = left / (len(endpoints) - index) if left is not None else None
+            if attempt_cap and index < len(endpoints) - 1:
+                # 连上了但卡住的端点不等到平分的时间用完, 尽快换下一个
+                attempt = min(attempt, attempt_cap) if attempt is not None else attempt_cap
+            breaker = self._breaker(endpoint, qq)
+            if not breaker.allow():
+                # 熔断器打开时直接跳过这个端点, 不再等待超时
+                self.metrics.inc('breaker_rejected', endpoint=endpoint.name)
+                error = error or NetworkError(f'Circuit breaker of {endpoint.name} is open')
+                continue
+            route = endpoint.route(api, query)
+            request = Request(
+                method="POST",  # 请求方法
+                url=route.url,  # 接口地址, 已经带上了查询参数
+                headers=route.headers,
+                content=content,
+                timeout=attempt
+            )
+            begin = time.perf_counter()
+            ok = cancelled = False
+            try:
+                with self.profiler.stage('_call_api'), self.tracer.span('http', cmd=cmd, endpoint=endpoint.name):
+                    # 超时后取消请求, 释放连接, 不让卡住的调用堆积
+                    result = await asyncio.wait_for(self.driver.request(request), attempt)
+                # 5xx说明OPQ自己出了问题, 也算作熔断器的失败
+                ok = result.status_code < 500
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = NetworkError(f'{cmd} timed out on {endpoint.name}')
+                endpoint.record_failure()
+                self.metrics.inc('api_errors', cmd=cmd)
+                log.warning(f'Failed to call {cmd} on {endpoint.name}, trying next endpoint', e)
+                error = e
+                continue
+            finally:
+                seconds = time.perf_counter() - begin
+                if cancelled:
+                    breaker.cancel()
+                else:
+                    breaker.record(ok, seconds)
+                self.metrics.observe('api_seconds', seconds, cmd=cmd)
+            endpoint.record_success()
+            break
+        if result is None:
+            raise error or ValueError("No OPQ endpoint available")
+        if result.status_code != 200:
+            self.metrics.inc('api_errors', cmd=cmd)
+        # TODO: 处理返回结果识别错误情况打印日志
+        log.debug(f'$_call_api@ result: {result} -> {str(result.content, "utf-8")}')
+        # 发送请求，返回结果
+        return result
@@ -0,0 +1,270 @@
+'''
+Description: OPQ接口表
+    把NoneBot风格的API名称(例如 ``send_group_message``)映射到OPQ的CgiCmd请求体,
+    请求模板在导入时预先编译为常量字段和需要填充的字段, 每次调用只填充字段, 不再重新构造整个请求体;
+    响应会被解析为对应的模型, CgiBaseResponse.Ret不为0时抛出ActionFailed
+'''
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from .exception import ActionFailed, ApiNotAvailable, NetworkError
+
+# OPQ的统一接口路径
+LUA_API = 'v1/LuaApiCaller'
+# 上传文件的接口路径
+UPLOAD_API = 'v1/upload'
+
+_REQUIRED: Any = object()
+# 默认值为_OMIT的字段没有传入时不出现在请求里
+_OMIT: Any = object()
+
+
+class Slot:
+    """请求模板中需要调用方填充的字段
+
+    Args:
+        name (str): 调用API时使用的参数名
+        default (Any): 默认值, 不给出时为必填参数
+        convert (Optional[Callable[[Any], Any]]): 填入前对参数值的转换
+    """
+    __slots__ = ('name', 'default', 'convert')
+
+    def __init__(self, name: str, default: Any = _REQUIRED,
+                 convert: Optional[Callable[[Any], Any]] = None):
+        self.name = name
+        self.default = default
+        self.convert = convert
+
+
+def optional(name: str, convert: Optional[Callable[[Any], Any]] = None) -> Slot:
+    """没有传入时不出现在请求里的字段"""
+    return Slot(name, _OMIT, convert)
+
+
+class CgiBaseResponse(BaseModel):
+    Ret: int = 0
+    ErrMsg: str = ''
+
+
+class SendMessageResult(BaseModel):
+    """发送消息的结果"""
+    MsgSeq: int = 0
+    MsgTime: int = 0
+    MsgUid: int = 0
+
+
+class UploadResult(BaseModel):
+    """上传文件的结果, 发送图片时需要这三个字段"""
+    FileMd5: str = ''
+    FileSize: int = 0
+    FileId: int = 0
+
+
+class GroupListResult(BaseModel):
+    """群列表, LastBuffer不为空时还有下一页"""
+    GroupLists: List[Dict[str, Any]] = []
+    LastBuffer: str = ''
+
+
+class MemberListResult(BaseModel):
+    """群成员列表, LastBuffer不为空时还有下一页"""
+    MemberLists: List[Dict[str, Any]] = []
+    LastBuffer: str = ''
+
+
+class ApiSpec:
+    """一个OPQ接口的声明
+
+    Args:
+        cmd (str): CgiCmd
+        request (Dict[str, Any]): CgiRequest模板, 值为Slot的字段由调用参数填充, 其余为常量
+        response (Optional[Type[BaseModel]]): ResponseData的模型, 为None时返回原始数据
+        merge (Optional[str]): 这个参数的值(一个字典)会被合并进CgiRequest, 用于已经编码好的消息内容
+        path (str): 接口路径
+    """
+
+    def __init__(self, cmd: str, request: Dict[str, Any],
+                 response: Optional[Type[BaseModel]] = None,
+                 merge: Optional[str] = None, path: str = LUA_API):
+        self.cmd = cmd
+        self.response = response
+        self.merge = merge
+        self.path = path
+        # 编译模板: 常量字段整体复制, 只有Slot字段需要逐个填充
+        self.constants: Dict[str, Any] = {}
+        self._slots: List[Tuple[str, Slot]] = []
+        for field, value in request.items():
+            if isinstance(value, Slot):
+                self._slots.append((field, value))
+            else:
+                self.constants[field] = value
+
+    def build(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """用调用参数填充模板, 生成完整的请求体
+
+        Args:
+            data (Dict[str, Any]): 调用参数
+
+        Raises:
+            TypeError: 缺少必填参数
+
+        Returns:
+            Dict[str, Any]: 包含CgiCmd与CgiRequest的请求体
+        """
+        request = self.constants.copy()
+        for field, slot in self._slots:
+            value = data.get(slot.name, slot.default)
+            if value is _OMIT:
+                continue
+            if value is _REQUIRED:
+                raise TypeError(f'{self.cmd} missing required argument: {slot.name!r}')
+            request[field] = slot.convert(value) if slot.convert is not None else value
+        if self.merge is not None and data.get(self.merge):
+            request.update(data[self.merge])
+        return {"CgiCmd": self.cmd, "CgiRequest": request}
+
+    def parse(self, content: bytes) -> Any:
+        """解析接口的响应
+
+        Args:
+            content (bytes): 响应体
+
+        Raises:
+            NetworkError: 响应不是合法的JSON
+            ActionFailed: CgiBaseResponse.Ret不为0
+
+        Returns:
+            Any: ResponseData对应的模型, 没有声明模型时返回原始数据
+        """
+        try:
+            result = json.loads(content)
+        except ValueError:
+            raise NetworkError(f'{self.cmd} returned invalid response: {content[:200]!r}')
+        base = CgiBaseResponse.parse_obj(result.get('CgiBaseResponse') or {})
+        if base.Ret != 0:
+            raise ActionFailed(cmd=self.cmd, Ret=base.Ret, ErrMsg=base.ErrMsg)
+        data = result.get('ResponseData')
+        if self.response is None:
+            return data
+        return self.response.parse_obj(data or {})
+
+
+class BatchResult:
+    """批量调用中单个调用的结果
+
+    Args:
+        api (str): API名称
+        data (Dict[str, Any]): 调用参数
+        result (Any): 返回值
+        error (Optional[Exception]): 调用失败时的异常
+    """
+    __slots__ = ('api', 'data', 'result', 'error')
+
+    def __init__(self, api: str, data: Dict[str, Any], result: Any = None,
+                 error: Optional[Exception] = None):
+        self.api = api
+        self.data = data
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        state = f'error={self.error!r}' if self.error is not None else f'result={self.result!r}'
+        return f'<BatchResult {self.api} {state}>'
+
+
+# 群管理操作的OpCode
+_OP_MUTE = 4691
+_OP_KICK = 2208
+
+# 响应好友申请的操作 -> OPQ的OpCode: 0 同意, 1 拒绝; OPQ不支持 2 拒绝并拉黑
+_FRIEND_OPERATE = {0: 2, 1: 3}
+# 响应入群申请/邀请的操作 -> OPQ的OpCode: 0 同意, 1 拒绝, 2 忽略; OPQ不支持 3 拒绝并拉黑, 4 忽略并拉黑
+_GROUP_OPERATE = {0: 1, 1: 2, 2: 3}
+
+
+def _operate(api: str, table: Dict[int, int]) -> Callable[[Any], int]:
+    """把响应申请的操作转换为OpCode, OPQ不支持的操作抛出ApiNotAvailable, 而不是悄悄换成别的操作"""
+    def convert(operate: Any) -> int:
+        code = table.get(operate)
+        if code is None:
+            raise ApiNotAvailable(f'{api} does not support operate={operate!r}')
+        return code
+    return convert
+
+
+# 已声明的接口: 发送好友/群/临时消息, 上传图片, 群列表, 群成员列表, 禁言, 踢人, 撤回群消息, 响应三种申请.
+# 还没有声明的接口(调用时需要自己用 ``origin`` 传入完整请求体):
+#   * 撤回好友消息 ``recall_friend_message``, 戳一戳 ``send_nudge``
+#   * 修改群名片/头衔/群名 ``set_member_card`` ``set_special_title`` ``set_group_name``
+#   * 设置管理员 ``set_member_admin``, 全员禁言 ``mute_all``, 退群 ``quit_group``
+#   * 好友列表 ``get_friend_list``, 成员/群资料 ``get_member_info`` ``get_group_info``, Uid转QQ号 ``query_uin_by_uid``
+#   * 上传语音和文件 ``upload_voice`` ``upload_file``
+# 这些接口在不同版本的OPQ上请求字段不一致, mock服务器也没有实现它们, 没有办法验证, 所以先不声明
+API_TABLE: Dict[str, ApiSpec] = {
+    'send_friend_message': ApiSpec('MessageSvc.PbSendMsg', {
+        "ToUin": Slot('target'),
+        "ToType": 1,
+    }, SendMessageResult, merge='message'),
+    'send_group_message': ApiSpec('MessageSvc.PbSendMsg', {
+        "ToUin": Slot('group'),
+        "ToType": 2,
+    }, SendMessageResult, merge='message'),
+    'send_temp_message': ApiSpec('MessageSvc.PbSendMsg', {
+        "ToUin": Slot('qq'),
+        "ToType": 3,
+        "GroupCode": Slot('group'),
+    }, SendMessageResult, merge='message'),
+    'upload_image': ApiSpec('PicUp.DataUp', {
+        # 1 好友图片, 2 群图片
+        "CommandId": Slot('command_id', 2),
+        "FilePath": optional('path'),
+        "FileUrl": optional('url'),
+        "Base64Buf": optional('base64'),
+    }, UploadResult, path=UPLOAD_API),
+    'get_group_list': ApiSpec('GetGroupLists', {
+        "LastBuffer": Slot('last_buffer', ''),
+    }, GroupListResult),
+    'get_group_member_list': ApiSpec('GetGroupMemberLists', {
+        "Uin": Slot('group'),
+        "LastBuffer": Slot('last_buffer', ''),
+    }, MemberListResult),
+    'mute_member': ApiSpec('SsoGroup.Op', {
+        "OpCode": _OP_MUTE,
+        "Uin": Slot('group'),
+        "Uid": Slot('uid'),
+        "BanTime": Slot('time'),
+    }),
+    'kick_member': ApiSpec('SsoGroup.Op', {
+        "OpCode": _OP_KICK,
+        "Uin": Slot('group'),
+        "Uid": Slot('uid'),
+    }),
+    'recall_group_message': ApiSpec('GroupRevokeMsg', {
+        "Uin": Slot('group'),
+        "MsgSeq": Slot('seq'),
+        "MsgRandom": Slot('random'),
+    }),
+    'resp_newFriendRequestEvent': ApiSpec('SystemMsgAction.Friend', {
+        "MsgSeq": Slot('event_id'),
+        "ReqUin": optional('from_id'),
+        "OpCode": Slot('operate', 0, _operate('resp_newFriendRequestEvent', _FRIEND_OPERATE)),
+    }),
+    'resp_memberJoinRequestEvent': ApiSpec('SystemMsgAction.Group', {
+        "MsgSeq": Slot('event_id'),
+        "MsgType": 1,
+        "GroupCode": Slot('group_id'),
+        "OpCode": Slot('operate', 0, _operate('resp_memberJoinRequestEvent', _GROUP_OPERATE)),
+    }),
+    'resp_botInvitedJoinGroupRequestEvent': ApiSpec('SystemMsgAction.Group', {
+        "MsgSeq": Slot('event_id'),
+        "MsgType": 2,
+        "GroupCode": Slot('group_id'),
+        "OpCode": Slot('operate', 0, _operate('resp_botInvitedJoinGroupRequestEvent', _GROUP_OPERATE)),
+    }),
+}
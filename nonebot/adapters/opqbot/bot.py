@@ -5,7 +5,8 @@ LastEditTime: 2023-10-25 23:55:48
 Description: 
 Copyright (c) 2023 by MemoryShadow@outlook.com, All Rights Reserved.
 '''
-from typing import Any, Optional, Union
+import asyncio
+from typing import TYPE_CHECKING, Any, Dict, Hashable, Iterable, List, Optional, Tuple, Union, cast
 from nonebot.typing import overrides
 
 from nonebot.adapters import Bot as BaseBot
@@ -14,10 +15,17 @@ from nonebot import get_driver
 from .event.message import ON_EVENT_FRIEND_NEW_MSG, ON_EVENT_GROUP_NEW_MSG, TempMessage
 
 from .event import Event
-from .message import MessageChain, MessageSegment
+from .message import MessageChain, MessageSegment, MessageType
+from .offload import read_base64
 from .utils import Message_mirai_to_OPQBot
+from .api import API_TABLE, BatchResult, SendMessageResult
+from .history import SessionKey, group_session, friend_session
+from .outgoing import split_chain
 from . import log
 
+if TYPE_CHECKING:
+    from .adapter import Adapter
+
 
 class Bot(BaseBot):
     @overrides(BaseBot)
@@ -39,12 +47,14 @@ class Bot(BaseBot):
           * ``event: Event``: Event对象
           * ``message: Union[MessageChain, MessageSegment, str]``: 要发送的消息
           * ``at_sender: bool``: 是否 @ 事件主体
+          * ``key: str``: 去重键, 启用发件箱时同一个键在有效期内只会发送一次
         """
         if not isinstance(message, MessageChain):
             message = MessageChain(message)
         if isinstance(event, ON_EVENT_FRIEND_NEW_MSG):
             return await self.send_friend_message(
-                target=event.MsgHead.SenderUin, message_chain=message, quote=quote
+                target=event.MsgHead.SenderUin, message_chain=message, quote=quote,
+                key=kwargs.get('key'),
             )
         elif isinstance(event, ON_EVENT_GROUP_NEW_MSG):
             if at_sender:
@@ -53,6 +63,7 @@ class Bot(BaseBot):
                 group=event.MsgHead.GroupInfo.GroupCode,
                 message_chain=message,
                 quote=quote,
+                key=kwargs.get('key'),
             )
         elif isinstance(event, TempMessage):
             return await self.send_temp_message(
@@ -60,20 +71,215 @@ class Bot(BaseBot):
                 group=event.MsgHead.GroupInfo.GroupCode,
                 message_chain=message,
                 quote=quote,
+                key=kwargs.get('key'),
             )
         else:
             raise ValueError(f"Unsupported event type {event!r}.")
 
+    async def call_batch(
+        self, calls: Iterable[Tuple[str, Dict[str, Any]]], concurrency: Optional[int] = None
+    ) -> List[BatchResult]:
+        """
+        :说明:
+
+          批量调用API, 同时进行的调用数不超过 ``concurrency``, 单个调用失败不影响其他调用
+
+        :参数:
+
+          * ``calls: Iterable[Tuple[str, Dict[str, Any]]]``: (API名称, 参数) 的列表,
+            例如 ``[("mute_member", {"group": 1, "uid": "u_1", "time": 60})]``
+          * ``concurrency: Optional[int]``: 最大并发数, 默认使用 ``opqbot_batch_concurrency``
+
+        :返回:
+
+          * ``List[BatchResult]``: 与 ``calls`` 顺序一致的结果, 失败的调用带有 ``error``
+        """
+        adapter = cast("Adapter", self.adapter)
+        limit = concurrency or adapter.opqbot_config.opqbot_batch_concurrency or 1
+        results = [BatchResult(api, data) for api, data in calls]
+        semaphore = asyncio.Semaphore(limit)
+
+        async def _call(item: BatchResult):
+            async with semaphore:
+                try:
+                    item.result = await self.call_api(item.api, **item.data)
+                except Exception as e:
+                    item.error = e
+
+        await asyncio.gather(*map(_call, results))
+        failed = sum(not item.ok for item in results)
+        if failed:
+            log.warning(f"{failed}/{len(results)} calls in batch failed")
+        return results
+
+    async def send_friend_message(
+        self, *, target: int, message_chain: MessageChain, quote: Optional[int] = None,
+        key: Optional[str] = None
+    ) -> Optional[SendMessageResult]:
+        """
+        :说明:
+
+          发送好友消息
+
+        :参数:
+
+          * ``target: int``: 好友QQ号
+          * ``message_chain: MessageChain``: 消息链
+          * ``quote: Optional[int]``: 引用的消息的MsgSeq
+          * ``key: Optional[str]``: 去重键, 启用发件箱时同一个键在有效期内只会发送一次
+        """
+        log.debug(f"$send_friend_message@ target: {target}")
+        return await self._submit(
+            'send_friend_message', friend_session(target), friend_session(target),
+            {'target': target}, message_chain, quote, key
+        )
+
     async def send_group_message(
-        self, *, group: int, message_chain: MessageChain, quote: Optional[int]
-    ):
+        self, *, group: int, message_chain: MessageChain, quote: Optional[int] = None,
+        key: Optional[str] = None
+    ) -> Optional[SendMessageResult]:
+        """
+        :说明:
+
+          发送群消息
+
+        :参数:
+
+          * ``group: int``: 群号
+          * ``message_chain: MessageChain``: 消息链
+          * ``quote: Optional[int]``: 引用的消息的MsgSeq
+          * ``key: Optional[str]``: 去重键, 启用发件箱时同一个键在有效期内只会发送一次
+        """
         log.debug(f"$send_group_message@ group: {group}")
         log.debug(f"$send_group_message@ message_chain: {message_chain}")
         log.debug(f"$send_group_message@ quote: {quote}")
-        Msg = Message_mirai_to_OPQBot(message_chain)
-        Msg['ToUin'] = group
-        Msg['ToType'] = 2
-        await self.call_api('v1/LuaApiCaller', message=message_chain, group_id=group, origin={
-            "CgiCmd": "MessageSvc.PbSendMsg",
-            "CgiRequest": Msg
-        })
+        return await self._submit(
+            'send_group_message', group_session(group), group_session(group),
+            {'group': group}, message_chain, quote, key
+        )
+
+    async def send_temp_message(
+        self, *, qq: int, group: int, message_chain: MessageChain, quote: Optional[int] = None,
+        key: Optional[str] = None
+    ) -> Optional[SendMessageResult]:
+        """
+        :说明:
+
+          发送临时会话消息
+
+        :参数:
+
+          * ``qq: int``: 对方QQ号
+          * ``group: int``: 临时会话来源的群号
+          * ``message_chain: MessageChain``: 消息链
+          * ``quote: Optional[int]``: 引用的消息的MsgSeq
+          * ``key: Optional[str]``: 去重键, 启用发件箱时同一个键在有效期内只会发送一次
+        """
+        log.debug(f"$send_temp_message@ qq: {qq}, group: {group}")
+        return await self._submit(
+            'send_temp_message', ('temp', qq, group), friend_session(qq),
+            {'qq': qq, 'group': group}, message_chain, quote, key
+        )
+
+    async def _submit(
+        self, api: str, target: Hashable, session: SessionKey, fields: Dict[str, Any],
+        message_chain: MessageChain, quote: Optional[int], key: Optional[str]
+    ) -> Optional[SendMessageResult]:
+        """交给合并器, 引用回复和带去重键的消息不和别的消息合并"""
+        adapter = cast("Adapter", self.adapter)
+        return await adapter.coalescer.submit(
+            target, message_chain,
+            lambda chain: self._send_chain(api, session, fields, chain, quote, key),
+            coalesce=quote is None and key is None
+        )
+
+    async def _upload_images(self, message_chain: MessageChain, command_id: int) -> MessageChain:
+        """上传消息链中还没有imageId的图片, 读取和编码本地文件在线程池中进行
+
+        Args:
+            message_chain (MessageChain): 消息链, 其中的消息段可能被调用方复用, 这里不会修改它们
+            command_id (int): 上传类型, 1 好友图片, 2 群图片
+
+        Returns:
+            MessageChain: 图片换成带FileId的新消息段后的消息链, 没有需要上传的图片时就是原消息链
+        """
+        adapter = cast("Adapter", self.adapter)
+        segments: List[MessageSegment] = []
+        uploaded = False
+        for segment in message_chain:
+            data = segment.data
+            if segment.type != MessageType.IMAGE or data.get('imageId'):
+                segments.append(segment)
+                continue
+            if data.get('path'):
+                # OPQ不一定和Bot在同一台机器上, 本地文件总是以base64上传
+                with adapter.tracer.span('read_image'):
+                    encoded = await adapter.offloader.run(read_base64, data['path'])
+                result = await self.call_api('upload_image', command_id=command_id, base64=encoded)
+            elif data.get('base64'):
+                result = await self.call_api('upload_image', command_id=command_id, base64=data['base64'])
+            elif data.get('url'):
+                result = await self.call_api('upload_image', command_id=command_id, url=data['url'])
+            else:
+                segments.append(segment)
+                continue
+            # 好友图片和群图片的FileId不通用, 写进新的消息段, 同一个消息段下次发往别处时会重新上传
+            segments.append(MessageSegment(
+                MessageType.IMAGE,
+                **{**data, 'imageId': result.FileId, 'fileMd5': result.FileMd5, 'fileSize': result.FileSize}
+            ))
+            uploaded = True
+        return MessageChain(segments) if uploaded else message_chain
+
+    async def _send_chain(
+        self, api: str, session: SessionKey, fields: Dict[str, Any],
+        message_chain: MessageChain, quote: Optional[int], key: Optional[str]
+    ) -> Optional[SendMessageResult]:
+        """发送一条消息, 超出长度限制时拆成几条依次发送, 返回最后一条的结果
+
+        Args:
+            api (str): ``API_TABLE`` 中发送消息的接口
+            session (SessionKey): 查找引用消息用的会话
+            fields (Dict[str, Any]): 发送目标相关的参数
+            message_chain (MessageChain): 消息链
+            quote (Optional[int]): 引用的消息的MsgSeq
+            key (Optional[str]): 去重键
+
+        Returns:
+            Optional[SendMessageResult]: 通过发件箱发送且这次没有发出去(或者是重复消息)时为None
+        """
+        adapter = cast("Adapter", self.adapter)
+        spec = API_TABLE[api]
+        history = adapter.message_history
+        config = adapter.opqbot_config
+        parts = split_chain(message_chain, config.opqbot_max_message_length or 0,
+                            config.opqbot_max_message_images or 0)
+        result: Optional[SendMessageResult] = None
+        # 通过发件箱发送时, 一旦有一部分没发出去, 后面的部分只写入发件箱, 由后台按顺序重试
+        queued = False
+        for index, part in enumerate(parts):
+            part = await self._upload_images(part, 2 if spec.constants['ToType'] == 2 else 1)
+            with adapter.tracer.span('encode'):
+                Msg = Message_mirai_to_OPQBot(part, lambda seq: history.get(session, seq=seq))
+            # 只有第一条引用原消息
+            if quote is not None and index == 0 and 'ReplyTo' not in Msg:
+                record = history.get(session, seq=quote)
+                if record is not None:
+                    Msg['ReplyTo'] = record.reply_to()
+            body = spec.build({**fields, 'message': Msg})
+            part_key = f'{key}#{index}' if key is not None and index else key
+            if adapter.outbox is None:
+                response = await self.call_api(spec.path, origin=body, message=part, **fields)
+            else:
+                id_ = await adapter.outbox.enqueue(self, spec.path, body, part_key)
+                if id_ is None or queued:
+                    # 重复的部分直接跳过; 前面的部分在等待重试时, 这一部分不能抢先发出
+                    continue
+                response, ok = await adapter.outbox.deliver(self, id_, spec.path, body)
+                if not ok:
+                    queued = True
+                    continue
+            result = spec.parse(response.content)
+            # 自己发出的消息也占用会话的消息序号, 告诉缺口检测一声
+            adapter.gap_tracker.advance(session, result.MsgSeq, result.MsgTime)
+        return result
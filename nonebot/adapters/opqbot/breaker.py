@@ -0,0 +1,113 @@
+'''
+Description: 熔断器
+    每个端点和账号各有一个熔断器, 统计最近一段时间API调用的失败率(过慢的调用也算失败).
+    失败率过高时熔断器打开, 之后的调用立即失败而不是等到超时; 打开一段时间后进入半开状态,
+    放行少量探测调用, 探测成功就关闭熔断器, 失败就重新打开
+'''
+import time
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 导出指标时状态对应的数值
+STATE_VALUES: Dict[str, int] = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """熔断器
+
+    Args:
+        failure_rate (float): 失败率达到这个比例时打开, 为0时不熔断
+        min_calls (int): 统计窗口内至少有这么多次调用才计算失败率
+        window (float): 统计窗口(秒)
+        slow_call (float): 耗时超过这个秒数的调用算作失败, 为0时不按耗时判断
+        open_seconds (float): 打开后多久进入半开状态
+        probes (int): 半开状态下最多同时放行的探测调用数
+    """
+
+    def __init__(self, failure_rate: float = 0.5, min_calls: int = 10, window: float = 30,
+                 slow_call: float = 0, open_seconds: float = 30, probes: int = 1):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self._state = CLOSED
+        self.opened_at = 0.0
+        # 统计窗口内的调用: (结束时刻, 是否失败)
+        self._calls: Deque[Tuple[float, bool]] = deque()
+        self._failures = 0
+        self._probing = 0
+        # 打开的次数和因为打开而拒绝的调用数
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            return HALF_OPEN
+        return self._state
+
+    def allow(self) -> bool:
+        """是否放行一次调用, 放行后必须调用 ``record`` 报告结果"""
+        if not self.failure_rate:
+            return True
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self._probing < self.probes:
+            self._state = HALF_OPEN
+            self._probing += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, ok: bool, seconds: float = 0):
+        """报告一次调用的结果
+
+        Args:
+            ok (bool): 是否成功
+            seconds (float): 调用耗时
+        """
+        if not self.failure_rate:
+            return
+        failed = not ok or bool(self.slow_call and seconds > self.slow_call)
+        if self._state == HALF_OPEN:
+            self._probing = max(self._probing - 1, 0)
+            if failed:
+                self._open()
+            else:
+                self._close()
+            return
+        now = time.monotonic()
+        calls = self._calls
+        calls.append((now, failed))
+        self._failures += failed
+        while calls and now - calls[0][0] > self.window:
+            self._failures -= calls.popleft()[1]
+        if self._state == CLOSED and len(calls) >= self.min_calls \
+                and self._failures >= self.failure_rate * len(calls):
+            self._open()
+
+    def cancel(self):
+        """放行的调用被取消了, 不计入统计, 只归还探测名额"""
+        if self._state == HALF_OPEN:
+            self._probing = max(self._probing - 1, 0)
+
+    def _open(self):
+        self._state = OPEN
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        self._probing = 0
+
+    def _close(self):
+        self._state = CLOSED
+        self._calls.clear()
+        self._failures = 0
+
+    def __repr__(self) -> str:
+        return f'<CircuitBreaker {self.state} calls={len(self._calls)} failures={self._failures}>'
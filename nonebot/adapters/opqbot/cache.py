@@ -0,0 +1,260 @@
+'''
+Description: 群与群成员信息缓存
+    OPQ推送的群消息里没有发送者的权限信息, 每次检查权限都去调用API太慢了
+    这里把群信息和成员的身份/名片/头衔缓存下来, 并在收到相关通知事件时增量更新
+'''
+import time
+import asyncio
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from . import log
+from .event import (
+    Event,
+    ON_EVENT_GROUP_JOIN,
+    ON_EVENT_GROUP_EXIT,
+    ON_EVENT_GROUP_NEW_MSG,
+    MemberLeaveEventKick,
+    MemberStateChangeEvent,
+    MemberCardChangeEvent,
+    MemberPermissionChangeEvent,
+    MemberSpecialTitleChangeEvent,
+)
+from .event.base import UserPermission
+
+if TYPE_CHECKING:
+    from .bot import Bot
+
+
+# OPQ成员列表中MemberFlag与权限的对应关系
+_MEMBER_FLAG = {
+    0: UserPermission.MEMBER,
+    1: UserPermission.ADMINISTRATOR,
+    2: UserPermission.OWNER,
+}
+
+
+# 会改动缓存内容的通知事件, 过载降级时也不能丢弃它们, 否则缓存里的权限会一直是旧的
+CACHE_EVENTS = (
+    ON_EVENT_GROUP_JOIN,
+    ON_EVENT_GROUP_EXIT,
+    MemberLeaveEventKick,
+    MemberStateChangeEvent,
+)
+
+
+class MemberInfo(BaseModel):
+    """群成员信息"""
+    uin: int
+    uid: str = ''
+    nick: str = ''
+    card: str = ''
+    title: str = ''
+    permission: UserPermission = UserPermission.MEMBER
+
+
+class GroupInfo(BaseModel):
+    """群信息"""
+    group_code: int
+    group_name: str = ''
+    owner: int = 0
+    member_count: int = 0
+
+
+class _GroupRecord:
+    """单个群的缓存记录, 成员同时按Uin与Uid建立索引"""
+    __slots__ = ('info', 'members', 'uids', 'expire', 'incomplete')
+
+    def __init__(self, info: GroupInfo, ttl: float):
+        self.info = info
+        self.members: Dict[int, MemberInfo] = {}
+        self.uids: Dict[str, int] = {}
+        self.expire = time.monotonic() + ttl
+        # 有新人入群但还没拉取到他的信息
+        self.incomplete = False
+
+    def put(self, member: MemberInfo):
+        self.members[member.uin] = member
+        if member.uid:
+            self.uids[member.uid] = member.uin
+
+    def by_uid(self, uid: str) -> Optional[MemberInfo]:
+        uin = self.uids.get(uid)
+        return None if uin is None else self.members.get(uin)
+
+    def remove_uid(self, uid: str):
+        uin = self.uids.pop(uid, None)
+        if uin is not None:
+            self.members.pop(uin, None)
+
+
+class GroupCache:
+    """群与群成员信息缓存
+
+    查询都是O(1)的字典查找, 只有缓存缺失或过期时才会调用API拉取整个群的成员列表,
+    同一个群的并发拉取会被合并为一次
+
+    Args:
+        ttl (float): 每个群缓存的有效期, 单位秒
+    """
+
+    def __init__(self, ttl: float = 600):
+        self.ttl = ttl
+        self._groups: Dict[int, _GroupRecord] = {}
+        self._fetching: Dict[int, "asyncio.Future[_GroupRecord]"] = {}
+
+    def clear(self):
+        self._groups.clear()
+
+    def get_group_cached(self, group: int) -> Optional[GroupInfo]:
+        """只查缓存, 不调用API"""
+        record = self._groups.get(group)
+        return None if record is None else record.info
+
+    def get_member_cached(self, group: int, uin: int) -> Optional[MemberInfo]:
+        """只查缓存, 不调用API"""
+        record = self._groups.get(group)
+        return None if record is None else record.members.get(uin)
+
+    async def get_member(self, bot: "Bot", group: int, uin: int) -> Optional[MemberInfo]:
+        """获取群成员信息, 缓存缺失或过期时会拉取该群的成员列表
+
+        Args:
+            bot (Bot): 缓存缺失时用于调用API的Bot
+            group (int): 群号
+            uin (int): 成员QQ号
+
+        Returns:
+            Optional[MemberInfo]: 成员信息, 不在群内时为None
+        """
+        record = self._groups.get(group)
+        if record is None or record.expire < time.monotonic() or \
+                (record.incomplete and uin not in record.members):
+            record = await self.refresh_group(bot, group)
+        return record.members.get(uin)
+
+    async def get_permission(self, bot: "Bot", group: int, uin: int) -> Optional[UserPermission]:
+        member = await self.get_member(bot, group, uin)
+        return None if member is None else member.permission
+
+    async def refresh_group(self, bot: "Bot", group: int) -> _GroupRecord:
+        """重新拉取一个群的成员列表"""
+        future = self._fetching.get(group)
+        if future is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+            # 负责拉取的任务被取消了, 而不是自己被取消, 自己重新拉取
+            return await self.refresh_group(bot, group)
+        future = asyncio.get_running_loop().create_future()
+        self._fetching[group] = future
+        try:
+            record = await self._fetch_group(bot, group)
+            self._groups[group] = record
+            future.set_result(record)
+            return record
+        except Exception as e:
+            future.set_exception(e)
+            # 没人等待这个future时也要取走异常, 避免asyncio报警
+            future.exception()
+            raise
+        finally:
+            # 被取消时也要结束future, 否则等待它的调用会一直挂着
+            if not future.done():
+                future.cancel()
+            del self._fetching[group]
+
+    async def _fetch_group(self, bot: "Bot", group: int) -> _GroupRecord:
+        old = self._groups.get(group)
+        info = old.info if old is not None else GroupInfo(group_code=group)
+        record = _GroupRecord(info, self.ttl)
+        last_buffer = ''
+        while True:
+            data = await bot.call_api('get_group_member_list', group=group, last_buffer=last_buffer)
+            for item in data.MemberLists:
+                uin = item['Uin']
+                permission = _MEMBER_FLAG.get(item.get('MemberFlag', 0), UserPermission.MEMBER)
+                if uin == info.owner:
+                    permission = UserPermission.OWNER
+                record.put(MemberInfo(
+                    uin=uin,
+                    uid=item.get('Uid') or '',
+                    nick=item.get('Nick') or '',
+                    card=item.get('GroupCard') or '',
+                    title=item.get('SpecialTitle') or '',
+                    permission=permission,
+                ))
+            last_buffer = data.LastBuffer
+            if not last_buffer:
+                break
+        log.debug(f'$GroupCache@ group {group} refreshed with {len(record.members)} members')
+        return record
+
+    async def warmup(self, bot: "Bot"):
+        """拉取Bot所在的全部群及其成员, 预热缓存"""
+        groups: List[GroupInfo] = []
+        last_buffer = ''
+        while True:
+            data = await bot.call_api('get_group_list', last_buffer=last_buffer)
+            for item in data.GroupLists:
+                groups.append(GroupInfo(
+                    group_code=item['GroupCode'],
+                    group_name=item.get('GroupName') or '',
+                    owner=item.get('GroupOwner') or 0,
+                    member_count=item.get('MemberCnt') or 0,
+                ))
+            last_buffer = data.LastBuffer
+            if not last_buffer:
+                break
+        for info in groups:
+            # 先放一个已过期的空记录占位, 这样拉取成员时就能拿到群主信息
+            placeholder = _GroupRecord(info, 0)
+            self._groups.setdefault(info.group_code, placeholder).info = info
+            try:
+                await self.refresh_group(bot, info.group_code)
+            except Exception as e:
+                log.warning(f'Failed to warm up member cache of group {info.group_code}', e)
+        log.info(f'Member cache warmed up with {len(groups)} groups')
+
+    def update(self, event: Event):
+        """根据事件增量更新缓存, 与缓存无关的事件会被直接忽略
+
+        Args:
+            event (Event): 收到的事件
+        """
+        if isinstance(event, ON_EVENT_GROUP_NEW_MSG):
+            # 群消息自带发送者的昵称与名片, 顺手更新一下
+            head = event.MsgHead
+            record = self._groups.get(head.GroupInfo.GroupCode) if head.GroupInfo else None
+            if record is not None:
+                member = record.members.get(head.SenderUin)
+                if member is not None:
+                    member.nick = head.SenderNick
+                    member.card = head.GroupInfo.GroupCard
+        elif isinstance(event, ON_EVENT_GROUP_JOIN):
+            record = self._groups.get(event.EventData.GroupCode)
+            if record is not None:
+                record.incomplete = True
+        elif isinstance(event, (ON_EVENT_GROUP_EXIT, MemberLeaveEventKick)):
+            record = self._groups.get(event.EventData.GroupCode)
+            if record is not None:
+                record.remove_uid(event.EventData.ReqUid)
+        elif isinstance(event, MemberPermissionChangeEvent):
+            member = self._member_of(event.member.GroupCode, event.member.ReqUid)
+            if member is not None:
+                member.permission = event.current
+        elif isinstance(event, MemberCardChangeEvent):
+            member = self._member_of(event.member.GroupCode, event.member.ReqUid)
+            if member is not None:
+                member.card = event.current
+        elif isinstance(event, MemberSpecialTitleChangeEvent):
+            member = self._member_of(event.member.GroupCode, event.member.ReqUid)
+            if member is not None:
+                member.title = event.current
+
+    def _member_of(self, group: int, uid: str) -> Optional[MemberInfo]:
+        record = self._groups.get(group)
+        return None if record is None else record.by_uid(uid)
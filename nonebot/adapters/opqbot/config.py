@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
 
 from pydantic import Field, Extra, BaseModel
 
@@ -14,6 +14,66 @@ class Config(BaseModel):
         - ``opqbot_mountPoint``: 目挂载点
         - ``opqbot_qq``: 目标的QQ(这个框架通常来说不支持多个QQ同时连接)
         - ``opqbot_forward``: 是否启用正向 ws 来主动连接服务
+        - ``opqbot_cache_ttl``: 群成员信息缓存的有效期(秒)
+        - ``opqbot_cache_warmup``: 是否在Bot连接后预热全部群的成员信息缓存
+        - ``opqbot_history_size``: 每个群/好友会话保留的最近消息数, 为0时不记录
+        - ``opqbot_history_sessions``: 最多保留多少个会话的消息记录
+        - ``opqbot_dedup_window``: 重复事件的去重窗口(秒), 为0时不去重
+        - ``opqbot_dedup_size``: 去重时最多记住的消息数
+        - ``opqbot_metrics``: 是否收集运行指标
+        - ``opqbot_metrics_path``: 反向驱动器上导出OpenMetrics文本的路径, 为空时不挂载
+        - ``opqbot_metrics_interval``: 向 ``Adapter.metrics_sinks`` 推送指标的间隔(秒), 为0时不推送
+        - ``opqbot_profile``: 是否开启分阶段耗时分析
+        - ``opqbot_profile_rate``: 耗时分析的事件采样率(0~1)
+        - ``opqbot_profile_top``: 每个阶段保留最慢的多少个事件
+        - ``opqbot_profile_path``: 反向驱动器上导出分析结果的路径, 为空时不挂载
+        - ``opqbot_trace``: 是否开启端到端延迟追踪
+        - ``opqbot_trace_threshold``: 总耗时超过多少毫秒的追踪一定会被导出
+        - ``opqbot_trace_rate``: 未超过阈值的追踪的随机导出比例(0~1)
+        - ``opqbot_trace_path``: 追踪导出的JSON-lines文件路径, 为空时只交给 ``Adapter.tracer.sinks``
+        - ``opqbot_fast_decode``: 是否跳过pydantic校验, 快速解码群消息与好友消息
+        - ``opqbot_heartbeat_interval``: 正向ws连接期间发送ws ping的间隔(秒), 驱动器不支持时改为请求clusterinfo接口, 为0时不探测
+        - ``opqbot_heartbeat_timeout``: 单次探测的超时时间(秒)
+        - ``opqbot_heartbeat_misses``: 连续多少次探测失败后认为连接已经失效并立即重连
+        - ``opqbot_ws_idle_timeout``: 多少秒没有收到任何数据就认为连接已经失效, 为0时不检查
+        - ``opqbot_backfill_max_age``: 消息缺口跨越的时间超过多少秒时不再补齐
+        - ``opqbot_backfill_max_count``: 单个缺口最多补齐多少条消息
+        - ``opqbot_backfill_interval``: 同一会话两次补齐拉取之间的最小间隔(秒)
+        - ``opqbot_backfill_concurrency``: 最多同时进行多少个补齐拉取, 为0时不限制
+        - ``opqbot_backfill_hold``: 补齐期间同一会话的实时事件最多被推迟多少秒, 超时后放弃等待补齐, 为0时不限制
+        - ``opqbot_endpoints``: 除 ``opqbot_host:opqbot_port`` 之外的冗余OPQ端点, 形如 ``["host:port"]``
+        - ``opqbot_connections_per_endpoint``: 对每个端点建立多少条正向ws连接
+        - ``opqbot_shutdown_timeout``: 关闭时等待正在处理的事件与API调用完成的最长时间(秒)
+        - ``opqbot_spool_path``: 关闭时把尚未派发的事件帧保存到这个文件, 下次启动后重放, 为空时直接丢弃
+        - ``opqbot_outbox_path``: 发件箱数据库(SQLite)的路径, 设置后发送的消息先落盘再发送, 失败时自动重试
+        - ``opqbot_outbox_ttl``: 发件箱中消息的有效期(秒), 过期未发出的消息会被丢弃
+        - ``opqbot_outbox_max_backoff``: 发件箱重试间隔的上限(秒)
+        - ``opqbot_coalesce_window``: 合并发往同一目标的连续消息的等待时间(秒), 为0时不合并
+        - ``opqbot_max_message_length``: 单条消息最多的字符数, 超出时拆成几条发送, 为0时不拆分
+        - ``opqbot_max_message_images``: 单条消息最多的图片数, 超出时拆成几条发送, 为0时不拆分
+        - ``opqbot_batch_concurrency``: ``Bot.call_batch`` 默认的最大并发调用数
+        - ``opqbot_api_timeout``: API调用默认的超时时间(秒), 包括换端点重试的时间, 为0时不限制
+        - ``opqbot_api_timeouts``: 按API名称或CgiCmd单独配置的超时时间, 形如 ``{"GetGroupMemberLists": 30}``
+        - ``opqbot_api_attempt_timeout``: 有冗余端点时, 除最后一个端点外每个端点最多等待多少秒就换下一个,
+          这样连上了但卡住的端点不会拖慢故障转移; 应大于正常调用的耗时, 为0时只按剩余时间平分
+        - ``opqbot_connect_timeout``: 建立正向ws连接的超时时间(秒)
+        - ``opqbot_event_deadline``: 每个事件的处理期限(秒), 处理过程中的API调用不会超过剩余时间, 为0时不限制
+        - ``opqbot_breaker_failure_rate``: 端点的API调用失败率达到多少(0~1)时熔断, 为0时不熔断
+        - ``opqbot_breaker_min_calls``: 统计窗口内至少有多少次调用才计算失败率
+        - ``opqbot_breaker_window``: 计算失败率的统计窗口(秒)
+        - ``opqbot_breaker_slow_call``: 耗时超过多少秒的调用算作失败, 为0时不按耗时判断
+        - ``opqbot_breaker_open_seconds``: 熔断多久之后放行探测调用(秒)
+        - ``opqbot_workers``: 执行图片编码等耗时工作的线程数, 为0时直接在事件循环中执行
+        - ``opqbot_worker_queue``: 最多同时提交给线程池的任务数, 满了之后新任务等待空位
+        - ``opqbot_offload_json_size``: 请求体中的字符串总长超过多少时在线程池中序列化, 为0时总在事件循环中序列化
+        - ``opqbot_lag_interval``: 事件循环延迟的采样间隔(秒), 为0时不监控
+        - ``opqbot_lag_threshold``: 事件循环延迟超过多少毫秒时丢弃通知和同步消息等低优先级事件, 为0时不丢弃
+        - ``opqbot_flood_user_rate``: 每个发送者每秒允许的消息数, 为0时不按发送者限流
+        - ``opqbot_flood_user_burst``: 每个发送者允许的突发消息数
+        - ``opqbot_flood_group_rate``: 每个群每秒允许的消息数, 为0时不按群限流
+        - ``opqbot_flood_group_burst``: 每个群允许的突发消息数
+        - ``opqbot_flood_action``: 超出限额的消息如何处理, ``drop`` 丢弃, ``tag`` 标记后照常派发, ``collapse`` 合并为最新的一条
+        - ``opqbot_flood_max_keys``: 限流时最多记录多少个发送者和群
 
     一般来说, 最终的合成就是 ``ws://host:port/mountPoint``
     """
@@ -28,6 +88,65 @@ class Config(BaseModel):
     # 这里不应该是一个可选项, 因为OPQ的请求调用都要使用这个
     opqbot_qq: str
     opqbot_forward: Optional[bool] = True
+    opqbot_cache_ttl: Optional[float] = 600
+    opqbot_cache_warmup: Optional[bool] = False
+    opqbot_history_size: Optional[int] = 100
+    opqbot_history_sessions: Optional[int] = 1000
+    opqbot_dedup_window: Optional[float] = 60
+    opqbot_dedup_size: Optional[int] = 4096
+    opqbot_metrics: Optional[bool] = False
+    opqbot_metrics_path: Optional[str] = "opqbot/metrics"
+    opqbot_metrics_interval: Optional[float] = 0
+    opqbot_profile: Optional[bool] = False
+    opqbot_profile_rate: Optional[float] = 0.01
+    opqbot_profile_top: Optional[int] = 10
+    opqbot_profile_path: Optional[str] = "opqbot/profile"
+    opqbot_trace: Optional[bool] = False
+    opqbot_trace_threshold: Optional[float] = 1000
+    opqbot_trace_rate: Optional[float] = 0
+    opqbot_trace_path: Optional[str] = None
+    opqbot_fast_decode: Optional[bool] = True
+    opqbot_heartbeat_interval: Optional[float] = 15
+    opqbot_heartbeat_timeout: Optional[float] = 5
+    opqbot_heartbeat_misses: Optional[int] = 2
+    opqbot_ws_idle_timeout: Optional[float] = 0
+    opqbot_backfill_max_age: Optional[float] = 300
+    opqbot_backfill_max_count: Optional[int] = 50
+    opqbot_backfill_interval: Optional[float] = 1
+    opqbot_backfill_concurrency: Optional[int] = 4
+    opqbot_backfill_hold: Optional[float] = 5
+    opqbot_endpoints: Optional[List[str]] = []
+    opqbot_connections_per_endpoint: Optional[int] = 1
+    opqbot_shutdown_timeout: Optional[float] = 10
+    opqbot_spool_path: Optional[str] = None
+    opqbot_outbox_path: Optional[str] = None
+    opqbot_outbox_ttl: Optional[float] = 3600
+    opqbot_outbox_max_backoff: Optional[float] = 60
+    opqbot_coalesce_window: Optional[float] = 0
+    opqbot_max_message_length: Optional[int] = 3000
+    opqbot_max_message_images: Optional[int] = 20
+    opqbot_batch_concurrency: Optional[int] = 16
+    opqbot_api_timeout: Optional[float] = 10
+    opqbot_api_timeouts: Optional[Dict[str, float]] = {}
+    opqbot_api_attempt_timeout: Optional[float] = 0.5
+    opqbot_connect_timeout: Optional[float] = 3
+    opqbot_event_deadline: Optional[float] = 0
+    opqbot_breaker_failure_rate: Optional[float] = 0.5
+    opqbot_breaker_min_calls: Optional[int] = 10
+    opqbot_breaker_window: Optional[float] = 30
+    opqbot_breaker_slow_call: Optional[float] = 0
+    opqbot_breaker_open_seconds: Optional[float] = 30
+    opqbot_workers: Optional[int] = 4
+    opqbot_worker_queue: Optional[int] = 64
+    opqbot_offload_json_size: Optional[int] = 262144
+    opqbot_lag_interval: Optional[float] = 0.5
+    opqbot_lag_threshold: Optional[float] = 0
+    opqbot_flood_user_rate: Optional[float] = 0
+    opqbot_flood_user_burst: Optional[float] = 10
+    opqbot_flood_group_rate: Optional[float] = 0
+    opqbot_flood_group_burst: Optional[float] = 50
+    opqbot_flood_action: Optional[Literal['drop', 'tag', 'collapse']] = 'drop'
+    opqbot_flood_max_keys: Optional[int] = 10000
 
     class Config:
         extra = Extra.ignore
@@ -0,0 +1,50 @@
+'''
+Description: 调用期限
+    事件处理开始时设置一个期限, 它通过上下文变量传给处理过程中发起的所有API调用(包括处理函数创建的任务),
+    每个调用的超时时间取接口自己的超时和剩余时间中较小的一个, 期限过了就不再发起调用
+'''
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+# 期限, time.monotonic()的时刻, 为None时没有期限
+_deadline: ContextVar[Optional[float]] = ContextVar('opqbot_deadline', default=None)
+
+
+def get_deadline() -> Optional[float]:
+    return _deadline.get()
+
+
+def set_deadline(seconds: float):
+    """在当前上下文中设置从现在起seconds秒的期限, 已经有更早的期限时保留原来的"""
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    _deadline.set(at if current is None else min(current, at))
+
+
+def remaining() -> Optional[float]:
+    """当前上下文剩余的时间(秒), 没有期限时为None, 已经超时时为0"""
+    at = _deadline.get()
+    if at is None:
+        return None
+    return max(at - time.monotonic(), 0.0)
+
+
+@contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    """
+    :说明:
+
+      在代码块内设置一个更紧的期限, 离开代码块后恢复
+
+    :参数:
+
+      * ``seconds: float``: 从现在起的秒数
+    """
+    token = _deadline.set(_deadline.get())
+    set_deadline(seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
@@ -0,0 +1,143 @@
+'''
+Description: OPQ服务端点
+    一个账号可以同时连接多个OPQ端点(或者对同一个端点建立多条连接),
+    每个端点记录自己的连接数, 心跳往返时间和最近的失败次数, API调用会优先发往最健康的端点.
+    发往端点的请求目标(带好查询参数的URL和默认请求头)按接口和账号预先准备好并缓存, 每次调用直接复用
+'''
+import time
+from typing import Dict, List, Optional, Tuple
+
+from nonebot.drivers import URL
+
+from .template import compile_template
+
+# OPQ接口地址的模板
+API_URL = '{base_url}/{api}'
+
+# 查询参数, 以有序元组的形式作为缓存键, 例如 (('qq', '123'),)
+Query = Tuple[Tuple[str, str], ...]
+
+DEFAULT_HEADERS: Dict[str, str] = {
+    'Content-Type': 'application/json'
+}
+
+
+class Route:
+    """预先准备好的请求目标, 创建后不再修改, 可以被并发的请求共享
+
+    Args:
+        url (URL): 已经带上查询参数的完整地址
+        headers (Dict[str, str]): 默认请求头
+    """
+    __slots__ = ('url', 'headers')
+
+    def __init__(self, url: URL, headers: Dict[str, str]):
+        self.url = url
+        self.headers = headers
+
+    def __repr__(self) -> str:
+        return f'<Route {self.url}>'
+
+
+class Endpoint:
+    """一个OPQ服务端点
+
+    Args:
+        host (str): 地址
+        port (int): 端口
+        protocol (str): API使用的协议, http或https
+    """
+
+    def __init__(self, host: str, port: int, protocol: str = 'http'):
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.base_url = f'{protocol}://{host}:{port}'
+        # (接口, 查询参数) -> 请求目标
+        self._routes: Dict[Tuple[str, Query], Route] = {}
+        # 当前连在这个端点上的ws数量
+        self.connections = 0
+        # 最近一次心跳探测的往返时间(秒)
+        self.rtt: Optional[float] = None
+        # 连续失败的API调用次数, 成功一次就清零
+        self.failures = 0
+        self.last_failure = 0.0
+
+    @classmethod
+    def parse(cls, address: str, protocol: str = 'http', default_port: int = 8086) -> "Endpoint":
+        """从 ``host:port`` 形式的字符串创建端点"""
+        host, _, port = address.rpartition(':')
+        if not host:
+            return cls(port, default_port, protocol)
+        return cls(host, int(port), protocol)
+
+    @property
+    def name(self) -> str:
+        return f'{self.host}:{self.port}'
+
+    def ws_url(self, mountpoint: str) -> str:
+        return f'ws://{self.host}:{self.port}/{mountpoint}'
+
+    def route(self, api: str, query: Query = ()) -> Route:
+        """获取发往这个端点某个接口的请求目标, 第一次使用时创建并缓存
+
+        Args:
+            api (str): 接口路径, 例如 ``v1/LuaApiCaller``
+            query (Query): 查询参数
+
+        Returns:
+            Route: 请求目标
+        """
+        route = self._routes.get((api, query))
+        if route is None:
+            url = URL(compile_template(API_URL)({'base_url': self.base_url, 'api': api}))
+            if query:
+                url = url.with_query(query)
+            route = self._routes[(api, query)] = Route(url, DEFAULT_HEADERS)
+        return route
+
+    def update(self, host: Optional[str] = None, port: Optional[int] = None,
+               protocol: Optional[str] = None):
+        """修改端点的地址, 用于运行时重新配置端点
+
+        地址和请求目标的缓存一起整体替换, 已经取走旧目标的请求不受影响, 之后的调用和心跳使用新地址;
+        正向ws连接在下一次重连时换到新地址, 连接状态和失败计数都清零
+
+        Args:
+            host (Optional[str]): 新地址, 为None时不变
+            port (Optional[int]): 新端口, 为None时不变
+            protocol (Optional[str]): 新协议, 为None时不变
+        """
+        host = self.host if host is None else host
+        port = self.port if port is None else port
+        protocol = self.protocol if protocol is None else protocol
+        self.host, self.port, self.protocol = host, port, protocol
+        self.base_url = f'{protocol}://{host}:{port}'
+        self._routes = {}
+        self.rtt = None
+        self.failures = 0
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        self.last_failure = time.monotonic()
+
+    def score(self) -> Tuple[bool, int, float]:
+        """健康度排序用的键, 越小越健康: 先看有没有连接, 再看失败次数, 最后看往返时间"""
+        return (
+            self.connections == 0,
+            self.failures,
+            self.rtt if self.rtt is not None else float('inf')
+        )
+
+    def __repr__(self) -> str:
+        return f'<Endpoint {self.name} connections={self.connections} failures={self.failures} rtt={self.rtt}>'
+
+
+def rank(endpoints: List[Endpoint]) -> List[Endpoint]:
+    """按健康度从高到低排列端点"""
+    if len(endpoints) == 1:
+        return endpoints
+    return sorted(endpoints, key=Endpoint.score)
@@ -1,9 +1,9 @@
 import json
 from enum import Enum
 from typing_extensions import Literal
-from typing import Any, Dict, Optional, Type, Union
+from typing import TYPE_CHECKING, Any, Dict, Optional, Type, Union
 
-from pydantic import BaseModel, Field, ValidationError
+from pydantic import BaseModel, Field, PrivateAttr, ValidationError
 
 from nonebot.typing import overrides
 from nonebot.utils import escape_tag
@@ -13,6 +13,9 @@ from nonebot.adapters import Message as BaseMessage
 from .. import log
 from ..message import MessageChain
 
+if TYPE_CHECKING:
+    from ..trace import TraceContext
+
 
 class UserPermission(str, Enum):
     """
@@ -126,6 +129,12 @@ class Event(BaseEvent):
     """
     self_id: int
     type: str
+    # 收到这个事件时创建的追踪上下文, 不参与序列化
+    _trace: Optional["TraceContext"] = PrivateAttr(None)
+
+    @property
+    def trace(self) -> Optional["TraceContext"]:
+        return self._trace
 
     @classmethod
     def new(cls, data: Dict[str, Any]) -> "Event":
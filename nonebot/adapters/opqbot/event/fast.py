@@ -0,0 +1,122 @@
+'''
+Description: 高频事件的快速解码
+    群消息和好友消息占了绝大部分流量, 而它们的结构是固定的, 没必要每次都让pydantic完整地校验一遍.
+    这里为这些事件按字段生成一份解码计划, 以类似 ``construct()`` 的方式直接填充字段(信任OPQ发来的数据),
+    同一个别名的消息链只构造一次并在各字段间共享. 缺少必需字段时抛出KeyError, 由调用方回退到 ``Event.new``.
+    除了不做类型转换之外, 得到的事件与 ``Event.new`` 一致: ``__fields_set__`` 只包含数据中出现的字段,
+    允许额外字段的模型会保留数据中的额外字段
+'''
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, Extra
+from pydantic.fields import ModelField
+
+from ..message import MessageChain
+from .base import Event
+from .message import ON_EVENT_GROUP_NEW_MSG, ON_EVENT_FRIEND_NEW_MSG
+
+# (字段名, 别名, 是否必需, 字段, 类型) 其中类型为 'model', 'chain' 或 'raw'
+_Plan = List[Tuple[str, str, bool, ModelField, str]]
+
+_plans: Dict[Type[BaseModel], _Plan] = {}
+
+# 走快速解码的事件
+FAST_EVENTS: Dict[str, Type[Event]] = {
+    'ON_EVENT_GROUP_NEW_MSG': ON_EVENT_GROUP_NEW_MSG,
+    'ON_EVENT_FRIEND_NEW_MSG': ON_EVENT_FRIEND_NEW_MSG,
+}
+
+
+def _plan(model: Type[BaseModel]) -> _Plan:
+    """为模型生成解码计划, 每个模型只生成一次"""
+    plan = _plans.get(model)
+    if plan is None:
+        plan = []
+        for name, field in model.__fields__.items():
+            type_ = field.type_
+            if isinstance(type_, type) and issubclass(type_, MessageChain):
+                kind = 'chain'
+            elif isinstance(type_, type) and issubclass(type_, BaseModel):
+                kind = 'model'
+            else:
+                kind = 'raw'
+            plan.append((name, field.alias, bool(field.required), field, kind))
+        _plans[model] = plan
+    return plan
+
+
+def construct_trusted(model: Type[BaseModel], data: Dict[str, Any],
+                      chains: Optional[Dict[str, MessageChain]] = None) -> Any:
+    """不经校验地构造模型, 嵌套的模型会被递归构造
+
+    Args:
+        model (Type[BaseModel]): 需要构造的模型
+        data (Dict[str, Any]): 以别名为键的数据
+        chains (Optional[Dict[str, MessageChain]]): 已经构造好的消息链, 以别名为键, 用于在字段间共享
+
+    Raises:
+        KeyError: 缺少必需的字段
+
+    Returns:
+        Any: 模型实例
+    """
+    if chains is None:
+        chains = {}
+    config = model.__config__
+    by_name = config.allow_population_by_field_name
+    values: Dict[str, Any] = {}
+    # 与pydantic一样, 只有数据中出现的字段才算作已设置
+    fields_set = set()
+    used = set()
+    for name, alias, required, field, kind in _plan(model):
+        if alias in data:
+            value = data[alias]
+            used.add(alias)
+        elif by_name and name in data:
+            value = data[name]
+            used.add(name)
+        elif required:
+            raise KeyError(alias)
+        else:
+            values[name] = field.get_default()
+            continue
+        fields_set.add(name)
+        if value is not None:
+            if kind == 'model' and isinstance(value, dict):
+                value = construct_trusted(field.type_, value, chains)
+            elif kind == 'chain' and not isinstance(value, MessageChain):
+                chain = chains.get(alias)
+                if chain is None:
+                    chain = chains[alias] = MessageChain(value)
+                value = chain
+        values[name] = value
+    if config.extra == Extra.allow:
+        for key, value in data.items():
+            if key not in used:
+                values[key] = value
+                fields_set.add(key)
+    instance = model.__new__(model)
+    object.__setattr__(instance, '__dict__', values)
+    object.__setattr__(instance, '__fields_set__', fields_set)
+    instance._init_private_attributes()
+    return instance
+
+
+def fast_new(data: Dict[str, Any]) -> Optional[Event]:
+    """快速解码一个事件
+
+    Args:
+        data (Dict[str, Any]): 与 ``Event.new`` 相同的事件数据
+
+    Raises:
+        KeyError: 缺少必需的字段, 调用方应回退到 ``Event.new``
+
+    Returns:
+        Optional[Event]: 不是高频事件时返回None
+    """
+    event_class = FAST_EVENTS.get(data['type'])
+    if event_class is None:
+        return None
+    # Bot传进来的self_id是字符串, 校验时会被转换为int, 这里手动转换一下
+    data['self_id'] = int(data['self_id'])
+    return construct_trusted(event_class, data)
@@ -1,13 +1,13 @@
 from datetime import datetime
-from pydantic import BaseModel, Field
-from typing import Any, Literal, Optional
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Any, FrozenSet, Literal, Optional, Tuple
 
 from nonebot.typing import overrides
+from nonebot.adapters import Event as BaseEvent
 
 from ..message import MessageChain
 from .base import (
     Event,
-    MsgBody,
     EventCenter,
     GroupInfoModel,
     MsgHead,
@@ -34,27 +34,46 @@ class MessageQuote(BaseModel):
 class MessageEvent(Event):
     """消息事件基类"""
     MsgHead: MsgHead
-    MsgBody: MessageChain = Field(alias='messageChain')
     Event: Optional[EventCenter] = Field(None)
     message_chain: MessageChain = Field(alias='messageChain')
+    # 命令索引标记的 (索引版本, 候选命令), 不参与序列化
+    _commands: Optional[Tuple[int, FrozenSet[str]]] = PrivateAttr(None)
+    # 刷屏限流的标记, 见flood模块
+    _flooded: bool = PrivateAttr(False)
+    _collapsed: int = PrivateAttr(0)
+
+    @property
+    def MsgBody(self) -> MessageChain:
+        """与 ``message_chain`` 是同一个对象, 保留这个名字是为了与OPQ的字段名对应"""
+        return self.message_chain
+
+    @property
+    def flooded(self) -> bool:
+        """发送者或群超出了入站限额"""
+        return self._flooded
+
+    @property
+    def collapsed(self) -> int:
+        """限流期间被合并到这个事件的消息数(包括它自己), 没有合并时为0"""
+        return self._collapsed
 
-    @overrides(Event)
+    @overrides(BaseEvent)
     def get_type(self) -> Literal["message"]:  # noqa
         return 'message'
 
-    @overrides(Event)
+    @overrides(BaseEvent)
     def get_message(self) -> MessageChain:
         return self.message_chain
 
-    @overrides(Event)
+    @overrides(BaseEvent)
     def get_plaintext(self) -> str:
         return self.message_chain.extract_plain_text()
 
-    @overrides(Event)
+    @overrides(BaseEvent)
     def get_user_id(self) -> str:
         raise NotImplementedError
 
-    @overrides(Event)
+    @overrides(BaseEvent)
     def get_session_id(self) -> str:
         raise NotImplementedError
 
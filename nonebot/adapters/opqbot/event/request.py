@@ -58,7 +58,7 @@ class NewFriendRequestEvent(RequestEvent):
           * ``operate: Literal[1, 2]``: 响应的操作类型
 
             * ``1``: 拒绝添加好友
-            * ``2``: 拒绝添加好友并添加黑名单，不再接收该用户的好友申请
+            * ``2``: 拒绝添加好友并添加黑名单，不再接收该用户的好友申请 (OPQ不支持, 会抛出 ``ApiNotAvailable``)
 
           * ``message: str``: 回复的信息
         """
@@ -112,8 +112,8 @@ class MemberJoinRequestEvent(RequestEvent):
 
             * ``1``: 拒绝入群
             * ``2``: 忽略请求
-            * ``3``: 拒绝入群并添加黑名单，不再接收该用户的入群申请
-            * ``4``: 忽略入群并添加黑名单，不再接收该用户的入群申请
+            * ``3``: 拒绝入群并添加黑名单，不再接收该用户的入群申请 (OPQ不支持, 会抛出 ``ApiNotAvailable``)
+            * ``4``: 忽略入群并添加黑名单，不再接收该用户的入群申请 (OPQ不支持, 会抛出 ``ApiNotAvailable``)
 
           * ``message: str``: 回复的信息
         """
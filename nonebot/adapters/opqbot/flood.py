@@ -0,0 +1,177 @@
+'''
+Description: 入站消息的刷屏限流
+    每个发送者和每个群各有一个令牌桶, 一条消息要同时从发送者和群的桶里拿到令牌才算正常.
+    桶的表按最近使用排序, 超过上限时丢掉最久没有消息的桶, 所以内存占用是有上限的.
+    超出限额的消息按配置的动作处理:
+        - ``drop``: 直接丢弃, 不进入process_event
+        - ``tag``: 照常派发, 但标记为刷屏消息, 匹配器可以用 ``not_flooded`` 规则忽略它
+        - ``collapse``: 限流期间每个桶只保留最新的一条, 等桶里有了令牌再派发, 并记录它代表了多少条消息
+'''
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .event import MessageEvent
+
+DROP = 'drop'
+TAG = 'tag'
+COLLAPSE = 'collapse'
+
+# (范围, 号码), 范围是 ``user`` 或 ``group``
+FloodKey = Tuple[str, int]
+
+
+class TokenBuckets:
+    """一组有数量上限的令牌桶
+
+    Args:
+        rate (float): 每秒补充的令牌数, 为0时不限流
+        burst (float): 桶的容量, 也就是允许的突发消息数
+        max_keys (int): 最多保留多少个桶
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        # 号码 -> [剩余令牌, 上次更新的时刻]
+        self._buckets: "OrderedDict[int, List[float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: int, now: float) -> float:
+        """从key的桶里拿一个令牌
+
+        Args:
+            key (int): 发送者或群的号码
+            now (float): 当前时刻
+
+        Returns:
+            float: 拿到令牌时为0, 否则是还要等多少秒才会有令牌
+        """
+        if not self.rate:
+            return 0
+        buckets = self._buckets
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= self.max_keys:
+                buckets.popitem(last=False)
+            bucket = buckets[key] = [self.burst, now]
+        else:
+            buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        return (1 - bucket[0]) / self.rate
+
+
+class FloodControl:
+    """按发送者和群限流
+
+    Args:
+        user_rate (float): 每个发送者每秒的消息数, 为0时不按发送者限流
+        user_burst (float): 每个发送者允许的突发消息数
+        group_rate (float): 每个群每秒的消息数, 为0时不按群限流
+        group_burst (float): 每个群允许的突发消息数
+        action (str): 超出限额时的动作, ``drop``, ``tag`` 或 ``collapse``
+        max_keys (int): 每种范围最多保留多少个桶
+    """
+
+    def __init__(self, user_rate: float = 0, user_burst: float = 10, group_rate: float = 0,
+                 group_burst: float = 50, action: str = DROP, max_keys: int = 10000):
+        if action not in (DROP, TAG, COLLAPSE):
+            raise ValueError(f'Unknown flood action {action!r}')
+        self.action = action
+        self.max_keys = max_keys
+        self.users = TokenBuckets(user_rate, user_burst, max_keys)
+        self.groups = TokenBuckets(group_rate, group_burst, max_keys)
+        # collapse时每个桶暂存的 [最新的事件, 代表的消息数, 派发函数, 原始帧]
+        self._held: Dict[FloodKey, list] = {}
+        self.stats: Dict[str, int] = {
+            'limited': 0,
+            'dropped': 0,
+            'tagged': 0,
+            'collapsed': 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.users.rate or self.groups.rate)
+
+    @property
+    def held(self) -> int:
+        return len(self._held)
+
+    def check(self, event: MessageEvent) -> Optional[Tuple[FloodKey, float]]:
+        """检查事件是否超出限额, 先检查发送者, 被限流的发送者不会消耗群的令牌
+
+        Returns:
+            Optional[Tuple[FloodKey, float]]: 没有超出时为None, 否则是超出限额的桶和还要等待的秒数
+        """
+        now = time.monotonic()
+        head = event.MsgHead
+        wait = self.users.take(head.SenderUin, now)
+        if wait:
+            return ('user', head.SenderUin), wait
+        if head.GroupInfo is not None:
+            wait = self.groups.take(head.GroupInfo.GroupCode, now)
+            if wait:
+                return ('group', head.GroupInfo.GroupCode), wait
+        return None
+
+    def limit(self, event: MessageEvent, key: FloodKey, wait: float,
+              dispatch: Callable[[MessageEvent], None], frame: Optional[Dict[str, Any]] = None) -> bool:
+        """按配置的动作处理超出限额的事件
+
+        Args:
+            event (MessageEvent): 超出限额的事件
+            key (FloodKey): 超出限额的桶
+            wait (float): 还要等待的秒数
+            dispatch (Callable[[MessageEvent], None]): collapse时到期后用来派发暂存事件的函数
+            frame (Optional[Dict[str, Any]]): 事件的原始帧, collapse时和事件一起暂存, 关闭时由 ``clear`` 交还
+
+        Returns:
+            bool: 调用方是否还要照常派发这个事件
+        """
+        self.stats['limited'] += 1
+        if self.action == TAG:
+            event._flooded = True
+            self.stats['tagged'] += 1
+            return True
+        if self.action == COLLAPSE:
+            held = self._held.get(key)
+            if held is not None:
+                held[0] = event
+                held[1] += 1
+                held[3] = frame
+                self.stats['collapsed'] += 1
+                return False
+            if len(self._held) < self.max_keys:
+                self._held[key] = [event, 1, dispatch, frame]
+                asyncio.get_running_loop().call_later(wait, self._release, key)
+                self.stats['collapsed'] += 1
+                return False
+        self.stats['dropped'] += 1
+        return False
+
+    def _release(self, key: FloodKey):
+        held = self._held.pop(key, None)
+        if held is None:
+            return
+        event, count, dispatch, _ = held
+        # 派发暂存的事件也要消耗一个令牌, 否则紧接着的下一条消息又能通过
+        buckets = self.users if key[0] == 'user' else self.groups
+        buckets.take(key[1], time.monotonic())
+        event._flooded = True
+        event._collapsed = count
+        dispatch(event)
+
+    def clear(self) -> List[Dict[str, Any]]:
+        """取出所有暂存事件的原始帧, 之后到期的也不再派发, 关闭时调用"""
+        frames = [held[3] for held in self._held.values() if held[3] is not None]
+        self._held.clear()
+        return frames
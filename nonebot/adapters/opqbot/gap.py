@@ -0,0 +1,168 @@
+'''
+Description: 断线期间的消息缺口检测与补齐
+    记录每个会话最后见到的MsgSeq/MsgTime, 新消息的序号不连续时就说明中间有消息丢了(通常是断线重连期间).
+    OPQ没有在这里提供固定的历史消息接口, 所以补齐通过 ``GapTracker.fetcher`` 这个可插拔的拉取函数完成,
+    补齐受时间, 数量和频率的限制, 并在放行触发缺口的那条消息之前完成.
+    频率按会话限制, 不同会话的补齐可以同时进行(总数有上限), 一个群的补齐不会拖慢其他群
+'''
+import time
+import asyncio
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .history import SessionKey
+
+if TYPE_CHECKING:
+    from .bot import Bot
+
+# 拉取函数: (bot, 会话, 起始序号, 结束序号) -> 这段序号内的原始事件帧列表
+Fetcher = Callable[["Bot", SessionKey, int, int], Awaitable[List[Dict[str, Any]]]]
+
+
+class Gap:
+    """一个消息缺口
+
+    Attributes:
+        session (SessionKey): 会话
+        begin (int): 丢失的第一条消息的MsgSeq
+        end (int): 丢失的最后一条消息的MsgSeq
+        last_time (int): 缺口之前最后一条消息的MsgTime
+        time (int): 缺口之后第一条消息的MsgTime
+    """
+    __slots__ = ('session', 'begin', 'end', 'last_time', 'time')
+
+    def __init__(self, session: SessionKey, begin: int, end: int, last_time: int, time: int):
+        self.session = session
+        self.begin = begin
+        self.end = end
+        self.last_time = last_time
+        self.time = time
+
+    @property
+    def size(self) -> int:
+        return self.end - self.begin + 1
+
+    def __repr__(self) -> str:
+        return f'<Gap {self.session} {self.begin}..{self.end}>'
+
+
+class GapTracker:
+    """消息缺口追踪器
+
+    Args:
+        max_sessions (int): 最多追踪多少个会话
+        max_age (float): 缺口跨越的时间超过这个秒数时不补齐
+        max_count (int): 单个缺口最多补齐多少条消息, 超出时只补齐最近的部分
+        min_interval (float): 同一会话两次拉取之间的最小间隔(秒)
+        concurrency (int): 最多同时进行多少个拉取, 为0时不限制
+    """
+
+    def __init__(self, max_sessions: int = 10000, max_age: float = 300,
+                 max_count: int = 50, min_interval: float = 1, concurrency: int = 4):
+        self.max_sessions = max_sessions
+        self.max_age = max_age
+        self.max_count = max_count
+        self.min_interval = min_interval
+        self.concurrency = concurrency
+        self.fetcher: Optional[Fetcher] = None
+        # 会话 -> (最后的MsgSeq, 最后的MsgTime)
+        self._last: "OrderedDict[SessionKey, Tuple[int, int]]" = OrderedDict()
+        # 信号量要在事件循环里创建, 见backfill
+        self._slots: Optional[asyncio.Semaphore] = None
+        # 会话 -> [锁, 正在使用的缺口数], 同一会话的缺口按顺序拉取, 没人使用时删除
+        self._locks: Dict[SessionKey, list] = {}
+        # 会话 -> 上次拉取结束的时刻
+        self._last_fetch: "OrderedDict[SessionKey, float]" = OrderedDict()
+        self.stats: Dict[str, int] = {
+            'gaps': 0,
+            'missed': 0,
+            'backfilled': 0,
+            'skipped': 0,
+        }
+
+    def observe(self, session: SessionKey, seq: int, msg_time: int) -> Optional[Gap]:
+        """记录一条消息, 并检查它之前是否有缺口
+
+        Args:
+            session (SessionKey): 会话
+            seq (int): MsgSeq
+            msg_time (int): MsgTime
+
+        Returns:
+            Optional[Gap]: 发现的缺口
+        """
+        last = self._last.get(session)
+        if last is None:
+            self._last[session] = (seq, msg_time)
+            if len(self._last) > self.max_sessions:
+                self._last.popitem(last=False)
+            return None
+        self._last.move_to_end(session)
+        last_seq, last_time = last
+        if seq <= last_seq:
+            # 乱序或者补齐回来的旧消息, 不更新位置
+            return None
+        self._last[session] = (seq, msg_time)
+        if seq == last_seq + 1:
+            return None
+        gap = Gap(session, last_seq + 1, seq - 1, last_time, msg_time)
+        self.stats['gaps'] += 1
+        self.stats['missed'] += gap.size
+        return gap
+
+    def advance(self, session: SessionKey, seq: int, msg_time: int):
+        """Bot自己发出的消息也会占用序号, 发送成功后用这个方法推进位置, 避免误报缺口"""
+        last = self._last.get(session)
+        if last is not None and seq > last[0]:
+            self._last[session] = (seq, msg_time)
+
+    def should_backfill(self, gap: Gap) -> bool:
+        if self.fetcher is None:
+            return False
+        if self.max_age and gap.time - gap.last_time > self.max_age:
+            self.stats['skipped'] += 1
+            return False
+        return True
+
+    async def backfill(self, bot: "Bot", gap: Gap) -> List[Dict[str, Any]]:
+        """拉取缺口中的消息, 同一会话的缺口排队并按 ``min_interval`` 限速
+
+        Args:
+            bot (Bot): 用于调用API的Bot
+            gap (Gap): 需要补齐的缺口
+
+        Returns:
+            List[Dict[str, Any]]: 拉取到的原始事件帧
+        """
+        if self.fetcher is None:
+            return []
+        begin = max(gap.begin, gap.end - self.max_count + 1) if self.max_count else gap.begin
+        if self._slots is None and self.concurrency:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        session = gap.session
+        entry = self._locks.get(session)
+        if entry is None:
+            entry = self._locks[session] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                wait = self._last_fetch.get(session, 0) + self.min_interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    if self._slots is None:
+                        frames = await self.fetcher(bot, session, begin, gap.end)
+                    else:
+                        async with self._slots:
+                            frames = await self.fetcher(bot, session, begin, gap.end)
+                finally:
+                    self._last_fetch[session] = time.monotonic()
+                    self._last_fetch.move_to_end(session)
+                    if len(self._last_fetch) > self.max_sessions:
+                        self._last_fetch.popitem(last=False)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[session]
+        self.stats['backfilled'] += len(frames)
+        return frames
@@ -0,0 +1,214 @@
+'''
+Description: 按会话保存最近的消息
+    引用回复需要原消息的MsgSeq/MsgTime/MsgUid, 撤回事件只带了消息ID,
+    这里为每个群和好友保留一段有上限的消息记录, 这样构造引用和查询被撤回的消息都不需要请求网络
+'''
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+from .event import (
+    Event,
+    GroupRecallEvent,
+    FriendRecallEvent,
+    ON_EVENT_GROUP_NEW_MSG,
+    ON_EVENT_FRIEND_NEW_MSG,
+)
+from .message import MessageChain, MessageSegment
+
+# 会话键, 形如 ('group', 群号) 或 ('friend', QQ号)
+SessionKey = Tuple[str, int]
+
+
+def group_session(group: int) -> SessionKey:
+    return ('group', group)
+
+
+def friend_session(uin: int) -> SessionKey:
+    return ('friend', uin)
+
+
+def session_of(event: Event) -> Optional[SessionKey]:
+    """获取消息事件所属的会话, 非好友/群消息时为None"""
+    if isinstance(event, ON_EVENT_GROUP_NEW_MSG):
+        if event.MsgHead.GroupInfo is not None:
+            return group_session(event.MsgHead.GroupInfo.GroupCode)
+    elif isinstance(event, ON_EVENT_FRIEND_NEW_MSG):
+        return friend_session(event.MsgHead.SenderUin)
+    return None
+
+
+class HistoryRecord:
+    """一条历史消息
+
+    Args:
+        seq (int): MsgSeq
+        uid (int): MsgUid
+        time (int): MsgTime
+        random (int): MsgRandom
+        sender (int): 发送者QQ号
+        target (int): 接收者的QQ号或群号
+        chain (List[Dict[str, Any]]): 转换为Mirai格式后的原始消息段, 需要时才构造为MessageChain
+    """
+    __slots__ = ('seq', 'uid', 'time', 'random', 'sender', 'target', 'chain')
+
+    def __init__(self, seq: int, uid: int, time: int, random: int,
+                 sender: int, target: int, chain: List[Dict[str, Any]]):
+        self.seq = seq
+        self.uid = uid
+        self.time = time
+        self.random = random
+        self.sender = sender
+        self.target = target
+        self.chain = chain
+
+    @property
+    def message_chain(self) -> MessageChain:
+        return MessageChain(self.chain)
+
+    def reply_to(self) -> Dict[str, int]:
+        """生成发送消息时OPQ需要的ReplyTo字段"""
+        return {
+            "MsgSeq": self.seq,
+            "MsgTime": self.time,
+            "MsgUid": self.uid
+        }
+
+
+class _Session:
+    """单个会话的环形缓冲区, 同时按MsgSeq和MsgUid建立索引"""
+    __slots__ = ('records', 'by_seq', 'by_uid')
+
+    def __init__(self, size: int):
+        self.records: Deque[HistoryRecord] = deque(maxlen=size)
+        self.by_seq: Dict[int, HistoryRecord] = {}
+        self.by_uid: Dict[int, HistoryRecord] = {}
+
+    def append(self, record: HistoryRecord):
+        if len(self.records) == self.records.maxlen:
+            oldest = self.records[0]
+            # 只删除仍然指向这条记录的索引, 避免误删序号重复的新记录
+            if self.by_seq.get(oldest.seq) is oldest:
+                del self.by_seq[oldest.seq]
+            if self.by_uid.get(oldest.uid) is oldest:
+                del self.by_uid[oldest.uid]
+        self.records.append(record)
+        self.by_seq[record.seq] = record
+        self.by_uid[record.uid] = record
+
+
+class MessageHistory:
+    """按会话保存的消息历史
+
+    每个会话是一个定长的环形缓冲区, 会话总数也有上限, 超出时淘汰最久没有消息的会话
+
+    Args:
+        size (int): 每个会话最多保留的消息数, 为0时不记录
+        max_sessions (int): 最多保留的会话数
+    """
+
+    def __init__(self, size: int = 100, max_sessions: int = 1000):
+        self.size = size
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[SessionKey, _Session]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def add(self, session: SessionKey, record: HistoryRecord):
+        """向会话追加一条消息
+
+        Args:
+            session (SessionKey): 会话键
+            record (HistoryRecord): 消息记录
+        """
+        if self.size <= 0:
+            return
+        store = self._sessions.get(session)
+        if store is None:
+            store = self._sessions[session] = _Session(self.size)
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session)
+        store.append(record)
+
+    def record(self, event: Event, chain: List[Dict[str, Any]]):
+        """记录一条收到的消息事件, 非好友/群消息会被忽略
+
+        Args:
+            event (Event): 已经解析好的事件
+            chain (List[Dict[str, Any]]): 转换为Mirai格式后的原始消息段
+        """
+        session = session_of(event)
+        if session is None:
+            return
+        head = event.MsgHead  # type: ignore
+        self.add(session, HistoryRecord(
+            seq=head.MsgSeq,
+            uid=head.MsgUid,
+            time=head.MsgTime,
+            random=head.MsgRandom,
+            sender=head.SenderUin,
+            target=head.ToUin if isinstance(event, ON_EVENT_FRIEND_NEW_MSG) else head.FromUin,
+            chain=chain,
+        ))
+
+    def get(self, session: SessionKey, seq: Optional[int] = None,
+            uid: Optional[int] = None) -> Optional[HistoryRecord]:
+        """按MsgSeq或MsgUid查找一条消息
+
+        Args:
+            session (SessionKey): 会话键
+            seq (Optional[int]): MsgSeq
+            uid (Optional[int]): MsgUid, 同时给出时优先使用
+
+        Returns:
+            Optional[HistoryRecord]: 找不到时为None
+        """
+        store = self._sessions.get(session)
+        if store is None:
+            return None
+        if uid is not None:
+            return store.by_uid.get(uid)
+        if seq is not None:
+            return store.by_seq.get(seq)
+        return None
+
+    def latest(self, session: SessionKey) -> Optional[HistoryRecord]:
+        store = self._sessions.get(session)
+        return store.records[-1] if store and store.records else None
+
+    def get_recalled(self, event: Union[GroupRecallEvent, FriendRecallEvent]) -> Optional[HistoryRecord]:
+        """查找撤回事件对应的原消息
+
+        Args:
+            event (Union[GroupRecallEvent, FriendRecallEvent]): 撤回事件
+
+        Returns:
+            Optional[HistoryRecord]: 原消息已被淘汰时为None
+        """
+        if isinstance(event, GroupRecallEvent):
+            return self.get(group_session(event.group.GroupCode), seq=event.message_id)
+        return self.get(friend_session(event.author_id), seq=event.message_id)
+
+    def quote(self, session: SessionKey, seq: int) -> Optional[MessageSegment]:
+        """用历史消息构造一个引用消息段
+
+        Args:
+            session (SessionKey): 会话键
+            seq (int): 被引用消息的MsgSeq
+
+        Returns:
+            Optional[MessageSegment]: 找不到原消息时为None
+        """
+        record = self.get(session, seq=seq)
+        if record is None:
+            return None
+        kind, code = session
+        return MessageSegment.quote(
+            id=record.seq,
+            group_id=code if kind == 'group' else 0,
+            sender_id=record.sender,
+            target_id=record.target,
+            origin=record.message_chain,
+        )
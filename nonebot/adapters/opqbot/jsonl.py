@@ -0,0 +1,59 @@
+'''
+Description: 在后台线程里批量追加JSON-lines文件
+    追踪导出和关闭时保存事件帧都要写文件, 直接在事件循环里写会让所有事件跟着等磁盘.
+    写入先放进缓冲区, 等一小段时间后整批交给一个单线程的线程池追加到文件, 一批只打开一次文件;
+    只有一个线程写文件, 所以行的顺序和写入的顺序一致
+'''
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from . import log
+
+
+class LineWriter:
+    """批量追加的JSON-lines文件
+
+    Args:
+        path (str): 文件路径
+        flush_interval (float): 批量写入的等待时间(秒), 这段时间内的写入合并为一次
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.1):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='opqbot-jsonl')
+        self._buffer: List[str] = []
+        self._flush_task: Optional["asyncio.Task"] = None
+
+    def write(self, record: Dict[str, Any]):
+        """追加一行, 不等待写入完成, 必须在事件循环中调用"""
+        self._buffer.append(json.dumps(record, ensure_ascii=False) + '\n')
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """把缓冲区中的行写入文件"""
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._append, lines)
+        except Exception as e:
+            log.error(f"Failed to write {len(lines)} lines to {self.path}", e)
+
+    def _append(self, lines: List[str]):
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.writelines(lines)
+
+    async def close(self):
+        """写入缓冲区中剩下的行, 关闭时调用"""
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
@@ -0,0 +1,95 @@
+'''
+Description: 事件循环延迟监控与过载降级
+    定时sleep一小段时间, 实际醒来比预期晚了多少就是事件循环的延迟.
+    延迟超过阈值时进入降级状态, 丢弃低优先级的事件(通知, 同步消息等), 只保留消息, 请求, 元事件
+    和会改动群成员缓存的通知;
+    延迟回落到阈值的一半以下才退出降级, 避免在阈值附近来回切换
+'''
+import asyncio
+from functools import lru_cache
+from typing import Optional, Type
+
+from . import log
+from .cache import CACHE_EVENTS
+from .event import Event, MessageEvent, MetaEvent, RequestEvent
+
+
+def _find_event_class(event_name: str) -> Optional[Type[Event]]:
+    pending = [Event]
+    while pending:
+        cls = pending.pop()
+        if cls.__name__ == event_name:
+            return cls
+        pending.extend(cls.__subclasses__())
+    return None
+
+
+@lru_cache(maxsize=None)
+def is_low_priority(event_name: str) -> bool:
+    """过载时是否可以丢弃这种事件, 每种事件只判断一次
+
+    Args:
+        event_name (str): OPQ的EventName
+
+    Returns:
+        bool: 通知, 同步消息和未知事件为True, 消息, 请求, 元事件和入群/退群/权限变更等通知为False
+    """
+    cls = _find_event_class(event_name)
+    if cls is None:
+        return True
+    if issubclass(cls, MessageEvent):
+        # 自己在其他客户端发出的消息同步回来, 不需要及时处理
+        return 'Sync' in cls.__name__
+    return not issubclass(cls, (RequestEvent, MetaEvent, *CACHE_EVENTS))
+
+
+class LagMonitor:
+    """事件循环延迟监控
+
+    Args:
+        interval (float): 采样间隔(秒), 为0时不监控
+        threshold (float): 延迟超过多少秒时开始丢弃低优先级事件, 为0时只监控不降级
+    """
+
+    def __init__(self, interval: float = 0.5, threshold: float = 0.2):
+        self.interval = interval
+        self.threshold = threshold
+        # 最近一次采样的延迟与启动以来的最大延迟(秒)
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.shedding = False
+        # 丢弃的事件数
+        self.shed = 0
+        self._task: Optional["asyncio.Task"] = None
+
+    def start(self) -> Optional["asyncio.Task"]:
+        if self.interval and self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    def should_shed(self, event_name: str) -> bool:
+        """当前是否应该丢弃这个事件, 丢弃时计数"""
+        if not self.shedding or not is_low_priority(event_name):
+            return False
+        self.shed += 1
+        return True
+
+    def record(self, lag: float):
+        """记录一次采样的延迟并更新降级状态"""
+        self.lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        if not self.threshold:
+            return
+        if not self.shedding and lag > self.threshold:
+            self.shedding = True
+            log.warning(f"Event loop lag {lag * 1000:.0f}ms, shedding low priority events")
+        elif self.shedding and lag < self.threshold / 2:
+            self.shedding = False
+            log.info(f"Event loop lag back to {lag * 1000:.0f}ms, {self.shed} events shed so far")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            begin = loop.time()
+            await asyncio.sleep(self.interval)
+            self.record(max(loop.time() - begin - self.interval, 0.0))
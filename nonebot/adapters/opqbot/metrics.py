@@ -0,0 +1,159 @@
+'''
+Description: 适配器的运行指标
+    收集计数器, 仪表和直方图, 可以导出为OpenMetrics(Prometheus)文本格式
+    未启用时使用NullMetrics, 所有记录操作都是空函数, 几乎没有开销
+'''
+import bisect
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 标签以有序元组的形式储存, 例如 (('cmd', 'MessageSvc.PbSendMsg'),)
+Labels = Tuple[Tuple[str, str], ...]
+
+# 默认的直方图桶, 单位秒, 覆盖从10µs到10s
+DEFAULT_BUCKETS = (
+    0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005,
+    0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0
+)
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    escaped = (
+        (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in items
+    )
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """指标仓库
+
+    所有指标都在第一次记录时自动创建, 名称会自动加上 ``opqbot_`` 前缀
+
+    Args:
+        buckets (Sequence[float]): 直方图使用的桶
+    """
+    enabled = True
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+        # 在导出前调用的回调, 用来刷新那些按需计算的仪表(例如连接数)
+        self._collectors: List[Callable[["Metrics"], None]] = []
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, help: str):
+        """为指标添加说明文字"""
+        self._help[name] = help
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        """计数器自增"""
+        series = self._counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str):
+        """设置仪表的值"""
+        self._gauges.setdefault(name, {})[_labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels: str):
+        """向直方图记录一个观测值, 单位通常为秒"""
+        series = self._histograms.setdefault(name, {})
+        key = _labels(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = _Histogram(self.buckets)
+        histogram.observe(value)
+
+    def add_collector(self, collector: Callable[["Metrics"], None]):
+        """注册一个在导出前执行的回调"""
+        self._collectors.append(collector)
+
+    def collect(self):
+        for collector in self._collectors:
+            collector(self)
+
+    def snapshot(self) -> Dict[str, Dict[Labels, float]]:
+        """导出当前所有计数器与仪表的值, 直方图只导出总数与总和, 便于交给自定义的上报回调"""
+        self.collect()
+        result: Dict[str, Dict[Labels, float]] = {}
+        for name, series in self._counters.items():
+            result[name] = dict(series)
+        for name, series in self._gauges.items():
+            result[name] = dict(series)
+        for name, histograms in self._histograms.items():
+            result[f'{name}_count'] = {k: h.count for k, h in histograms.items()}
+            result[f'{name}_sum'] = {k: h.sum for k, h in histograms.items()}
+        return result
+
+    def render(self) -> str:
+        """导出为OpenMetrics文本格式"""
+        self.collect()
+        lines: List[str] = []
+
+        def header(name: str, kind: str):
+            full = f'opqbot_{name}'
+            if name in self._help:
+                lines.append(f'# HELP {full} {self._help[name]}')
+            lines.append(f'# TYPE {full} {kind}')
+            return full
+
+        for name, series in sorted(self._counters.items()):
+            full = header(name, 'counter')
+            for labels, value in series.items():
+                lines.append(f'{full}_total{_format_labels(labels)} {value}')
+        for name, series in sorted(self._gauges.items()):
+            full = header(name, 'gauge')
+            for labels, value in series.items():
+                lines.append(f'{full}{_format_labels(labels)} {value}')
+        for name, histograms in sorted(self._histograms.items()):
+            full = header(name, 'histogram')
+            for labels, histogram in histograms.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{full}_bucket{_format_labels(labels, ("le", repr(bound)))} {cumulative}')
+                lines.append(f'{full}_bucket{_format_labels(labels, ("le", "+Inf"))} {histogram.count}')
+                lines.append(f'{full}_sum{_format_labels(labels)} {histogram.sum}')
+                lines.append(f'{full}_count{_format_labels(labels)} {histogram.count}')
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+class NullMetrics(Metrics):
+    """未启用指标时的替身, 所有记录操作都什么也不做"""
+    enabled = False
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        pass
+
+    def set(self, name: str, value: float, **labels: str):
+        pass
+
+    def observe(self, name: str, value: float, **labels: str):
+        pass
@@ -0,0 +1,349 @@
+'''
+Description: 一个本地的OPQ替身服务, 用于离线联调与吞吐测试
+    它在 /ws 上推送OPQ格式的事件, 在 v1/LuaApiCaller 上响应 MagicCgiCmd 调用
+    延迟, 错误注入以及事件生成速率都可以配置
+
+    e.g.
+        python -m nonebot.adapters.opqbot.mock --qq 10000 --event-rate 200 --latency 5-20 --error-rate 0.01
+'''
+import json
+import time
+import random
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    from aiohttp import web, WSMsgType
+except ImportError:  # pragma: no cover
+    raise ImportError(
+        "请先安装 aiohttp 再使用OPQ替身服务: pip install aiohttp"
+    ) from None
+
+
+class MockOPQServer:
+    """OPQ替身服务
+    这里只实现了适配器会用到的那部分协议, 返回的数据都是伪造的, 但结构与OPQ一致
+
+    Args:
+        qq (int): 替身服务登录的QQ号
+        mountpoint (str): ws的挂载点, 与 ``opqbot_mountpoint`` 对应
+        latency (Tuple[float, float]): API响应的延迟范围, 单位毫秒
+        error_rate (float): API调用失败的概率, 一半返回HTTP 500, 一半返回 Ret != 0
+        event_rate (float): 每秒向每个连接推送的事件数, 为0时不主动推送
+        drop_interval (float): 每隔多少秒主动断开所有ws连接, 用于测试重连, 为0时不断开
+        groups (int): 伪造的群数量
+        members (int): 每个群伪造的成员数量
+    """
+
+    def __init__(
+        self,
+        qq: int = 10000,
+        mountpoint: str = "ws",
+        latency: Tuple[float, float] = (0, 0),
+        error_rate: float = 0,
+        event_rate: float = 0,
+        drop_interval: float = 0,
+        groups: int = 5,
+        members: int = 20,
+    ):
+        self.qq = qq
+        self.mountpoint = mountpoint.strip("/")
+        self.latency = latency
+        self.error_rate = error_rate
+        self.event_rate = event_rate
+        self.drop_interval = drop_interval
+        self.groups = [100000 + i for i in range(groups)]
+        self.members = [200000 + i for i in range(members)]
+        # 当前连上来的ws
+        self.connections: Set[web.WebSocketResponse] = set()
+        # 每个群/好友会话的消息序号, 模拟OPQ中连续递增的MsgSeq
+        self._seq: Dict[int, int] = {}
+        self._tasks: List["asyncio.Task"] = []
+        self.stats: Dict[str, Any] = {
+            "connections": 0,
+            "disconnections": 0,
+            "events_sent": 0,
+            "send_wait": 0.0,
+            "api_calls": {},
+            "api_errors": 0,
+        }
+
+    def make_app(self) -> web.Application:
+        """构建aiohttp应用, 可以直接交给 ``web.run_app`` 或者测试客户端"""
+        app = web.Application()
+        app.router.add_get(f"/{self.mountpoint}", self._handle_ws)
+        app.router.add_post("/v1/LuaApiCaller", self._handle_api)
+        app.router.add_post("/v1/upload", self._handle_api)
+        app.router.add_get("/v1/clusterinfo", self._handle_clusterinfo)
+        app.router.add_get("/stats", self._handle_stats)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def _on_startup(self, app: web.Application):
+        if self.event_rate > 0:
+            self._tasks.append(asyncio.create_task(self._event_generator()))
+        if self.drop_interval > 0:
+            self._tasks.append(asyncio.create_task(self._dropper()))
+
+    async def _on_cleanup(self, app: web.Application):
+        for task in self._tasks:
+            task.cancel()
+        for ws in list(self.connections):
+            await ws.close()
+
+    def _next_seq(self, session: int) -> int:
+        self._seq[session] = self._seq.get(session, 0) + 1
+        return self._seq[session]
+
+    def group_message(self, group: int, sender: int, content: str) -> Dict[str, Any]:
+        """伪造一条 ``ON_EVENT_GROUP_NEW_MSG`` 事件帧
+
+        Args:
+            group (int): 群号
+            sender (int): 发送者QQ号
+            content (str): 消息的文字内容
+
+        Returns:
+            Dict[str, Any]: 与OPQ推送一致的事件帧
+        """
+        seq = self._next_seq(group)
+        return self._frame("ON_EVENT_GROUP_NEW_MSG", {
+            "FromUin": group,
+            "FromUid": "",
+            "FromType": 2,
+            "MsgType": 82,
+            "SenderUin": sender,
+            "MsgSeq": seq,
+            "GroupInfo": {
+                "GroupCard": f"card_{sender}",
+                "GroupCode": group,
+                "GroupInfoSeq": seq,
+                "GroupLevel": 1,
+                "GroupRank": 0,
+                "GroupType": 0,
+                "GroupName": f"group_{group}",
+            },
+        }, content)
+
+    def friend_message(self, sender: int, content: str) -> Dict[str, Any]:
+        """伪造一条 ``ON_EVENT_FRIEND_NEW_MSG`` 事件帧
+
+        Args:
+            sender (int): 发送者QQ号
+            content (str): 消息的文字内容
+
+        Returns:
+            Dict[str, Any]: 与OPQ推送一致的事件帧
+        """
+        return self._frame("ON_EVENT_FRIEND_NEW_MSG", {
+            "FromUin": sender,
+            "FromUid": f"u_{sender}",
+            "FromType": 1,
+            "MsgType": 166,
+            "SenderUin": sender,
+            "MsgSeq": self._next_seq(sender),
+            "GroupInfo": None,
+        }, content)
+
+    def _frame(self, event_name: str, head: Dict[str, Any], content: str) -> Dict[str, Any]:
+        now = int(time.time())
+        sender = head["SenderUin"]
+        return {
+            "CurrentPacket": {
+                "EventData": {
+                    "MsgHead": {
+                        "ToUin": self.qq,
+                        "ToUid": f"u_{self.qq}",
+                        "SenderUid": f"u_{sender}",
+                        "SenderNick": f"nick_{sender}",
+                        "C2cCmd": 0,
+                        "MsgTime": now,
+                        "MsgRandom": random.randint(0, 2 ** 31),
+                        "MsgUid": random.randint(0, 2 ** 62),
+                        "C2CTempMessageHead": None,
+                        **head,
+                    },
+                    "MsgBody": {
+                        "SubMsgType": 0,
+                        "Content": content,
+                        "AtUinLists": None,
+                        "Images": None,
+                        "Video": None,
+                        "Voice": None,
+                    },
+                    "Event": None,
+                },
+                "EventName": event_name,
+            },
+            "CurrentQQ": self.qq,
+        }
+
+    def random_event(self) -> Dict[str, Any]:
+        """按9:1的比例随机生成群消息与好友消息"""
+        sender = random.choice(self.members)
+        if random.random() < 0.9:
+            return self.group_message(random.choice(self.groups), sender, f"/echo {random.random()}")
+        return self.friend_message(sender, f"/echo {random.random()}")
+
+    async def broadcast(self, frame: Dict[str, Any]):
+        """向所有连接推送同一个事件帧, 并统计发送时的等待时间(背压)"""
+        data = json.dumps(frame, ensure_ascii=False)
+        for ws in list(self.connections):
+            begin = time.perf_counter()
+            try:
+                await ws.send_str(data)
+            except ConnectionError:
+                continue
+            self.stats["send_wait"] += time.perf_counter() - begin
+            self.stats["events_sent"] += 1
+
+    async def _event_generator(self):
+        interval = 1 / self.event_rate
+        next_time = time.perf_counter()
+        while True:
+            next_time += interval
+            if self.connections:
+                await self.broadcast(self.random_event())
+            await asyncio.sleep(max(0, next_time - time.perf_counter()))
+
+    async def _dropper(self):
+        while True:
+            await asyncio.sleep(self.drop_interval)
+            for ws in list(self.connections):
+                await ws.close()
+
+    async def _delay(self):
+        low, high = self.latency
+        if high > 0:
+            await asyncio.sleep(random.uniform(low, high) / 1000)
+
+    async def _handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections.add(ws)
+        self.stats["connections"] += 1
+        try:
+            async for msg in ws:
+                # OPQ不会处理客户端发来的帧, 这里只是把它们读掉
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self.connections.discard(ws)
+            self.stats["disconnections"] += 1
+        return ws
+
+    async def _handle_api(self, request: web.Request) -> web.Response:
+        await self._delay()
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            return web.json_response({"CgiBaseResponse": {"Ret": -1, "ErrMsg": "bad json"}}, status=400)
+        cmd: str = body.get("CgiCmd", "")
+        calls: Dict[str, int] = self.stats["api_calls"]
+        calls[cmd] = calls.get(cmd, 0) + 1
+        if self.error_rate and random.random() < self.error_rate:
+            self.stats["api_errors"] += 1
+            if random.random() < 0.5:
+                return web.Response(status=500, text="injected error")
+            return web.json_response({
+                "CgiBaseResponse": {"Ret": 241, "ErrMsg": "injected error"},
+                "ResponseData": None,
+                "Data": None,
+            })
+        return web.json_response({
+            "CgiBaseResponse": {"Ret": 0, "ErrMsg": ""},
+            "ResponseData": self._response_data(cmd, body.get("CgiRequest") or {}),
+            "Data": None,
+        })
+
+    def _response_data(self, cmd: str, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if cmd == "MessageSvc.PbSendMsg":
+            return {
+                "MsgTime": int(time.time()),
+                "MsgSeq": self._next_seq(request.get("ToUin", 0)),
+                "MsgUid": random.randint(0, 2 ** 62),
+            }
+        if cmd == "GetGroupLists":
+            return {
+                "GroupLists": [{
+                    "GroupCode": group,
+                    "GroupName": f"group_{group}",
+                    "GroupOwner": self.members[0],
+                    "MemberCnt": len(self.members),
+                    "GroupCnt": len(self.groups),
+                    "CreateTime": 0,
+                } for group in self.groups],
+                "LastBuffer": "",
+            }
+        if cmd == "GetGroupMemberLists":
+            return {
+                "MemberLists": [{
+                    "Uin": uin,
+                    "Uid": f"u_{uin}",
+                    "Nick": f"nick_{uin}",
+                    "GroupCard": f"card_{uin}",
+                    "MemberFlag": 2 if index == 0 else (1 if index < 3 else 0),
+                    "Level": 1,
+                    "JoinTime": 0,
+                    "LastSpeakTime": 0,
+                    "CreditLevel": 1,
+                } for index, uin in enumerate(self.members)],
+                "LastBuffer": "",
+            }
+        if cmd == "PicUp.DataUp":
+            return {
+                "FileMd5": "00000000000000000000000000000000",
+                "FileSize": 0,
+                "FileId": random.randint(0, 2 ** 31),
+            }
+        return None
+
+    async def _handle_clusterinfo(self, request: web.Request) -> web.Response:
+        await self._delay()
+        return web.json_response({
+            "CgiBaseResponse": {"Ret": 0, "ErrMsg": ""},
+            "ResponseData": {
+                "QQUsers": [{"QQ": self.qq, "Nick": "mock", "Alive": True}],
+                "ServerRuntime": "mock",
+            },
+        })
+
+    async def _handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({**self.stats, "active": len(self.connections)})
+
+
+def _parse_range(value: str) -> Tuple[float, float]:
+    low, _, high = value.partition("-")
+    return float(low), float(high or low)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="本地OPQ替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8086)
+    parser.add_argument("--qq", type=int, default=10000)
+    parser.add_argument("--mountpoint", default="ws")
+    parser.add_argument("--latency", type=_parse_range, default=(0, 0), help="API延迟范围(毫秒), 例如 5-20")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--event-rate", type=float, default=0, help="每秒推送的事件数")
+    parser.add_argument("--drop-interval", type=float, default=0, help="每隔多少秒断开一次连接")
+    parser.add_argument("--groups", type=int, default=5)
+    parser.add_argument("--members", type=int, default=20)
+    args = parser.parse_args(argv)
+    server = MockOPQServer(
+        qq=args.qq,
+        mountpoint=args.mountpoint,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        event_rate=args.event_rate,
+        drop_interval=args.drop_interval,
+        groups=args.groups,
+        members=args.members,
+    )
+    web.run_app(server.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+'''
+Description: 把耗CPU或阻塞的工作放到线程池
+    读取本地图片, base64编码和序列化很大的请求体都会卡住事件循环, 让所有群的事件一起排队.
+    这里用一个有上限的线程池执行这些工作, 排队的任务数也有上限, 满了之后调用方会等待空位而不是无限堆积
+'''
+import time
+import base64
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+def read_base64(path: str) -> str:
+    """读取文件并编码为base64字符串"""
+    with open(path, 'rb') as file:
+        return base64.b64encode(file.read()).decode()
+
+
+class Offloader:
+    """有上限的线程池
+
+    Args:
+        workers (int): 线程数, 为0时直接在事件循环里执行
+        queue_size (int): 最多同时提交(包括正在执行)的任务数, 为0时不限制
+    """
+
+    def __init__(self, workers: int = 4, queue_size: int = 64):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # 信号量要在事件循环里创建, 见run
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.pending = 0
+        self.stats: Dict[str, float] = {
+            'completed': 0,
+            'wait_seconds': 0.0,
+            'run_seconds': 0.0,
+        }
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """在线程池中执行func, 排队已满时等待
+
+        Args:
+            func (Callable[..., T]): 要执行的函数
+            *args: 参数
+
+        Returns:
+            T: func的返回值
+        """
+        if not self.workers:
+            return func(*args)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='opqbot-worker')
+        if self._slots is None and self.queue_size:
+            self._slots = asyncio.Semaphore(self.queue_size)
+        queued = time.perf_counter()
+        self.pending += 1
+        try:
+            if self._slots is not None:
+                await self._slots.acquire()
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(self._executor, self._timed, func, args)
+            finally:
+                if self._slots is not None:
+                    self._slots.release()
+        finally:
+            self.pending -= 1
+        value, started, finished = result
+        self.stats['completed'] += 1
+        # 排队时间包括等待空位和等待空闲线程的时间
+        self.stats['wait_seconds'] += started - queued
+        self.stats['run_seconds'] += finished - started
+        return value
+
+    @staticmethod
+    def _timed(func: Callable[..., T], args: Any):
+        started = time.perf_counter()
+        return func(*args), started, time.perf_counter()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,292 @@
+'''
+Description: 持久化的发件箱
+    要发送的消息先写进SQLite(WAL模式)再发送, 发送成功后才标记完成, OPQ或者进程重启时没发出去的消息会被重试(至少一次).
+    写入和发送成功后的标记都按批提交, 一次提交只触发一次fsync; 重试按指数退避, 同一账号的消息按写入顺序重试, 超过有效期的消息会被丢弃;
+    调用方可以给消息指定去重键, 有效期内同一个键只会发送一次
+'''
+import json
+import time
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Tuple
+
+from . import log
+
+if TYPE_CHECKING:
+    from .bot import Bot
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT UNIQUE,
+    self_id TEXT NOT NULL,
+    api TEXT NOT NULL,
+    body TEXT NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_try REAL NOT NULL,
+    delivered INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (delivered, next_try);
+'''
+
+# 待写入的一条消息: (去重键, 账号, 接口, 请求体, 创建时间)
+_Row = Tuple[Optional[str], str, str, str, float]
+
+
+class Outbox:
+    """持久化的发件箱
+
+    Args:
+        path (str): 数据库文件路径
+        ttl (float): 消息的有效期(秒), 过期还没发出去的消息会被丢弃, 已发送消息的去重记录也保留这么久
+        max_backoff (float): 重试间隔的上限(秒), 重试间隔从1秒开始翻倍
+        flush_interval (float): 批量提交的等待时间(秒), 这段时间内的写入合并为一次提交
+        retry_interval (float): 后台检查待重试消息的间隔(秒)
+    """
+
+    def __init__(self, path: str, ttl: float = 3600, max_backoff: float = 60,
+                 flush_interval: float = 0.01, retry_interval: float = 1):
+        self.path = path
+        self.ttl = ttl
+        self.max_backoff = max_backoff
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        # 没有发送成功的消息数
+        self.pending = 0
+        self.stats: Dict[str, int] = {
+            'queued': 0,
+            'delivered': 0,
+            'duplicates': 0,
+            'retries': 0,
+            'expired': 0,
+        }
+        self._db: Optional[sqlite3.Connection] = None
+        # 所有数据库操作都在这一个线程里执行, 不阻塞事件循环
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='opqbot-outbox')
+        self._buffer: List[Tuple[_Row, "asyncio.Future[Optional[int]]"]] = []
+        # 已经发送成功, 等待和下一批写入一起标记完成的消息ID
+        self._delivered: List[int] = []
+        self._marking: Set[int] = set()
+        self._flush_task: Optional["asyncio.Task"] = None
+        self._retry_task: Optional["asyncio.Task"] = None
+        # 正在发送的消息ID, 后台重试时跳过它们
+        self._inflight: Set[int] = set()
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _open(self) -> int:
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        # WAL模式下NORMAL提交时不fsync, 断电或系统崩溃后最近的提交可能丢失, 所以这里用FULL, 每次提交都fsync一次WAL
+        db.execute('PRAGMA synchronous=FULL')
+        db.executescript(_SCHEMA)
+        self._db = db
+        return db.execute('SELECT COUNT(*) FROM outbox WHERE delivered = 0').fetchone()[0]
+
+    async def start(self, get_bot: Callable[[str], Optional["Bot"]]):
+        """打开数据库并启动后台重试, 上次没发出去的消息会在对应账号连上后重新发送
+
+        Args:
+            get_bot (Callable[[str], Optional[Bot]]): 按账号获取Bot, 账号没有连接时返回None
+        """
+        self.pending = await self._run(self._open)
+        if self.pending:
+            log.info(f"Outbox has {self.pending} undelivered messages from last run")
+        self._retry_task = asyncio.create_task(self._retry_loop(get_bot))
+
+    async def close(self):
+        """写入缓冲区中剩下的消息并关闭数据库"""
+        if self._retry_task is not None:
+            self._retry_task.cancel()
+            await asyncio.gather(self._retry_task, return_exceptions=True)
+            self._retry_task = None
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self._flush()
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+
+    async def send(self, bot: "Bot", api: str, body: Dict[str, Any], key: Optional[str] = None) -> Any:
+        """写入发件箱并立即尝试发送一次
+
+        Args:
+            bot (Bot): 发送消息的Bot
+            api (str): 接口
+            body (Dict[str, Any]): 请求体
+            key (Optional[str]): 去重键, 有效期内同一个键只会发送一次
+
+        Returns:
+            Any: API的返回值, 重复的消息或者发送失败(之后会重试)时为None
+        """
+        id_ = await self.enqueue(bot, api, body, key)
+        if id_ is None:
+            return None
+        result, _ = await self.deliver(bot, id_, api, body)
+        return result
+
+    async def enqueue(self, bot: "Bot", api: str, body: Dict[str, Any], key: Optional[str] = None) -> Optional[int]:
+        """只写入发件箱, 不立即发送, 之后由 ``deliver`` 或后台重试发送
+
+        Args:
+            bot (Bot): 发送消息的Bot
+            api (str): 接口
+            body (Dict[str, Any]): 请求体
+            key (Optional[str]): 去重键, 有效期内同一个键只会写入一次
+
+        Returns:
+            Optional[int]: 消息ID, 重复的消息为None
+        """
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[Optional[int]]" = loop.create_future()
+        self._buffer.append(((key, bot.self_id, api, json.dumps(body, ensure_ascii=False), time.time()), future))
+        self._schedule_flush()
+        id_ = await future
+        if id_ is None:
+            self.stats['duplicates'] += 1
+            log.debug(f"$Outbox.enqueue@ Skip duplicated message {key}")
+        return id_
+
+    def _schedule_flush(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        await self._flush()
+
+    async def _flush(self):
+        if not self._buffer and not self._delivered:
+            return
+        batch, self._buffer = self._buffer, []
+        done, self._delivered = self._delivered, []
+        try:
+            ids = await self._run(self._write, [row for row, _ in batch], done)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            # 没能标记完成的消息会被重试, 至少发送一次的语义不变
+            self._marking.difference_update(done)
+            log.error(f"Failed to write {len(batch)} messages and {len(done)} delivery marks to outbox", e)
+            return
+        self._marking.difference_update(done)
+        # 计数只在事件循环线程里修改
+        inserted = sum(id_ is not None for id_ in ids)
+        self.pending += inserted
+        self.stats['queued'] += inserted
+        for (_, future), id_ in zip(batch, ids):
+            if not future.done():
+                future.set_result(id_)
+
+    def _write(self, rows: List[_Row], done: List[int]) -> List[Optional[int]]:
+        db = self._db
+        if db is None:
+            raise RuntimeError('Outbox is not started')
+        ids: List[Optional[int]] = []
+        # 整批在一个事务里提交, 一批只fsync一次
+        db.execute('BEGIN')
+        try:
+            for key, self_id, api, body, created in rows:
+                cursor = db.execute(
+                    'INSERT OR IGNORE INTO outbox (key, self_id, api, body, created, next_try) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, self_id, api, body, created, created)
+                )
+                ids.append(cursor.lastrowid if cursor.rowcount else None)
+            db.executemany('UPDATE outbox SET delivered = 1 WHERE id = ?', [(id_,) for id_ in done])
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return ids
+
+    async def deliver(self, bot: "Bot", id_: int, api: str, body: Dict[str, Any],
+                      attempts: int = 0) -> Tuple[Any, bool]:
+        """发送一条已经写入的消息, 失败时按退避时间安排重试
+
+        Args:
+            bot (Bot): 发送消息的Bot
+            id_ (int): ``enqueue`` 返回的消息ID
+            api (str): 接口
+            body (Dict[str, Any]): 请求体
+            attempts (int): 之前已经尝试过的次数
+
+        Returns:
+            Tuple[Any, bool]: (API的返回值, 是否发送成功)
+        """
+        self._inflight.add(id_)
+        try:
+            try:
+                result = await bot.call_api(api, origin=body)
+                if getattr(result, 'status_code', 200) != 200:
+                    raise ValueError(f'HTTP {result.status_code}')
+            except Exception as e:
+                backoff = min(2 ** attempts, self.max_backoff)
+                log.warning(f"Failed to deliver outbox message {id_}, retrying in {backoff}s", e)
+                await self._run(self._execute,
+                                'UPDATE outbox SET attempts = ?, next_try = ? WHERE id = ?',
+                                (attempts + 1, time.time() + backoff, id_))
+                return None, False
+            # 完成标记和下一批写入一起提交, 不为每条消息单独fsync; 提交之前后台重试会跳过它
+            self._delivered.append(id_)
+            self._marking.add(id_)
+            self._schedule_flush()
+            self.pending -= 1
+            self.stats['delivered'] += 1
+            return result, True
+        finally:
+            self._inflight.discard(id_)
+
+    def _execute(self, sql: str, params: Tuple[Any, ...]) -> List[Any]:
+        if self._db is None:
+            return []
+        return self._db.execute(sql, params).fetchall()
+
+    def _due(self, now: float, limit: int) -> Tuple[int, List[Any]]:
+        """删除过期的消息, 返回 (过期的消息数, 没发送的消息), 没发送的消息按写入顺序排列"""
+        db = self._db
+        if db is None:
+            return 0, []
+        expired = db.execute(
+            'DELETE FROM outbox WHERE delivered = 0 AND created < ?', (now - self.ttl,)
+        ).rowcount
+        # 去重记录也只保留有效期内的
+        db.execute('DELETE FROM outbox WHERE delivered = 1 AND created < ?', (now - self.ttl,))
+        return expired, db.execute(
+            'SELECT id, self_id, api, body, attempts, next_try FROM outbox '
+            'WHERE delivered = 0 ORDER BY id LIMIT ?',
+            (limit,)
+        ).fetchall()
+
+    async def _retry_loop(self, get_bot: Callable[[str], Optional["Bot"]]):
+        while True:
+            await asyncio.sleep(self.retry_interval)
+            try:
+                now = time.time()
+                expired, rows = await self._run(self._due, now, 100)
+            except Exception as e:
+                log.error("Failed to read outbox", e)
+                continue
+            if expired:
+                self.pending -= expired
+                self.stats['expired'] += expired
+                log.warning(f"Dropped {expired} outbox messages older than {self.ttl}s")
+            # 同一个账号的消息按写入顺序发送, 前面的还没到重试时间或者正在发送时, 后面的也要等着
+            blocked: Set[str] = set()
+            for id_, self_id, api, body, attempts, next_try in rows:
+                if id_ in self._marking or self_id in blocked:
+                    continue
+                bot = get_bot(self_id)
+                if bot is None or id_ in self._inflight or next_try > now:
+                    blocked.add(self_id)
+                    continue
+                self.stats['retries'] += 1
+                _, ok = await self.deliver(bot, id_, api, json.loads(body), attempts)
+                if not ok:
+                    # 还是发不出去, 多半是OPQ不可用, 这一轮剩下的就不试了
+                    break
@@ -0,0 +1,222 @@
+'''
+Description: 发送前的消息合并与拆分
+    插件经常为了一次回复连续调用好几次 ``Bot.send``, 这里把短时间内发往同一个目标的消息合并成一次 ``PbSendMsg``;
+    超出QQ长度限制的消息链则在安全的位置拆成几条发送, 只会在文本内部断开, 不会拆开At, 图片等消息段
+'''
+import asyncio
+from typing import Any, Awaitable, Callable, Coroutine, Dict, Hashable, List, Optional, Set, Tuple
+
+from .message import MessageChain, MessageSegment, MessageType
+
+# 这些消息段只能出现在一条消息的开头或者必须单独发送, 带有它们的消息链不参与合并
+_STANDALONE = (MessageType.QUOTE, MessageType.VOICE)
+
+# 合并发送用的回调: 消息链 -> API返回值
+Sender = Callable[[MessageChain], Awaitable[Any]]
+
+
+def _segment_length(segment: MessageSegment) -> int:
+    """消息段计入长度限制的字符数, At按 ``@昵称`` 计算, 其余非文本消息段不计"""
+    if segment.type == MessageType.PLAIN:
+        return len(segment.data['text'])
+    if segment.type == MessageType.AT:
+        return len(segment.data.get('display') or '') + 1
+    return 0
+
+
+def _cut(text: str, room: int, hard: bool) -> int:
+    """在text的前room个字符内找一个断开的位置, 优先换行, 其次空白字符
+
+    Args:
+        text (str): 需要断开的文本
+        room (int): 最多能放下的字符数
+        hard (bool): 找不到合适的位置时是否直接在room处断开
+
+    Returns:
+        int: 断开的位置, 为0时表示这里放不下
+    """
+    if room <= 0:
+        return 0
+    index = text.rfind('\n', 0, room)
+    if index >= 0:
+        return index + 1
+    for index in range(min(room, len(text)) - 1, -1, -1):
+        if text[index].isspace():
+            return index + 1
+    return room if hard else 0
+
+
+def split_chain(chain: MessageChain, max_length: int = 0, max_images: int = 0) -> List[MessageChain]:
+    """把超出限制的消息链拆成几条
+
+    Args:
+        chain (MessageChain): 需要拆分的消息链
+        max_length (int): 每条消息最多的字符数, 为0时不限制
+        max_images (int): 每条消息最多的图片数, 为0时不限制
+
+    Returns:
+        List[MessageChain]: 拆分后的消息链, 没有超出限制时就是原消息链
+    """
+    if not max_length and not max_images:
+        return [chain]
+    parts: List[MessageChain] = []
+    current: List[MessageSegment] = []
+    length = images = 0
+
+    def flush():
+        nonlocal current, length, images
+        if current:
+            parts.append(MessageChain(current))
+        current, length, images = [], 0, 0
+
+    for segment in chain:
+        if segment.type == MessageType.PLAIN and max_length:
+            text: str = segment.data['text']
+            while text:
+                room = max_length - length
+                if len(text) <= room:
+                    current.append(MessageSegment.plain(text))
+                    length += len(text)
+                    break
+                # 当前这条还有别的内容时, 宁可另起一条也不在单词中间断开
+                cut = _cut(text, room, hard=not current)
+                if cut:
+                    current.append(MessageSegment.plain(text[:cut]))
+                    text = text[cut:]
+                flush()
+            continue
+        cost = _segment_length(segment)
+        is_image = segment.type in (MessageType.IMAGE, MessageType.FLASH_IMAGE)
+        if (max_length and current and length + cost > max_length) or \
+                (is_image and max_images and images >= max_images):
+            flush()
+        current.append(segment)
+        length += cost
+        images += is_image
+    flush()
+    return parts or [chain]
+
+
+class _Batch:
+    __slots__ = ('chains', 'length', 'futures', 'handle')
+
+    def __init__(self):
+        self.chains: List[MessageChain] = []
+        self.length = 0
+        self.futures: List["asyncio.Future[Any]"] = []
+        self.handle: Optional[asyncio.TimerHandle] = None
+
+
+class Coalescer:
+    """合并短时间内发往同一个目标的消息
+
+    第一条消息到达后等待 ``window`` 秒, 这期间发往同一目标的消息会被拼成一条(中间用换行分隔),
+    合并后超出长度限制时先把已经攒下的发出去. 所有参与合并的调用方都会拿到合并后那次发送的返回值
+
+    Args:
+        window (float): 合并窗口(秒), 为0时不合并
+        max_length (int): 合并后每条消息最多的字符数, 为0时不限制
+    """
+
+    def __init__(self, window: float = 0, max_length: int = 0):
+        self.window = window
+        self.max_length = max_length
+        self._batches: Dict[Hashable, Tuple[_Batch, Sender]] = {}
+        # 后台发送的任务, 留着引用避免被回收, 关闭时要等它们发完
+        self._tasks: Set["asyncio.Task"] = set()
+        self.stats: Dict[str, int] = {
+            'submitted': 0,
+            'sent': 0,
+        }
+
+    async def submit(self, target: Hashable, chain: MessageChain, sender: Sender,
+                     coalesce: bool = True) -> Any:
+        """提交一条要发送的消息
+
+        Args:
+            target (Hashable): 发送目标, 只有目标相同的消息才会合并
+            chain (MessageChain): 消息链
+            sender (Sender): 真正发送合并后消息链的函数
+            coalesce (bool): 为False时不参与合并, 但仍然排在之前攒下的消息后面发送
+
+        Returns:
+            Any: sender的返回值
+        """
+        self.stats['submitted'] += 1
+        if not self.window or not coalesce or any(segment.type in _STANDALONE for segment in chain):
+            # 先发出之前攒下的, 保证消息顺序
+            pending = self._take(target)
+            if pending is not None:
+                await self._send(*pending)
+            self.stats['sent'] += 1
+            return await sender(chain)
+        length = sum(map(_segment_length, chain))
+        pending = self._batches.get(target)
+        if pending is not None and self.max_length and pending[0].length + length + 1 > self.max_length:
+            # 放不下了, 攒下的先发出去, 这条开始新的一批
+            self._spawn(self._send(*self._take(target)))  # type: ignore
+            pending = None
+        if pending is None:
+            batch = _Batch()
+            batch.handle = asyncio.get_running_loop().call_later(
+                self.window, lambda: self._spawn(self._flush(target, batch))
+            )
+            self._batches[target] = (batch, sender)
+        else:
+            batch = pending[0]
+            batch.length += 1
+        batch.chains.append(chain)
+        batch.length += length
+        future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+        batch.futures.append(future)
+        return await future
+
+    def close(self) -> Set["asyncio.Task"]:
+        """关闭时调用, 立即发送所有攒下的消息, 之后提交的消息不再合并
+
+        Returns:
+            Set[asyncio.Task]: 还没完成的发送任务, 由调用方等待
+        """
+        self.window = 0
+        for target in list(self._batches):
+            self._spawn(self._send(*self._take(target)))  # type: ignore
+        return set(self._tasks)
+
+    def _spawn(self, coro: Coroutine[Any, Any, None]) -> "asyncio.Task":
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _take(self, target: Hashable) -> Optional[Tuple[_Batch, Sender]]:
+        """取走目标攒下的消息"""
+        pending = self._batches.pop(target, None)
+        if pending is not None and pending[0].handle is not None:
+            pending[0].handle.cancel()
+        return pending
+
+    async def _flush(self, target: Hashable, batch: _Batch):
+        """合并窗口到期, 发送这一批消息"""
+        pending = self._batches.get(target)
+        if pending is None or pending[0] is not batch:
+            # 已经被提前发送了
+            return
+        await self._send(*self._take(target))  # type: ignore
+
+    async def _send(self, batch: _Batch, sender: Sender):
+        merged = MessageChain([])
+        for index, chain in enumerate(batch.chains):
+            if index:
+                merged.append(MessageSegment.plain('\n'))
+            merged.extend(chain)
+        self.stats['sent'] += 1
+        try:
+            result = await sender(merged)
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future in batch.futures:
+            if not future.done():
+                future.set_result(result)
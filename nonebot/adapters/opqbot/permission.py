@@ -1,35 +1,46 @@
+from typing import TYPE_CHECKING, Optional, cast
+
 from nonebot.permission import Permission
 from nonebot.adapters import Bot, Event
 
 from .event.base import UserPermission
 from .event.message import ON_EVENT_GROUP_NEW_MSG
 
+if TYPE_CHECKING:
+    from .adapter import Adapter
+
+
+async def _sender_permission(bot: "Bot", event: "Event") -> Optional[UserPermission]:
+    """从群成员缓存中查询发送者的权限, 非群消息时返回None"""
+    if not isinstance(event, ON_EVENT_GROUP_NEW_MSG):
+        return None
+    adapter = cast("Adapter", bot.adapter)
+    return await adapter.group_cache.get_permission(
+        bot, event.MsgHead.GroupInfo.GroupCode, event.MsgHead.SenderUin  # type: ignore
+    )
+
 
 async def _group_member(bot: "Bot", event: "Event") -> bool:
-    return isinstance(event, ON_EVENT_GROUP_NEW_MSG) and \
-        event.sender.permission == UserPermission.MEMBER
+    return await _sender_permission(bot, event) == UserPermission.MEMBER
 
 
 async def _group_admin(bot: "Bot", event: "Event") -> bool:
-    return isinstance(event, ON_EVENT_GROUP_NEW_MSG) and \
-        event.sender.permission == UserPermission.ADMINISTRATOR
+    return await _sender_permission(bot, event) == UserPermission.ADMINISTRATOR
 
 
 async def _group_admins(bot: "Bot", event: "Event") -> bool:
-    return isinstance(event, ON_EVENT_GROUP_NEW_MSG) and \
-        event.sender.permission in \
+    return await _sender_permission(bot, event) in \
         (UserPermission.ADMINISTRATOR, UserPermission.OWNER)
 
 
 async def _group_owner(bot: "Bot", event: "Event") -> bool:
-    return isinstance(event, ON_EVENT_GROUP_NEW_MSG) and \
-        event.sender.permission == UserPermission.OWNER
+    return await _sender_permission(bot, event) == UserPermission.OWNER
 
 
 async def _group_owner_superuser(bot: "Bot", event: "Event") -> bool:
     return isinstance(event, ON_EVENT_GROUP_NEW_MSG) and \
-        (event.sender.permission == UserPermission.OWNER or
-            event.get_user_id() in bot.config.superusers)
+        (event.get_user_id() in bot.config.superusers or
+            await _sender_permission(bot, event) == UserPermission.OWNER)
 
 
 GROUP_MEMBER = Permission(_group_member)  # 仅成员
@@ -0,0 +1,133 @@
+'''
+Description: 按事件采样的分阶段耗时分析
+    开启后按采样率挑选一部分事件, 记录它们在每个处理阶段(解码, 转换, 解析, process_*, handle_event, _call_api)的耗时
+    结果可以导出为火焰图工具(flamegraph.pl, speedscope)能读取的折叠栈格式, 也可以导出每个阶段最慢的N个事件
+'''
+import time
+import heapq
+import random
+import contextlib
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+
+class _Frame:
+    """一个正在计时的阶段"""
+    __slots__ = ('profiler', 'path', 'event', 'begin', 'children', 'token')
+
+    def __init__(self, profiler: "StageProfiler", path: Tuple[str, ...], event: str):
+        self.profiler = profiler
+        self.path = path
+        self.event = event
+        self.begin = 0.0
+        self.children = 0.0
+        self.token = None
+
+    def __enter__(self) -> "_Frame":
+        self.token = _current.set(self)
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.begin
+        _current.reset(self.token)  # type: ignore
+        parent = _current.get()
+        if parent is not None and parent.token is not None:
+            parent.children += duration
+        self.profiler._record(self, duration)
+
+
+# 当前任务所处的阶段, 每个asyncio任务都有自己的一份拷贝, 所以并发的事件不会互相干扰
+_current: ContextVar[Optional[_Frame]] = ContextVar('opqbot_profiler_frame', default=None)
+_null = contextlib.nullcontext()
+
+
+class StageProfiler:
+    """分阶段耗时分析器
+
+    Args:
+        enabled (bool): 是否启用
+        sample_rate (float): 事件的采样率, 取值0~1
+        top_n (int): 每个阶段保留最慢的多少个事件
+    """
+
+    def __init__(self, enabled: bool = False, sample_rate: float = 0.01, top_n: int = 10):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.top_n = top_n
+        self.reset()
+
+    def reset(self):
+        """清空已经收集的数据"""
+        # 折叠栈 -> 自身耗时(微秒)
+        self._collapsed: Dict[str, int] = {}
+        # 阶段名 -> [(耗时, 事件名)] 的小顶堆
+        self._slowest: Dict[str, List[Tuple[float, str]]] = {}
+        self._totals: Dict[str, List[float]] = {}
+        self.sampled = 0
+
+    def begin(self, event: str = 'frame') -> bool:
+        """在收到一帧数据时调用, 决定是否采样这个事件
+        结果会记录在当前上下文中, 由此创建的任务都会继承这个决定
+
+        Args:
+            event (str): 事件名, 暂时不知道时可以之后用 ``rename`` 修改
+
+        Returns:
+            bool: 是否被采样
+        """
+        if not self.enabled or random.random() >= self.sample_rate:
+            _current.set(None)
+            return False
+        self.sampled += 1
+        # 根节点不计时, 只用来携带事件名
+        _current.set(_Frame(self, (), event))
+        return True
+
+    def rename(self, event: str):
+        """修改当前采样事件的事件名"""
+        frame = _current.get()
+        if frame is not None:
+            frame.event = event
+
+    def stage(self, name: str):
+        """为一个阶段计时, 当前事件没有被采样时返回一个空的上下文管理器
+
+        e.g.
+            with profiler.stage('Event.new'):
+                ...
+
+        Args:
+            name (str): 阶段名
+        """
+        parent = _current.get()
+        if parent is None:
+            return _null
+        return _Frame(self, parent.path + (name,), parent.event)
+
+    def _record(self, frame: _Frame, duration: float):
+        stack = ';'.join((frame.event,) + frame.path)
+        self._collapsed[stack] = self._collapsed.get(stack, 0) + \
+            int(max(0.0, duration - frame.children) * 1_000_000)
+        stage = frame.path[-1]
+        totals = self._totals.setdefault(stage, [0, 0.0])
+        totals[0] += 1
+        totals[1] += duration
+        slowest = self._slowest.setdefault(stage, [])
+        if len(slowest) < self.top_n:
+            heapq.heappush(slowest, (duration, frame.event))
+        elif duration > slowest[0][0]:
+            heapq.heapreplace(slowest, (duration, frame.event))
+
+    def dump_collapsed(self) -> str:
+        """导出为折叠栈格式, 权重为自身耗时(微秒), 可以直接交给flamegraph.pl"""
+        return '\n'.join(f'{stack} {weight}' for stack, weight in sorted(self._collapsed.items())) + '\n'
+
+    def report(self) -> str:
+        """导出每个阶段的平均耗时与最慢的N个事件"""
+        lines = [f'sampled events: {self.sampled}']
+        for stage, (count, total) in sorted(self._totals.items(), key=lambda x: -x[1][1]):
+            lines.append(f'{stage}: count={int(count)} total={total * 1000:.3f}ms avg={total / count * 1e6:.1f}µs')
+            for duration, event in sorted(self._slowest.get(stage, []), reverse=True):
+                lines.append(f'    {duration * 1000:.3f}ms {event}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,143 @@
+'''
+Description: 基于前缀树的命令索引
+    注册过的命令被组织成一棵前缀树, process_event时沿消息开头走一遍树,
+    就能得到这条消息可能命中的全部命令, 匹配器只需要检查集合成员关系
+'''
+from typing import Dict, FrozenSet, Iterable, Optional, Set, Tuple
+
+from nonebot.rule import Rule
+from nonebot.adapters import Bot, Event
+
+from .event import MessageEvent
+
+
+class _Node:
+    __slots__ = ('children', 'command')
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # 走到这个节点时完整匹配的命令
+        self.command: Optional[str] = None
+
+
+class CommandTrie:
+    """命令前缀树
+
+    Args:
+        command_start (Iterable[str]): 命令前缀, 例如 ``{"/", ""}``
+    """
+
+    def __init__(self, command_start: Iterable[str] = ("/",)):
+        self.command_start: Tuple[str, ...] = tuple(command_start)
+        # 每注册一条新命令就加一, 事件上的标记版本不一致时需要重新匹配
+        self.version = 0
+        self._root = _Node()
+        self._commands: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    def __contains__(self, command: str) -> bool:
+        return command in self._commands
+
+    def add(self, command: str):
+        """注册一条命令, 不含命令前缀"""
+        if not command or command in self._commands:
+            return
+        node = self._root
+        for char in command:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _Node()
+            node = child
+        node.command = command
+        self._commands.add(command)
+        self.version += 1
+
+    def match(self, text: str) -> FrozenSet[str]:
+        """找出text可能命中的所有命令
+        命令之后必须是文本结尾或空白字符, 这样 ``/help`` 不会命中 ``/helper``
+
+        Args:
+            text (str): 消息的纯文本
+
+        Returns:
+            FrozenSet[str]: 候选命令
+        """
+        if not self._commands:
+            return _EMPTY
+        found: Set[str] = set()
+        length = len(text)
+        for start in self.command_start:
+            if not text.startswith(start):
+                continue
+            node: Optional[_Node] = self._root
+            index = len(start)
+            while index < length:
+                node = node.children.get(text[index])  # type: ignore
+                if node is None:
+                    break
+                index += 1
+                if node.command is not None and (index == length or text[index].isspace()):
+                    found.add(node.command)
+        return frozenset(found) if found else _EMPTY
+
+    def tag(self, event: MessageEvent) -> FrozenSet[str]:
+        """匹配事件的纯文本, 并把候选命令标记在事件上"""
+        commands = self.match(event.get_plaintext())
+        event._commands = (self.version, commands)
+        return commands
+
+    def candidates(self, event: MessageEvent) -> FrozenSet[str]:
+        """获取事件的候选命令, 标记过期或者还没有标记时会重新匹配"""
+        tagged = event._commands
+        if tagged is not None and tagged[0] == self.version:
+            return tagged[1]
+        return self.tag(event)
+
+
+_EMPTY: FrozenSet[str] = frozenset()
+
+# 适配器共用的命令索引, 适配器初始化时会填入 ``command_start``
+command_trie = CommandTrie()
+
+
+def trie_command(*cmds: str) -> Rule:
+    """
+    :说明:
+
+      匹配消息开头的命令, 命令在创建规则时注册到命令索引中,
+      检查时只需要查看 ``process_event`` 标记在事件上的候选命令
+
+      它不是 ``nonebot.rule.command`` 的替代品, 行为上有这些不同:
+
+        * 命令之后必须是空白字符或消息结尾, 相当于 ``force_whitespace=True``
+        * 只判断是否命中, 不会设置 ``state["_prefix"]``, 处理函数里不能用 ``CommandArg`` 等依赖取参数
+
+    :参数:
+
+      * ``*cmds: str``: 命令, 不含命令前缀
+    """
+    commands = frozenset(cmds)
+    for cmd in commands:
+        command_trie.add(cmd)
+
+    async def _trie_command(bot: Bot, event: Event) -> bool:
+        if not isinstance(event, MessageEvent):
+            return False
+        return not commands.isdisjoint(command_trie.candidates(event))
+
+    return Rule(_trie_command)
+
+
+def not_flooded() -> Rule:
+    """
+    :说明:
+
+      忽略被入站限流标记为刷屏的消息, 配合 ``opqbot_flood_action = "tag"`` 使用
+    """
+
+    async def _not_flooded(bot: Bot, event: Event) -> bool:
+        return not (isinstance(event, MessageEvent) and event.flooded)
+
+    return Rule(_not_flooded)
@@ -0,0 +1,66 @@
+'''
+Description: 编译后的字符串模板
+    模板中的 ``{field}`` 是需要填充的空位, ``{{`` 与 ``}}`` 是转义的花括号.
+    每个模板只解析一次并缓存, 之后每次填充只是按顺序拼接字符串; 环境中没有的空位会原样保留
+'''
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+_TOKEN = re.compile(r'\{\{|\}\}|\{([a-z_][a-z0-9_]*)\}', re.I)
+
+
+class Template:
+    """编译后的模板
+
+    Args:
+        source (str): 模板原文
+        parts (Tuple[str, ...]): 文本与空位交替排列, 偶数位是文本, 奇数位是空位的名字
+    """
+    __slots__ = ('source', 'parts', 'fields')
+
+    def __init__(self, source: str, parts: Tuple[str, ...]):
+        self.source = source
+        self.parts = parts
+        self.fields: Tuple[str, ...] = parts[1::2]
+
+    def __call__(self, Env: Dict[str, Any]) -> str:
+        parts = self.parts
+        if len(parts) == 1:
+            return parts[0]
+        out: List[str] = list(parts)
+        for index in range(1, len(parts), 2):
+            name = parts[index]
+            out[index] = str(Env[name]) if name in Env else '{' + name + '}'
+        return ''.join(out)
+
+    def __repr__(self) -> str:
+        return f'<Template {self.source!r} fields={self.fields}>'
+
+
+@lru_cache(maxsize=1024)
+def compile_template(String: str) -> Template:
+    """解析模板, 同一个模板只解析一次
+
+    Args:
+        String (str): 模板原文, 例如 ``ab{cd}efgh{i}jk``
+
+    Returns:
+        Template: 编译后的模板, 以环境字典调用它即可得到填充后的字符串
+    """
+    parts: List[str] = []
+    literal: List[str] = []
+    position = 0
+    for match in _TOKEN.finditer(String):
+        literal.append(String[position:match.start()])
+        position = match.end()
+        name = match.group(1)
+        if name is None:
+            # 转义的花括号
+            literal.append(match.group()[0])
+            continue
+        parts += [''.join(literal), name]
+        literal = []
+    literal.append(String[position:])
+    parts.append(''.join(literal))
+    return Template(String, tuple(parts))
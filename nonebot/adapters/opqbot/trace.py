@@ -0,0 +1,167 @@
+'''
+Description: 从收到ws帧到回复发出的端到端延迟追踪
+    每收到一帧数据就创建一个追踪上下文, 它通过contextvars跟随事件传递到 Bot.send 和 _call_api,
+    沿途记录解码, 解析, 排队, 匹配器, 编码和HTTP请求等阶段的时间戳.
+    结束后按尾延迟采样, 以接近OpenTelemetry(OTLP JSON)的结构写入JSON-lines文件或交给回调
+'''
+import time
+import random
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from .jsonl import LineWriter
+
+
+def _new_id(bits: int) -> str:
+    return f'{random.getrandbits(bits):0{bits // 4}x}'
+
+
+class _Span:
+    """一个正在计时的阶段"""
+    __slots__ = ('trace', 'name', 'attributes', 'start')
+
+    def __init__(self, trace: "TraceContext", name: str, attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.start = 0
+
+    def __enter__(self) -> "_Span":
+        self.start = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.trace.add_span(self.name, self.start, time.time_ns(), **self.attributes)
+
+
+class _NullSpan:
+    """没有追踪上下文时使用的空阶段"""
+    attributes: Dict[str, Any] = {}
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+class TraceContext:
+    """一次事件处理的追踪上下文
+
+    Attributes:
+        trace_id (str): 追踪ID
+        event (str): 事件名
+        start (int): 收到这一帧的时间, 单位纳秒
+        spans (List[Dict[str, Any]]): 已经结束的阶段
+    """
+    __slots__ = ('trace_id', 'root_id', 'event', 'start', 'queued', 'spans')
+
+    def __init__(self):
+        self.trace_id = _new_id(128)
+        self.root_id = _new_id(64)
+        self.event = 'frame'
+        self.start = time.time_ns()
+        # 事件被放入任务队列的时间, 用来计算排队等待的耗时
+        self.queued = 0
+        self.spans: List[Dict[str, Any]] = []
+
+    def span(self, name: str, **attributes: Any) -> _Span:
+        return _Span(self, name, attributes)
+
+    def add_span(self, name: str, start: int, end: int, **attributes: Any):
+        self.spans.append({
+            'traceId': self.trace_id,
+            'spanId': _new_id(64),
+            'parentSpanId': self.root_id,
+            'name': name,
+            'startTimeUnixNano': start,
+            'endTimeUnixNano': end,
+            'attributes': attributes,
+        })
+
+
+_current: ContextVar[Optional[TraceContext]] = ContextVar('opqbot_trace', default=None)
+
+
+def current_trace() -> Optional[TraceContext]:
+    """获取当前任务所属的追踪上下文"""
+    return _current.get()
+
+
+class Tracer:
+    """追踪器
+
+    只有总耗时超过 ``threshold`` 的追踪, 以及按 ``sample_rate`` 随机抽中的追踪会被导出
+
+    Args:
+        enabled (bool): 是否启用
+        threshold (float): 尾延迟阈值, 单位毫秒
+        sample_rate (float): 未超过阈值的追踪的随机采样率, 取值0~1
+        path (Optional[str]): JSON-lines文件路径, 为空时不写文件; 文件在后台线程中批量写入
+    """
+
+    def __init__(self, enabled: bool = False, threshold: float = 1000,
+                 sample_rate: float = 0, path: Optional[str] = None):
+        self.enabled = enabled
+        self.threshold = threshold * 1_000_000
+        self.sample_rate = sample_rate
+        self.path = path
+        self._writer = LineWriter(path) if path else None
+        # 导出的回调, 每个追踪以一行JSON对应的字典传入
+        self.sinks: List[Callable[[Dict[str, Any]], Any]] = []
+        self.exported = 0
+
+    def begin(self) -> Optional[TraceContext]:
+        """在收到一帧数据时调用, 创建新的追踪上下文并设为当前上下文"""
+        trace = TraceContext() if self.enabled else None
+        _current.set(trace)
+        return trace
+
+    def span(self, name: str, **attributes: Any):
+        """为当前追踪上下文中的一个阶段计时, 没有上下文时什么也不做
+
+        Args:
+            name (str): 阶段名
+        """
+        trace = _current.get()
+        if trace is None:
+            return _null_span
+        return trace.span(name, **attributes)
+
+    def finish(self, trace: Optional[TraceContext]):
+        """结束一次追踪, 并按采样规则导出
+
+        Args:
+            trace (Optional[TraceContext]): 需要结束的追踪上下文
+        """
+        if trace is None:
+            return
+        end = time.time_ns()
+        if end - trace.start < self.threshold and random.random() >= self.sample_rate:
+            return
+        record = {
+            'traceId': trace.trace_id,
+            'spans': [{
+                'traceId': trace.trace_id,
+                'spanId': trace.root_id,
+                'name': trace.event,
+                'startTimeUnixNano': trace.start,
+                'endTimeUnixNano': end,
+                'attributes': {},
+            }, *trace.spans],
+        }
+        self.exported += 1
+        if self._writer is not None:
+            self._writer.write(record)
+        for sink in self.sinks:
+            sink(record)
+
+    async def close(self):
+        """写入还没写进文件的追踪, 关闭时调用"""
+        if self._writer is not None:
+            await self._writer.close()
@@ -1,12 +1,17 @@
 import asyncio
+import json
 import re
 import sys
-from typing import TYPE_CHECKING, Any, Dict, Optional, Union
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Union, cast
 
 from nonebot.message import handle_event
 from nonebot.typing import overrides
 from nonebot.utils import DataclassEncoder
 
+from .api import API_TABLE
+from .template import compile_template
 from .exception import ApiNotAvailable
 
 from .event import Event, ON_EVENT_GROUP_NEW_MSG, MessageEvent, MessageSource, MessageQuote
@@ -15,27 +20,21 @@ from . import log
 
 if TYPE_CHECKING:
     from .bot import Bot
+    from .adapter import Adapter
+    from .history import HistoryRecord
 
 
 
 def api_name_to_control_signal(api_name: str) -> dict:
-    data: dict = {
-        'send_friend_message': {
-            'APIPath': 'v1/LuaApiCaller',
-            'ToType': 1
-        },
-        'send_group_message': {
-            'APIPath': 'v1/LuaApiCaller',
-            'ToType': 2
-        },
-        'send_private_message': {
-            'APIPath': 'v1/LuaApiCaller',
-            'ToType': 3
-        },
+    """查询发送消息类API的接口路径与ToType, 数据来自 ``API_TABLE``"""
+    # send_private_message是send_temp_message的旧名字
+    spec = API_TABLE.get('send_temp_message' if api_name == 'send_private_message' else api_name)
+    if spec is None or 'ToType' not in spec.constants:
+        return {}
+    return {
+        'APIPath': spec.path,
+        'ToType': spec.constants['ToType']
     }
-    if api_name in data:
-        return data[api_name]
-    return {}
 
 def format(String:str, Env:dict) -> str:
     """这个函数按照String中预留的空位, 从Env中取出对应请求字段的值提交给这个字符串
@@ -56,11 +55,8 @@ def format(String:str, Env:dict) -> str:
     Returns:
         str: 被合成后的字符串
     """
-    FetchRequestField: re.Pattern = re.compile('\{([a-z_][a-z0-9_]*)\}', re.I)
-    PushField = {}
-    for RequestField in FetchRequestField.findall(String):
-        PushField[RequestField] = '{' + f'{RequestField}' + '}' if RequestField not in Env else Env[RequestField]
-    return String.format(**PushField)
+    # 模板只在第一次使用时解析, 之后直接从缓存中取出编译好的模板
+    return compile_template(String)(Env)
 
 def Message_OPQBot_to_mirai(MsgData: dict) -> MessageChain:
     MsgSegment: MessageChain = []
@@ -96,14 +92,24 @@ def Message_OPQBot_to_mirai(MsgData: dict) -> MessageChain:
             })
     return MsgSegment
 
-def Message_mirai_to_OPQBot(MsgData: MessageChain) -> dict:
+def Message_mirai_to_OPQBot(MsgData: MessageChain,
+        reply_lookup: Optional[Callable[[int], Optional["HistoryRecord"]]] = None) -> dict:
+    """将Mirai格式的消息链转换为OPQ的CgiRequest
+
+    Args:
+        MsgData (MessageChain): 需要发送的消息链
+        reply_lookup (Optional[Callable[[int], Optional[HistoryRecord]]]): 通过MsgSeq查找被引用的原消息, 用于生成ReplyTo
+
+    Returns:
+        dict: 不含ToUin与ToType的CgiRequest
+    """
     MsgSegment: dict = {}
     for seg in MsgData:
         log.debug(f'$Message_mirai_to_OPQBot@ seg.type: {seg.type}')
         log.debug(f'$Message_mirai_to_OPQBot@ seg.data: {seg.data}')
         if seg.type == MessageType.PLAIN:
             # 倘若没有'Content'这个对象, 就初始化
-            if 'Content' not in MsgData:
+            if 'Content' not in MsgSegment:
                 MsgSegment['Content'] = ''
             MsgSegment['Content'] = f"{MsgSegment['Content']}{seg.data['text']}"
         if seg.type == MessageType.VOICE:
@@ -112,28 +118,31 @@ def Message_mirai_to_OPQBot(MsgData: MessageChain) -> dict:
                 "FileSize": seg.data['length'],
                 "FileToken": seg.data['url']
             }
-        # TODO: 这里需要再研究一下
-        # if seg.type == MessageType.QUOTE:
-        #     MsgSegment['ReplyTo'] = {
-        #         "MsgSeq": seg.data['id'],
-        #         "MsgTime": 1683025345,
-        #         "MsgUid": 72057595189354740
-        #     }
+        if seg.type == MessageType.QUOTE:
+            # OPQ需要原消息的MsgSeq, MsgTime与MsgUid, 后两个只能从历史消息里找
+            record = reply_lookup(seg.data['id']) if reply_lookup is not None else None
+            if record is not None:
+                MsgSegment['ReplyTo'] = record.reply_to()
+            else:
+                log.warning(f"Quoted message {seg.data['id']} is not in history, ReplyTo is dropped")
         if seg.type == MessageType.AT:
             # 倘若没有'AtUinLists'这个对象, 就初始化
-            if 'AtUinLists' not in MsgData:
+            if 'AtUinLists' not in MsgSegment:
                 MsgSegment['AtUinLists'] = []
             MsgSegment['AtUinLists'].append({
-                "Nick": seg.data['display'],
+                "Nick": seg.data.get('display', ''),
                 "Uin": seg.data['target']
             })
         if seg.type == MessageType.IMAGE:
             # 倘若没有'Images'这个对象, 就初始化
-            if 'Images' not in MsgData:
+            if 'Images' not in MsgSegment:
                 MsgSegment['Images'] = []
-            MsgSegment['Images'].append({
-                "FileId": seg.data['imageId']
-            })
+            image = {"FileId": seg.data['imageId']}
+            # 上传后得到的MD5与大小, OPQ发送图片时需要
+            if seg.data.get('fileMd5'):
+                image['FileMd5'] = seg.data['fileMd5']
+                image['FileSize'] = seg.data.get('fileSize', 0)
+            MsgSegment['Images'].append(image)
     log.debug(f"$Message_mirai_to_OPQBot@ MsgSegment: {MsgSegment}")
     return MsgSegment
 
@@ -227,18 +236,18 @@ def process_nick(bot: "Bot", event: ON_EVENT_GROUP_NEW_MSG) -> ON_EVENT_GROUP_NE
     Returns:
         ON_EVENT_GROUP_NEW_MSG: 返回处理后的事件
     """
-    plain = event.message_chain.extract_first(MessageType.PLAIN)
-    if plain is not None:
-        if len(bot.config.nickname):
-            text = str(plain)
-            nick_regex = '|'.join(filter(lambda x: x, bot.config.nickname))
-            matched = re.search(rf"^({nick_regex})([\s,，]*|$)", text, re.IGNORECASE)
-            if matched is not None:
-                event.to_me = True
-                nickname = matched.group(1)
-                log.info(f'User is calling me {nickname}')
-                plain.data['text'] = text[matched.end():]
-        event.message_chain.insert(0, plain)
+    # 直接在原地修改第一个文本段, 不需要把它弹出再插回去
+    chain = event.message_chain
+    if chain and chain[0].type == MessageType.PLAIN and len(bot.config.nickname):
+        plain = chain[0]
+        text = str(plain)
+        nick_regex = '|'.join(filter(lambda x: x, bot.config.nickname))
+        matched = re.search(rf"^({nick_regex})([\s,，]*|$)", text, re.IGNORECASE)
+        if matched is not None:
+            event.to_me = True
+            nickname = matched.group(1)
+            log.info(f'User is calling me {nickname}')
+            plain.data['text'] = text[matched.end():]
     return event
 
 
@@ -250,13 +259,31 @@ async def process_event(bot: "Bot", event: Event) -> None:
         event (Event): 此事件的内容
     """
     log.debug(f'$process_event@ event: {event}[{type(event)}]')
-    if isinstance(event, MessageEvent):
-        event = process_source(bot, event)
-        event = process_quote(bot, event)
-        if isinstance(event, ON_EVENT_GROUP_NEW_MSG):
-            event = process_nick(bot, event)
-            event = process_at(bot, event)
-    await handle_event(bot, event)
+    adapter = cast("Adapter", bot.adapter)
+    profiler = adapter.profiler
+    tracer = adapter.tracer
+    trace = event.trace
+    if trace is not None and trace.queued:
+        trace.add_span('queue', trace.queued, time.time_ns())
+    with profiler.stage('process_event'):
+        if isinstance(event, MessageEvent):
+            with profiler.stage('process_source'):
+                event = process_source(bot, event)
+            with profiler.stage('process_quote'):
+                event = process_quote(bot, event)
+            if isinstance(event, ON_EVENT_GROUP_NEW_MSG):
+                with profiler.stage('process_nick'):
+                    event = process_nick(bot, event)
+                with profiler.stage('process_at'):
+                    event = process_at(bot, event)
+            if len(adapter.command_trie):
+                with profiler.stage('process_commands'):
+                    adapter.command_trie.tag(event)
+    try:
+        with profiler.stage('handle_event'), tracer.span('matcher'):
+            await handle_event(bot, event)
+    finally:
+        tracer.finish(trace)
 
 class SyncIDStore:
     """同步ID队列(仓库)
@@ -321,6 +348,60 @@ class SyncIDStore:
             del cls._futures[sync_id]
 
 
+class EventDeduplicator:
+    """事件去重器
+    断线重连或者多连接时OPQ可能会把同一条消息推送两次, 这里用一个定长的LRU集合记住最近见过的消息,
+    在时间窗口内重复出现的消息会被丢弃. 没有MsgHead的事件(通知, 请求等)没有消息ID,
+    以事件名加上EventData规范化后的JSON作为标识, 否则多条连接时同一个好友申请会被派发多次
+
+    Args:
+        window (float): 去重的时间窗口, 单位秒, 为0时不去重
+        size (int): 最多记住多少条消息, 超出时淘汰最早的
+    """
+
+    def __init__(self, window: float = 60, size: int = 4096):
+        self.window = window
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._seen: "OrderedDict[tuple, float]" = OrderedDict()
+
+    def seen(self, self_id: str, event_name: str, event_data: Dict[str, Any]) -> bool:
+        """检查并记录一条事件
+
+        Args:
+            self_id (str): 收到事件的Bot
+            event_name (str): 事件帧中的EventName
+            event_data (Dict[str, Any]): 事件帧中的EventData
+
+        Returns:
+            bool: 这条事件在时间窗口内已经出现过时为True
+        """
+        if self.window <= 0:
+            return False
+        head = event_data.get('MsgHead')
+        if head:
+            key: tuple = (self_id, head.get('MsgUid') or head.get('MsgSeq'), head.get('MsgRandom'))
+        else:
+            # 同一事件在每条连接上推送的内容相同, 键的顺序可能不同, 所以排序后再比较
+            key = (self_id, event_name, hash(json.dumps(event_data, sort_keys=True, ensure_ascii=False)))
+        now = time.monotonic()
+        # 顺便清理已经滑出时间窗口的旧记录, OrderedDict里的顺序就是时间顺序
+        while self._seen:
+            oldest_key, oldest_time = next(iter(self._seen.items()))
+            if now - oldest_time <= self.window:
+                break
+            del self._seen[oldest_key]
+        if key in self._seen:
+            self.hits += 1
+            return True
+        self.misses += 1
+        self._seen[key] = now
+        if len(self._seen) > self.size:
+            self._seen.popitem(last=False)
+        return False
+
+
 class OPQBotDataclassEncoder(DataclassEncoder):
     """OPQBot的数据类解析工作
     好的代码具有自叙性, 但我还是要把注释写上
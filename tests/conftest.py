@@ -0,0 +1,17 @@
+import nonebot
+import pytest
+
+# 适配器的配置来自全局配置, 这里初始化一次, 使用不需要网络的驱动器
+nonebot.init(
+    driver='~none',
+    opqbot_qq='10000',
+    opqbot_host='127.0.0.1',
+    opqbot_port=8086,
+    opqbot_endpoints=['127.0.0.2:8086'],
+)
+
+
+@pytest.fixture
+def adapter():
+    from nonebot.adapters.opqbot import Adapter
+    return Adapter(nonebot.get_driver())
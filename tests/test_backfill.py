@@ -0,0 +1,98 @@
+import time
+import asyncio
+from typing import List
+
+import pytest
+
+from nonebot.adapters.opqbot import Bot, adapter as adapter_module
+
+pytest.importorskip('aiohttp')
+from nonebot.adapters.opqbot.mock import MockOPQServer  # noqa: E402
+
+
+def seq_of(event) -> int:
+    return event.MsgHead.MsgSeq
+
+
+def test_backfill_runs_before_live_dispatch(adapter, monkeypatch: pytest.MonkeyPatch):
+    server = MockOPQServer(qq=10000)
+    frames = [server.group_message(100000, 200000, f'message {i}') for i in range(1, 6)]
+    processed: List[int] = []
+
+    async def process_event(bot, event):
+        # 补齐的消息处理得慢一些, 如果没有等待它们, 后面的消息就会抢先
+        await asyncio.sleep(0.05 if seq_of(event) in (2, 3) else 0)
+        processed.append(seq_of(event))
+
+    async def fetcher(bot, session, begin, end):
+        await asyncio.sleep(0.05)
+        return [frame for frame in frames if begin <= frame['CurrentPacket']['EventData']['MsgHead']['MsgSeq'] <= end]
+
+    monkeypatch.setattr(adapter_module, 'process_event', process_event)
+    adapter.gap_tracker.fetcher = fetcher
+    bot = Bot(adapter, '10000')
+
+    async def main():
+        adapter._event_handle(bot, frames[0])
+        # 2和3丢失了, 4触发补齐, 补齐期间5到达
+        adapter._event_handle(bot, frames[3])
+        await asyncio.sleep(0.01)
+        adapter._event_handle(bot, frames[4])
+        while adapter._event_tasks:
+            await asyncio.wait(set(adapter._event_tasks))
+
+    asyncio.run(main())
+    assert processed == [1, 2, 3, 4, 5]
+
+
+def test_backfill_throttled_per_session():
+    from nonebot.adapters.opqbot.gap import Gap, GapTracker
+
+    tracker = GapTracker(min_interval=1, concurrency=4)
+    fetched: List[tuple] = []
+
+    async def fetcher(bot, session, begin, end):
+        fetched.append(session)
+        await asyncio.sleep(0.05)
+        return []
+
+    tracker.fetcher = fetcher
+
+    async def main():
+        begin = time.monotonic()
+        # 不同群的缺口不互相等待min_interval
+        await asyncio.gather(*(tracker.backfill(None, Gap(('group', group), 1, 2, 0, 0)) for group in range(4)))
+        return time.monotonic() - begin
+
+    assert asyncio.run(main()) < 0.5
+    assert len(fetched) == 4
+    assert not tracker._locks
+
+
+def test_live_events_released_when_backfill_is_slow(adapter, monkeypatch: pytest.MonkeyPatch):
+    server = MockOPQServer(qq=10000)
+    frames = [server.group_message(100000, 200000, f'message {i}') for i in range(1, 6)]
+    processed: List[int] = []
+
+    async def process_event(bot, event):
+        processed.append(seq_of(event))
+
+    async def fetcher(bot, session, begin, end):
+        await asyncio.sleep(3600)
+        return []
+
+    monkeypatch.setattr(adapter_module, 'process_event', process_event)
+    adapter.opqbot_config.opqbot_backfill_hold = 0.1
+    adapter.gap_tracker.fetcher = fetcher
+    bot = Bot(adapter, '10000')
+
+    async def main():
+        adapter._event_handle(bot, frames[0])
+        adapter._event_handle(bot, frames[3])
+        await asyncio.sleep(0.01)
+        adapter._event_handle(bot, frames[4])
+        while adapter._event_tasks:
+            await asyncio.wait(set(adapter._event_tasks))
+
+    asyncio.run(asyncio.wait_for(main(), 2))
+    assert processed == [1, 4, 5]
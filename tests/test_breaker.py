@@ -0,0 +1,93 @@
+import pytest
+
+from nonebot.adapters.opqbot import breaker as breaker_module
+from nonebot.adapters.opqbot.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(breaker_module.time, 'monotonic', clock)
+    return clock
+
+
+def tripped(clock: Clock) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_rate=0.5, min_calls=4, window=30, open_seconds=10)
+    for ok in (True, False, True, False):
+        assert breaker.allow()
+        breaker.record(ok)
+    assert breaker.state == OPEN
+    return breaker
+
+
+def test_opens_at_failure_rate(clock: Clock):
+    breaker = CircuitBreaker(failure_rate=0.5, min_calls=4)
+    for ok in (False, False, True):
+        breaker.record(ok)
+    # 调用数还不够, 不计算失败率
+    assert breaker.state == CLOSED
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert breaker.trips == 1
+
+
+def test_open_rejects_then_half_open_probe_closes(clock: Clock):
+    breaker = tripped(clock)
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+    clock.now += 10
+    assert breaker.state == HALF_OPEN
+    # 半开时只放行一个探测调用
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens(clock: Clock):
+    breaker = tripped(clock)
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert breaker.trips == 2
+    assert not breaker.allow()
+
+
+def test_cancelled_probe_returns_slot(clock: Clock):
+    breaker = tripped(clock)
+    clock.now += 10
+    assert breaker.allow()
+    breaker.cancel()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+
+def test_slow_calls_count_as_failures_and_window_expires(clock: Clock):
+    breaker = CircuitBreaker(failure_rate=0.5, min_calls=2, window=30, slow_call=1)
+    breaker.record(True, 5)
+    # 窗口外的失败不再计入
+    clock.now += 31
+    breaker.record(True, 0.1)
+    breaker.record(True, 0.1)
+    assert breaker.state == CLOSED
+    breaker.record(True, 5)
+    breaker.record(True, 5)
+    assert breaker.state == OPEN
+
+
+def test_disabled_breaker_always_allows(clock: Clock):
+    breaker = CircuitBreaker(failure_rate=0)
+    for _ in range(20):
+        breaker.record(False)
+    assert breaker.allow()
+    assert breaker.state == CLOSED
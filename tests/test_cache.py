@@ -0,0 +1,92 @@
+import asyncio
+from types import SimpleNamespace
+from typing import List
+
+from nonebot.adapters.opqbot.cache import GroupCache
+from nonebot.adapters.opqbot.event.base import UserPermission
+from nonebot.adapters.opqbot.event import (
+    ON_EVENT_GROUP_EXIT,
+    ON_EVENT_GROUP_JOIN,
+    MemberCardChangeEvent,
+    MemberPermissionChangeEvent,
+    MemberSpecialTitleChangeEvent,
+)
+
+GROUP = 100000
+
+
+class MemberListBot:
+    """成员列表分两页返回, 记录拉取次数"""
+
+    def __init__(self):
+        self.calls: List[str] = []
+        self.members = [
+            {'Uin': 1, 'Uid': 'u1', 'Nick': 'one', 'GroupCard': 'card1', 'MemberFlag': 2},
+            {'Uin': 2, 'Uid': 'u2', 'Nick': 'two', 'GroupCard': '', 'MemberFlag': 0},
+            {'Uin': 3, 'Uid': 'u3', 'Nick': 'three', 'GroupCard': '', 'MemberFlag': 1},
+        ]
+
+    async def call_api(self, api: str, group: int, last_buffer: str):
+        self.calls.append(last_buffer)
+        if not last_buffer:
+            return SimpleNamespace(MemberLists=self.members[:2], LastBuffer='page2')
+        return SimpleNamespace(MemberLists=self.members[2:], LastBuffer='')
+
+
+def event_data(uid: str) -> dict:
+    return {
+        'ActorUid': '', 'ActorUidNick': '', 'GroupCode': GROUP, 'GroupName': 'group',
+        'InvitorUid': '', 'InvitorUidNick': '', 'MsgAdditional': '', 'MsgSeq': 1,
+        'MsgType': 0, 'ReqUid': uid, 'ReqUidNick': '', 'Status': 0,
+    }
+
+
+def notice(cls, uid: str, **fields):
+    return cls.parse_obj({'self_id': 10000, 'type': cls.__name__, **fields, 'member': event_data(uid)})
+
+
+def refreshed_cache(bot: MemberListBot) -> GroupCache:
+    cache = GroupCache(ttl=600)
+    asyncio.run(cache.refresh_group(bot, GROUP))
+    return cache
+
+
+def test_refresh_reads_every_page():
+    bot = MemberListBot()
+    cache = refreshed_cache(bot)
+    assert bot.calls == ['', 'page2']
+    assert cache.get_member_cached(GROUP, 1).permission == UserPermission.OWNER
+    assert cache.get_member_cached(GROUP, 3).permission == UserPermission.ADMINISTRATOR
+
+
+def test_permission_card_and_title_changes():
+    cache = refreshed_cache(MemberListBot())
+    cache.update(notice(MemberPermissionChangeEvent, 'u2', origin='MEMBER', current='ADMINISTRATOR'))
+    cache.update(notice(MemberCardChangeEvent, 'u2', origin='', current='new card'))
+    cache.update(notice(MemberSpecialTitleChangeEvent, 'u2', origin='', current='title'))
+    member = cache.get_member_cached(GROUP, 2)
+    assert member.permission == UserPermission.ADMINISTRATOR
+    assert member.card == 'new card'
+    assert member.title == 'title'
+
+
+def test_exit_removes_member_and_join_refetches():
+    bot = MemberListBot()
+    cache = refreshed_cache(bot)
+    cache.update(ON_EVENT_GROUP_EXIT.parse_obj({'self_id': 10000, 'type': 'ON_EVENT_GROUP_EXIT',
+                                                'EventData': event_data('u3')}))
+    assert cache.get_member_cached(GROUP, 3) is None
+    assert cache.get_member_cached(GROUP, 2) is not None
+
+    # 有新人入群后, 查不到的成员会触发重新拉取, 已有的成员仍然直接命中缓存
+    cache.update(ON_EVENT_GROUP_JOIN.parse_obj({'self_id': 10000, 'type': 'ON_EVENT_GROUP_JOIN',
+                                                'EventData': event_data('u4')}))
+    bot.members.append({'Uin': 4, 'Uid': 'u4', 'Nick': 'four'})
+
+    async def main():
+        assert (await cache.get_member(bot, GROUP, 2)).uin == 2
+        assert len(bot.calls) == 2
+        assert (await cache.get_member(bot, GROUP, 4)).nick == 'four'
+        assert len(bot.calls) == 4
+
+    asyncio.run(main())
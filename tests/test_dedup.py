@@ -0,0 +1,63 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from nonebot.adapters.opqbot import Bot, adapter as adapter_module
+from nonebot.adapters.opqbot.metrics import Metrics
+
+
+def notice_frame(**event_data) -> dict:
+    return {
+        'CurrentQQ': 10000,
+        'CurrentPacket': {
+            'EventName': 'ON_EVENT_GROUP_JOIN',
+            'EventData': event_data,
+        },
+    }
+
+
+def test_notice_over_two_connections_dispatched_once(adapter, monkeypatch: pytest.MonkeyPatch):
+    dispatched: List[str] = []
+
+    async def process_event(bot, event):
+        dispatched.append(event.get_event_name())
+
+    monkeypatch.setattr(adapter_module, 'process_event', process_event)
+    bot = Bot(adapter, '10000')
+    data = {'GroupCode': 100000, 'ActorUid': '200000', 'MsgSeq': 7}
+    # 两条连接推送同一个通知, 键的顺序不一定相同
+    first = notice_frame(**data)
+    second = notice_frame(**dict(reversed(list(data.items()))))
+    # 另一个人入群是不同的通知, 不能被当成重复
+    other = notice_frame(**{**data, 'ActorUid': '200001'})
+
+    async def main():
+        for frame in (first, second, other):
+            adapter._event_handle(bot, frame)
+        while adapter._event_tasks:
+            await asyncio.wait(set(adapter._event_tasks))
+
+    asyncio.run(main())
+    assert len(dispatched) == 2
+    assert adapter.deduplicator.hits == 1
+
+
+def test_duplicated_frames_still_counted_as_received(adapter, monkeypatch: pytest.MonkeyPatch):
+    async def process_event(bot, event):
+        pass
+
+    monkeypatch.setattr(adapter_module, 'process_event', process_event)
+    monkeypatch.setattr(adapter, 'metrics', Metrics())
+    bot = Bot(adapter, '10000')
+    frame = notice_frame(GroupCode=100000, ActorUid='200000', MsgSeq=8)
+
+    async def main():
+        adapter._event_handle(bot, frame)
+        adapter._event_handle(bot, frame)
+        while adapter._event_tasks:
+            await asyncio.wait(set(adapter._event_tasks))
+
+    asyncio.run(main())
+    received = adapter.metrics.snapshot()['frames_received']
+    assert received[(('event', 'ON_EVENT_GROUP_JOIN'),)] == 2
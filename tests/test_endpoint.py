@@ -0,0 +1,35 @@
+from nonebot.adapters.opqbot.endpoint import Endpoint, rank
+
+API = 'v1/LuaApiCaller'
+QUERY = (('funcname', 'MagicCgiCmd'), ('timeout', '10'), ('qq', '10000'))
+
+
+def test_route_is_built_once():
+    endpoint = Endpoint.parse('127.0.0.1:8086')
+    route = endpoint.route(API, QUERY)
+    assert str(route.url) == 'http://127.0.0.1:8086/v1/LuaApiCaller?funcname=MagicCgiCmd&timeout=10&qq=10000'
+    assert endpoint.route(API, QUERY) is route
+    assert endpoint.route(API, (('qq', '10001'),)) is not route
+
+
+def test_update_swaps_routes_without_touching_old_ones():
+    endpoint = Endpoint.parse('127.0.0.1:8086')
+    old = endpoint.route(API, QUERY)
+    endpoint.record_failure()
+    endpoint.update(host='10.0.0.2', protocol='https')
+    new = endpoint.route(API, QUERY)
+    # 已经取走旧目标的请求不受影响
+    assert str(old.url).startswith('http://127.0.0.1:8086/')
+    assert str(new.url).startswith('https://10.0.0.2:8086/')
+    assert endpoint.ws_url('ws') == 'ws://10.0.0.2:8086/ws'
+    assert endpoint.name == '10.0.0.2:8086'
+    assert endpoint.failures == 0
+
+
+def test_rank_prefers_connected_then_healthy():
+    idle, failing, fast, slow = (Endpoint.parse(f'10.0.0.{n}:8086') for n in range(1, 5))
+    for endpoint in (failing, fast, slow):
+        endpoint.connections = 1
+    failing.record_failure()
+    fast.rtt, slow.rtt = 0.01, 0.1
+    assert rank([idle, failing, slow, fast]) == [fast, slow, failing, idle]
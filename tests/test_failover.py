@@ -0,0 +1,47 @@
+import json
+import time
+import asyncio
+from typing import List
+
+from nonebot.drivers import Request, Response
+
+
+class HangingDriver:
+    """第一个端点的请求永远不返回, 其他端点立即成功"""
+
+    def __init__(self):
+        self.hosts: List[str] = []
+
+    async def request(self, request: Request) -> Response:
+        self.hosts.append(request.url.host)
+        if request.url.host == '127.0.0.1':
+            await asyncio.sleep(3600)
+        return Response(200, content=json.dumps({'CgiBaseResponse': {'Ret': 0}}).encode())
+
+
+def test_hanging_endpoint_fails_over(adapter):
+    driver = adapter.driver = HangingDriver()
+
+    async def call():
+        return await adapter._send_api_request('v1/LuaApiCaller', 'GetGroupLists', '{}', 1)
+
+    response = asyncio.run(asyncio.wait_for(call(), 2))
+    assert response.status_code == 200
+    assert driver.hosts == ['127.0.0.1', '127.0.0.2']
+    # 卡住的端点被记为失败, 下次排到后面
+    assert adapter.endpoints[0].failures == 1
+
+
+def test_hung_primary_fails_over_quickly(adapter):
+    # 默认10秒的预算下, 卡住的主端点也只等一小段时间就换到备用端点
+    driver = adapter.driver = HangingDriver()
+
+    async def call():
+        begin = time.monotonic()
+        response = await adapter._send_api_request('v1/LuaApiCaller', 'GetGroupLists', '{}', 10)
+        return response, time.monotonic() - begin
+
+    response, seconds = asyncio.run(asyncio.wait_for(call(), 5))
+    assert response.status_code == 200
+    assert driver.hosts == ['127.0.0.1', '127.0.0.2']
+    assert seconds < 1
@@ -0,0 +1,77 @@
+import copy
+from typing import Any, Dict, Iterator, Tuple
+
+import pytest
+from pydantic import BaseModel
+
+from nonebot.adapters.opqbot.event import Event
+from nonebot.adapters.opqbot.event.fast import fast_new
+from nonebot.adapters.opqbot.utils import Message_OPQBot_to_mirai
+
+pytest.importorskip('aiohttp')
+from nonebot.adapters.opqbot.mock import MockOPQServer  # noqa: E402
+
+
+def event_data(frame: Dict[str, Any]) -> Dict[str, Any]:
+    """与适配器的_event_handle一样, 把事件帧转换为Event.new的输入"""
+    data = frame['CurrentPacket']['EventData']
+    result = {
+        **data,
+        'type': frame['CurrentPacket']['EventName'],
+        'self_id': '10000',
+        'messageChain': Message_OPQBot_to_mirai(data['MsgBody']),
+    }
+    result.pop('MsgBody')
+    return result
+
+
+def payloads() -> Iterator[Tuple[str, Dict[str, Any]]]:
+    server = MockOPQServer(qq=10000)
+    group = server.group_message(100000, 200000, '/echo hello')
+    friend = server.friend_message(200001, 'hi')
+    yield 'group', group
+    yield 'friend', friend
+
+    rich = copy.deepcopy(group)
+    body = rich['CurrentPacket']['EventData']['MsgBody']
+    body['AtUinLists'] = [{'Uin': 10000, 'Nick': 'bot'}]
+    body['Images'] = [{'FileId': 1, 'FileMd5': 'md5', 'FileSize': 10, 'Url': 'http://example.com/1.png'}]
+    yield 'at and image', rich
+
+    empty = copy.deepcopy(friend)
+    empty['CurrentPacket']['EventData']['MsgBody']['Content'] = ''
+    yield 'empty content', empty
+
+    no_event = copy.deepcopy(friend)
+    del no_event['CurrentPacket']['EventData']['Event']
+    yield 'without Event', no_event
+
+    no_group = copy.deepcopy(friend)
+    del no_group['CurrentPacket']['EventData']['MsgHead']['GroupInfo']
+    yield 'without GroupInfo', no_group
+
+    extra = copy.deepcopy(group)
+    extra['CurrentPacket']['EventData']['Extra'] = {'Unknown': 1}
+    extra['CurrentPacket']['EventData']['MsgHead']['Unknown'] = 2
+    yield 'extra keys', extra
+
+
+def fields_set(model: BaseModel, path: str = '') -> Dict[str, Any]:
+    """递归收集模型及其嵌套模型的__fields_set__"""
+    result = {path: (type(model), model.__fields_set__)}
+    for name, value in model.__dict__.items():
+        if isinstance(value, BaseModel):
+            result.update(fields_set(value, f'{path}.{name}'))
+    return result
+
+
+@pytest.mark.parametrize('name, frame', list(payloads()))
+def test_fast_decode_matches_event_new(name: str, frame: Dict[str, Any]):
+    expected = Event.new(event_data(frame))
+    actual = fast_new(event_data(frame))
+    assert type(actual) is type(expected)
+    assert actual.dict() == expected.dict()
+    assert actual.dict(exclude_unset=True) == expected.dict(exclude_unset=True)
+    assert actual.json() == expected.json()
+    assert fields_set(actual) == fields_set(expected)
+    assert actual.get_plaintext() == expected.get_plaintext()
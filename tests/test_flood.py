@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+
+from nonebot.adapters.opqbot.flood import COLLAPSE, DROP, TAG, FloodControl, TokenBuckets
+
+
+def message(text: str, sender: int = 200000, group: int = 100000):
+    head = SimpleNamespace(SenderUin=sender, GroupInfo=SimpleNamespace(GroupCode=group))
+    return SimpleNamespace(MsgHead=head, text=text)
+
+
+def submit(flood: FloodControl, event, dispatch) -> bool:
+    """和适配器一样: 没超出限额或者limit要求照常派发时返回True"""
+    limited = flood.check(event)
+    if limited is None:
+        return True
+    key, wait = limited
+    return flood.limit(event, key, wait, dispatch, {'text': event.text})
+
+
+def test_token_bucket_refills():
+    buckets = TokenBuckets(rate=2, burst=2)
+    assert buckets.take(1, 0) == 0
+    assert buckets.take(1, 0) == 0
+    assert buckets.take(1, 0) == pytest.approx(0.5)
+    assert buckets.take(1, 0.5) == 0
+
+
+def test_bucket_table_is_bounded():
+    buckets = TokenBuckets(rate=1, burst=1, max_keys=2)
+    for key in (1, 2, 3):
+        buckets.take(key, 0)
+    assert len(buckets) == 2
+    # 最久没用的1被淘汰了, 重新拿到一个满的桶
+    assert buckets.take(1, 0) == 0
+
+
+def test_drop_and_tag():
+    dropped = FloodControl(user_rate=1, user_burst=1, action=DROP)
+    assert submit(dropped, message('a'), None)
+    assert not submit(dropped, message('b'), None)
+    assert dropped.stats['dropped'] == 1
+
+    tagged = FloodControl(user_rate=1, user_burst=1, action=TAG)
+    assert submit(tagged, message('a'), None)
+    event = message('b')
+    assert submit(tagged, event, None)
+    assert event._flooded
+
+
+def test_group_limit_spans_senders():
+    flood = FloodControl(group_rate=1, group_burst=2)
+    assert submit(flood, message('a', sender=1), None)
+    assert submit(flood, message('b', sender=2), None)
+    assert not submit(flood, message('c', sender=3), None)
+
+
+def test_collapse_holds_latest_then_releases():
+    flood = FloodControl(user_rate=20, user_burst=1, action=COLLAPSE)
+    released: List[SimpleNamespace] = []
+
+    async def main():
+        assert submit(flood, message('a'), released.append)
+        # 限流期间只保留最新的一条, 并记录它代表了几条消息
+        assert not submit(flood, message('b'), released.append)
+        assert not submit(flood, message('c'), released.append)
+        assert flood.held == 1
+        assert released == []
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert [event.text for event in released] == ['c']
+    assert released[0]._collapsed == 2
+    assert released[0]._flooded
+    assert flood.held == 0
+    assert flood.stats['collapsed'] == 2
+
+
+def test_clear_returns_held_frames():
+    flood = FloodControl(user_rate=0.01, user_burst=1, action=COLLAPSE)
+    released: List[SimpleNamespace] = []
+
+    async def main():
+        submit(flood, message('a'), released.append)
+        submit(flood, message('b'), released.append)
+        submit(flood, message('c', sender=200001), released.append)
+        submit(flood, message('d', sender=200001), released.append)
+        # 关闭时交还暂存的原始帧, 之后到期也不再派发
+        return flood.clear()
+
+    assert asyncio.run(main()) == [{'text': 'b'}, {'text': 'd'}]
+    assert released == []
@@ -0,0 +1,72 @@
+import pytest
+
+from nonebot.adapters.opqbot.history import HistoryRecord, MessageHistory, friend_session, group_session
+
+GROUP = group_session(100000)
+
+
+def record(seq: int, uid: int = 0) -> HistoryRecord:
+    return HistoryRecord(seq=seq, uid=uid or seq + 1000, time=seq, random=0, sender=200000,
+                         target=100000, chain=[{'type': 'Plain', 'data': {'text': f'message {seq}'}}])
+
+
+def test_ring_buffer_evicts_oldest():
+    history = MessageHistory(size=3)
+    for seq in range(1, 6):
+        history.add(GROUP, record(seq))
+    assert history.get(GROUP, seq=1) is None
+    assert history.get(GROUP, uid=1002) is None
+    assert [history.get(GROUP, seq=seq).seq for seq in (3, 4, 5)] == [3, 4, 5]
+    assert history.get(GROUP, uid=1005).seq == 5
+    assert history.latest(GROUP).seq == 5
+
+
+def test_evicting_old_record_keeps_newer_index():
+    history = MessageHistory(size=2)
+    history.add(GROUP, record(1, uid=10))
+    # 同一个序号又出现了一次(比如补齐回来的消息), 淘汰旧记录时不能删掉指向新记录的索引
+    history.add(GROUP, record(1, uid=11))
+    history.add(GROUP, record(2))
+    assert history.get(GROUP, seq=1).uid == 11
+    assert history.get(GROUP, uid=10) is None
+
+
+def test_least_recent_session_is_evicted():
+    history = MessageHistory(size=10, max_sessions=2)
+    friend, other = friend_session(1), friend_session(2)
+    history.add(GROUP, record(1))
+    history.add(friend, record(1))
+    history.add(GROUP, record(2))
+    history.add(other, record(1))
+    assert len(history) == 2
+    assert history.get(friend, seq=1) is None
+    assert history.get(GROUP, seq=2) is not None
+
+
+def test_disabled_history_records_nothing():
+    history = MessageHistory(size=0)
+    history.add(GROUP, record(1))
+    assert len(history) == 0
+
+
+def test_record_event_and_quote():
+    pytest.importorskip('aiohttp')
+    from nonebot.adapters.opqbot.event.fast import fast_new
+    from nonebot.adapters.opqbot.mock import MockOPQServer
+    from nonebot.adapters.opqbot.utils import Message_OPQBot_to_mirai
+
+    frame = MockOPQServer(qq=10000).group_message(100000, 200000, 'hello')
+    data = frame['CurrentPacket']['EventData']
+    chain = Message_OPQBot_to_mirai(data['MsgBody'])
+    event = fast_new({**data, 'type': 'ON_EVENT_GROUP_NEW_MSG', 'self_id': '10000', 'messageChain': chain})
+    history = MessageHistory()
+    history.record(event, chain)
+
+    head = data['MsgHead']
+    stored = history.get(GROUP, seq=head['MsgSeq'])
+    assert stored.reply_to() == {'MsgSeq': head['MsgSeq'], 'MsgTime': head['MsgTime'], 'MsgUid': head['MsgUid']}
+    quote = history.quote(GROUP, head['MsgSeq'])
+    assert quote.type == 'Quote'
+    assert quote.data['groupId'] == 100000
+    assert quote.data['senderId'] == 200000
+    assert history.quote(GROUP, head['MsgSeq'] + 1) is None
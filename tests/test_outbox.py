@@ -0,0 +1,143 @@
+import json
+import time
+import asyncio
+from typing import List
+
+from nonebot.drivers import Request, Response
+
+from nonebot.adapters.opqbot import Bot
+from nonebot.adapters.opqbot.message import MessageChain, MessageSegment
+from nonebot.adapters.opqbot.outbox import Outbox
+
+
+class FlakyDriver:
+    """前failures次请求返回500, 之后都成功, 记录每次请求发送的文本"""
+
+    def __init__(self, failures: int = 1):
+        self.failures = failures
+        self.sent: List[str] = []
+        self.delivered: List[str] = []
+
+    async def request(self, request: Request) -> Response:
+        text = json.loads(request.content)['CgiRequest']['Content']
+        self.sent.append(text)
+        if len(self.sent) <= self.failures:
+            return Response(500)
+        self.delivered.append(text)
+        return Response(200, content=json.dumps({
+            'CgiBaseResponse': {'Ret': 0},
+            'ResponseData': {'MsgSeq': len(self.delivered), 'MsgTime': 0},
+        }).encode())
+
+
+def test_split_parts_stay_in_order_after_failure(adapter, tmp_path):
+    driver = adapter.driver = FlakyDriver()
+    adapter.opqbot_config.opqbot_max_message_length = 5
+    bot = Bot(adapter, '10000')
+
+    async def main():
+        outbox = adapter.outbox = Outbox(str(tmp_path / 'outbox.db'), max_backoff=0.05, retry_interval=0.01)
+        await outbox.start(lambda self_id: bot)
+        try:
+            chain = MessageChain([MessageSegment.plain('aaaa bbbb cccc')])
+            # 第一部分没发出去, 整条消息交给后台重试
+            assert await bot.send_group_message(group=100000, message_chain=chain) is None
+            while outbox.pending:
+                await asyncio.sleep(0.01)
+        finally:
+            await outbox.close()
+
+    asyncio.run(asyncio.wait_for(main(), 5))
+    # 后面的部分不能抢在重试的第一部分前面
+    assert driver.sent == ['aaaa ', 'aaaa ', 'bbbb ', 'cccc']
+    assert driver.delivered == ['aaaa ', 'bbbb ', 'cccc']
+
+
+class FakeBot:
+    self_id = '10000'
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.calls: List[dict] = []
+
+    async def call_api(self, api: str, origin: dict):
+        self.calls.append(origin)
+        if len(self.calls) <= self.failures:
+            raise ConnectionError('OPQ is down')
+        return Response(200)
+
+
+def run_outbox(tmp_path, bot, body, **kwargs):
+    """启动发件箱, 执行body(outbox), 关闭后返回发件箱; bot为None时账号没有连接"""
+    outbox = Outbox(str(tmp_path / 'outbox.db'), **kwargs)
+
+    async def main():
+        await outbox.start(lambda self_id: bot)
+        try:
+            await body(outbox)
+        finally:
+            await outbox.close()
+
+    asyncio.run(asyncio.wait_for(main(), 5))
+    return outbox
+
+
+def test_dedup_key_sends_once(tmp_path):
+    bot = FakeBot()
+
+    async def body(outbox: Outbox):
+        assert await outbox.send(bot, 'api', {'n': 1}, key='reply-1') is not None
+        assert await outbox.send(bot, 'api', {'n': 2}, key='reply-1') is None
+        assert await outbox.send(bot, 'api', {'n': 3}) is not None
+
+    outbox = run_outbox(tmp_path, bot, body)
+    assert [call['n'] for call in bot.calls] == [1, 3]
+    assert outbox.stats['duplicates'] == 1
+    assert outbox.stats['delivered'] == 2
+
+
+def test_failed_send_is_retried(tmp_path):
+    bot = FakeBot(failures=2)
+
+    async def body(outbox: Outbox):
+        assert await outbox.send(bot, 'api', {'n': 1}) is None
+        assert outbox.pending == 1
+        while outbox.pending:
+            await asyncio.sleep(0.01)
+
+    outbox = run_outbox(tmp_path, bot, body, max_backoff=0.05, retry_interval=0.01)
+    assert len(bot.calls) == 3
+    assert outbox.stats['retries'] == 2
+    assert outbox.stats['delivered'] == 1
+
+
+def test_backoff_doubles_up_to_max(tmp_path):
+    bot = FakeBot(failures=10)
+    schedule: List[tuple] = []
+
+    async def body(outbox: Outbox):
+        id_ = await outbox.enqueue(bot, 'api', {'n': 1})
+        for attempts in (0, 3, 10):
+            begin = time.time()
+            assert await outbox.deliver(bot, id_, 'api', {'n': 1}, attempts) == (None, False)
+            row = await outbox._run(outbox._execute, 'SELECT attempts, next_try FROM outbox WHERE id = ?', (id_,))
+            schedule.append((row[0][0], round(row[0][1] - begin)))
+
+    # 重试间隔从1秒开始翻倍, 不超过max_backoff; 后台重试间隔很长, 不会打扰
+    run_outbox(tmp_path, bot, body, max_backoff=60, retry_interval=3600)
+    assert schedule == [(1, 1), (4, 8), (11, 60)]
+
+
+def test_expired_messages_are_dropped(tmp_path):
+    bot = FakeBot()
+
+    async def body(outbox: Outbox):
+        # 账号没有连接, 消息一直发不出去, 直到过期
+        await outbox.enqueue(bot, 'api', {'n': 1})
+        assert outbox.pending == 1
+        while outbox.pending:
+            await asyncio.sleep(0.01)
+
+    outbox = run_outbox(tmp_path, None, body, ttl=0.05, retry_interval=0.01)
+    assert outbox.stats['expired'] == 1
+    assert bot.calls == []
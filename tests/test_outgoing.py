@@ -0,0 +1,130 @@
+import asyncio
+from typing import List
+
+from nonebot.adapters.opqbot.message import MessageChain, MessageSegment
+from nonebot.adapters.opqbot.outgoing import Coalescer, split_chain
+
+
+def plain(text: str) -> MessageChain:
+    return MessageChain([MessageSegment.plain(text)])
+
+
+def texts(chain: MessageChain) -> str:
+    return ''.join(segment.data.get('text', '') for segment in chain)
+
+
+def image() -> MessageSegment:
+    return MessageSegment.image(url='http://example.com/a.png')
+
+
+def test_split_without_limits_keeps_chain():
+    chain = plain('x' * 10000)
+    assert split_chain(chain) == [chain]
+
+
+def test_split_prefers_newline_then_whitespace():
+    parts = split_chain(plain('hello\nworld foo'), max_length=8)
+    assert [texts(part) for part in parts] == ['hello\n', 'world ', 'foo']
+
+
+def test_split_hard_cut_without_whitespace():
+    parts = split_chain(plain('abcdefghij'), max_length=4)
+    assert [texts(part) for part in parts] == ['abcd', 'efgh', 'ij']
+
+
+def test_split_does_not_break_words_or_segments():
+    # 当前这条已经有内容时, 不在单词中间断开, 另起一条
+    parts = split_chain(MessageChain([MessageSegment.plain('ab '), MessageSegment.plain('cdefg')]), max_length=6)
+    assert [texts(part) for part in parts] == ['ab ', 'cdefg']
+    # At不会被拆开, 放不下时整个移到下一条
+    parts = split_chain(MessageChain([MessageSegment.plain('abcd'), MessageSegment.at(10001)]), max_length=4)
+    assert [[segment.type for segment in part] for part in parts] == [['Plain'], ['At']]
+
+
+def test_split_image_limit():
+    chain = MessageChain([MessageSegment.plain('look'), *(image() for _ in range(5))])
+    parts = split_chain(chain, max_images=2)
+    assert [sum(segment.type == 'Image' for segment in part) for part in parts] == [2, 2, 1]
+    assert texts(parts[0]) == 'look'
+
+
+def test_coalesce_within_window():
+    coalescer = Coalescer(window=0.05)
+    sent: List[tuple] = []
+
+    def sender_for(target):
+        async def sender(chain: MessageChain):
+            sent.append((target, texts(chain)))
+            return len(sent)
+        return sender
+
+    async def main():
+        group, friend = sender_for('group'), sender_for('friend')
+        return await asyncio.gather(
+            coalescer.submit('group', plain('a'), group),
+            coalescer.submit('friend', plain('x'), friend),
+            coalescer.submit('group', plain('b'), group),
+        )
+
+    results = asyncio.run(asyncio.wait_for(main(), 1))
+    assert sorted(sent) == [('friend', 'x'), ('group', 'a\nb')]
+    # 合并在一起的调用方拿到同一个返回值
+    assert results[0] == results[2]
+    assert coalescer.stats == {'submitted': 3, 'sent': 2}
+
+
+def test_coalesce_overflow_starts_new_batch():
+    coalescer = Coalescer(window=0.05, max_length=5)
+    sent: List[str] = []
+
+    async def sender(chain: MessageChain):
+        sent.append(texts(chain))
+
+    async def main():
+        await asyncio.gather(*(coalescer.submit('group', plain(text), sender) for text in ('abc', 'de', 'f')))
+
+    asyncio.run(asyncio.wait_for(main(), 1))
+    assert sent == ['abc', 'de\nf']
+
+
+def test_no_coalesce_bypasses_window_after_pending():
+    coalescer = Coalescer(window=3600)
+    sent: List[str] = []
+
+    async def sender(chain: MessageChain):
+        sent.append(texts(chain))
+
+    async def main():
+        waiting = asyncio.create_task(coalescer.submit('group', plain('a'), sender))
+        await asyncio.sleep(0)
+        # 不参与合并的消息不等窗口到期, 但要排在之前攒下的后面
+        await coalescer.submit('group', plain('b'), sender, coalesce=False)
+        await waiting
+
+    asyncio.run(asyncio.wait_for(main(), 1))
+    assert sent == ['a', 'b']
+
+
+def test_close_flushes_pending_batches():
+    coalescer = Coalescer(window=3600)
+    sent: List[str] = []
+
+    async def sender(chain: MessageChain):
+        sent.append(texts(chain))
+        return len(sent)
+
+    async def main():
+        waiting = [asyncio.create_task(coalescer.submit('group', plain(text), sender)) for text in 'ab']
+        await asyncio.sleep(0)
+        # 合并窗口还远没有到期, 关闭时也要立即发出去
+        tasks = coalescer.close()
+        assert tasks
+        await asyncio.wait(tasks)
+        results = await asyncio.gather(*waiting)
+        # 关闭之后的消息直接发送, 不再等待合并
+        results.append(await coalescer.submit('group', plain('c'), sender))
+        return results
+
+    assert asyncio.run(asyncio.wait_for(main(), 1)) == [1, 1, 2]
+    assert sent == ['a\nb', 'c']
+    assert not coalescer._tasks
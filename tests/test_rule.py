@@ -0,0 +1,25 @@
+from nonebot.adapters.opqbot.rule import CommandTrie
+
+
+def test_command_needs_whitespace_or_end():
+    trie = CommandTrie(('/', ''))
+    for cmd in ('help', 'helper', 'echo'):
+        trie.add(cmd)
+    assert trie.match('/help') == {'help'}
+    assert trie.match('/help me') == {'help'}
+    assert trie.match('/helper x') == {'helper'}
+    # 和force_whitespace=True一样, 命令后面紧跟参数不算命中
+    assert trie.match('/helpme') == frozenset()
+    assert trie.match('echo\nhi') == {'echo'}
+    assert trie.match('say /echo') == frozenset()
+
+
+def test_version_bumps_only_for_new_commands():
+    trie = CommandTrie()
+    trie.add('help')
+    version = trie.version
+    trie.add('help')
+    assert trie.version == version
+    trie.add('ping')
+    assert trie.version == version + 1
+    assert len(trie) == 2 and 'ping' in trie
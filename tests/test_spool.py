@@ -0,0 +1,71 @@
+import json
+import asyncio
+from typing import List
+
+import pytest
+
+from nonebot.adapters.opqbot import adapter as adapter_module
+
+
+def notice_frame(seq: int) -> dict:
+    return {
+        'CurrentQQ': 10000,
+        'CurrentPacket': {
+            'EventName': 'ON_EVENT_GROUP_JOIN',
+            'EventData': {'GroupCode': 100000, 'ActorUid': '200000', 'MsgSeq': seq},
+        },
+    }
+
+
+def test_replay_skips_corrupt_lines(adapter, tmp_path, monkeypatch: pytest.MonkeyPatch):
+    path = tmp_path / 'spool.jsonl'
+    path.write_bytes(
+        json.dumps(notice_frame(1)).encode() + b'\n'
+        + b'\xff\xfe not utf-8\n'
+        + b'{"half written\n'
+        + json.dumps(notice_frame(2)).encode() + b'\n'
+    )
+    adapter.opqbot_config.opqbot_spool_path = str(path)
+    dispatched: List[int] = []
+
+    async def process_event(bot, event):
+        dispatched.append(event.MsgSeq)
+
+    monkeypatch.setattr(adapter_module, 'process_event', process_event)
+
+    ws = object()
+
+    async def main():
+        adapter._attach('10000', ws)
+        try:
+            await asyncio.gather(*adapter.tasks)
+            while adapter._event_tasks:
+                await asyncio.wait(set(adapter._event_tasks))
+            assert '10000' in adapter.connections
+        finally:
+            adapter._detach('10000', ws)
+
+    asyncio.run(main())
+    assert sorted(dispatched) == [1, 2]
+    assert not path.exists()
+    assert not (tmp_path / 'spool.jsonl.replay').exists()
+
+
+def test_unreadable_spool_does_not_break_connection(adapter, tmp_path):
+    # 路径是个目录, 改名或者打开都会出错
+    path = tmp_path / 'spool'
+    path.mkdir()
+    (path / 'x').write_text('')
+    adapter.opqbot_config.opqbot_spool_path = str(path)
+
+    ws = object()
+
+    async def main():
+        adapter._attach('10000', ws)
+        try:
+            await asyncio.gather(*adapter.tasks)
+            assert '10000' in adapter.connections
+        finally:
+            adapter._detach('10000', ws)
+
+    asyncio.run(main())
@@ -0,0 +1,21 @@
+import json
+import asyncio
+
+from nonebot.adapters.opqbot.trace import Tracer
+
+
+def test_finish_writes_in_background(tmp_path):
+    path = tmp_path / 'trace.jsonl'
+
+    async def main():
+        tracer = Tracer(enabled=True, threshold=0, path=str(path))
+        for _ in range(3):
+            tracer.finish(tracer.begin())
+        # finish只放进缓冲区, 不在事件循环里写文件
+        assert not path.exists()
+        await tracer.close()
+
+    asyncio.run(main())
+    records = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert len(records) == 3
+    assert all(record['spans'][0]['name'] == 'frame' for record in records)